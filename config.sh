@@ -38,6 +38,22 @@ trimmomatic='trimmomatic'
 # it more accurate (though slower).
 MafftArgsForPairwise='--maxiterate 1000 --localpair'
 
+# The number of threads (processor cores) shiver may use. It is passed to each
+# program shiver runs that can use more than one, with that program's own
+# option: trimmomatic, the mapper (smalt, bwa mem or bowtie2, and bowtie2-build),
+# blastn, samtools (converting and sorting the mapped reads), mafft, and the
+# calculation of base frequencies directly from the bam file. To give one of
+# these a different number, set its variable (NumThreadsTrimmomatic below, the
+# four here, or NumThreadsBaseFreqs below); leave it empty to use NumThreads.
+# Each is the total number of threads the program uses (samtools' -@ option,
+# for example, is given one fewer, as it counts threads in addition to the
+# main one).
+NumThreads=1
+NumThreadsMapper=''
+NumThreadsBlast=''
+NumThreadsSamtools=''
+NumThreadsMafft=''
+
 # Minimum contig length: contigs shorter than this will be discarded at the
 # start. In addition, when contigs are blasted against the existing reference 
 # set, we will only keep hits for which the length of the hit multipled by its 
@@ -100,8 +116,9 @@ TrimReadsForAdaptersAndQual=true
 IlluminaClipParams='2:10:7:1:true'
 BaseQualityParams='MINLEN:50 LEADING:20 TRAILING:20 SLIDINGWINDOW:4:20'
 # How many threads Trimmomatic should use (it sometimes multithreads unless told
-# not to, which can be problematic on clusters).
-NumThreadsTrimmomatic=1
+# not to, which can be problematic on clusters). Leave empty to use NumThreads
+# (below).
+NumThreadsTrimmomatic=
 
 # Shall we trim exact matches to PCR primers from the end of reads using fastaq?
 TrimReadsForPrimers=true
@@ -111,6 +128,36 @@ TrimPrimerWithOneSNP=false
 
 # Shall we clean (remove read pairs that look like contaminants)?
 CleanReads=true
+# How to find the contaminant reads: "blast" blasts every read against the
+# reference and the contaminant contigs; "kmers" instead assigns each read to
+# whichever of those it shares the most k-mers (words of length
+# CleaningKmerLength) with, requiring at least CleaningMinSharedKmers of them,
+# which is much faster. The same rules decide which read pairs are contaminant.
+ReadCleaningMethod="blast"
+CleaningKmerLength=21
+CleaningMinSharedKmers=2
+# When blasting the reads for cleaning, shall we blast each distinct read
+# sequence only once? Reads with the same sequence are given the same blast hit.
+# This saves time in proportion to how many reads are duplicates of others,
+# which is typically a large fraction for amplicon data.
+# It needs memory for the name of each distinct read sequence (and a 16-byte
+# digest of it), and for the name of each duplicate read.
+BlastDistinctReadSeqsOnly=true
+# Shall we map the reads before cleaning them, then look for contaminants (as
+# above) only among the reads that map poorly, removing them from the bam file
+# before it is processed? Reads that map well to the reference are assumed not
+# to be contaminants, which saves checking the large majority of the reads. A
+# read maps poorly if it is unmapped, agrees with the reference at less than a
+# fraction ScreenReadsBelowIdentity of its bases, or has more than a fraction
+# ScreenReadsClippedFrac of its length clipped; for paired reads, both reads of
+# a pair are checked if either maps poorly, or if only one of them is in the bam
+# file. Note that reads excluded from the bam file by samtoolsReadFlags below
+# (with the default, unmapped reads and improperly paired reads) are therefore
+# always checked; they do not contribute to the consensus, but if remapping,
+# their removal from the reads used for remapping depends on this check.
+CleanAfterMapping=false
+ScreenReadsBelowIdentity=0.9
+ScreenReadsClippedFrac=0.2
 
 # Which mapper to use? "smalt", "bwa" or "bowtie"? You can ignore the options
 # for a mapper you're not using, and it doesn't need to be installed.
@@ -166,6 +213,34 @@ bwaOptions='-v 2'
 # aligned pairs are kept (-f 3). The '-f 3' should be removed for unpaired data.
 samtoolsReadFlags='-f 3 -F 4'
 
+# Whether to pipe the mapper's output straight through the conversion to a
+# sorted bam file (samtools view, sort by name, fixmate, sort by coordinate),
+# passing uncompressed data between the steps, instead of writing the sam file
+# and a compressed bam file after each step. The memory per thread used by each
+# samtools sort is set below (it is used by both sorts at once when reads are
+# paired); the number of threads is NumThreadsSamtools.
+StreamSamToBam=true
+SamtoolsSortMemPerThread='768M'
+
+# The number of shards to split the reads into for mapping. With a value greater
+# than 1, the reads (keeping pairs together) are dealt out into this many
+# separate files, which are mapped concurrently against the same index of the
+# reference, and the resulting sorted bam files are merged with samtools merge.
+# This helps mappers that don't make good use of multiple threads themselves,
+# such as smalt. Each shard's mapper uses NumThreadsMapper threads.
+NumMappingShards=1
+
+# A directory in which to cache the indexes of mapping references (made by
+# smalt, bwa or bowtie2), the pairwise alignments of the mapping reference to
+# HXB2 (made by mafft) and the BLAST databases made in shiver_map_reads.sh, so
+# that they are reused instead of rebuilt whenever the same input file contents
+# are processed with the same command options, e.g. for another sample or for a
+# reanalysis using the same reference. Leave empty to disable caching. The cache
+# can be shared between runs; when its total size exceeds CacheMaxSizeMB
+# megabytes, the least recently used entries are deleted.
+CacheDir=''
+CacheMaxSizeMB=2000
+
 # See http://www.htslib.org/doc/samtools.html for a description of samtools
 # mpileup options. Those used below mean that: the base alignment quality ('BAQ')
 # calculation (described at https://dx.doi.org/10.1093%2Fbioinformatics%2Fbtr076)
@@ -183,6 +258,27 @@ samtoolsReadFlags='-f 3 -F 4'
 # generally undesirable).
 mpileupOptions='--no-BAQ --min-BQ 5 --max-depth 1000000'
 
+# Whether to calculate base frequencies directly from the bam file, with
+# tools/GetBaseFreqsFromBamFile.py (which requires the python module pysam),
+# instead of writing a pileup file with samtools mpileup and then analysing it.
+# This avoids the pileup file, which can be very large for deep sequencing. The
+# mpileupOptions above are used in the same way, except that the --max-depth
+# limit is not applied, and they must include --no-BAQ. The base frequencies are
+# the same as those from samtools 1.6 (the version in shiver's docker image);
+# other versions of samtools may differ slightly in how they handle overlapping
+# read pairs.
+BaseFreqsFromBam=false
+# With BaseFreqsFromBam=true, the number of processes to use for calculating
+# base frequencies: the reference is split into windows that are processed in
+# parallel. Leave empty to use NumThreads (below).
+NumThreadsBaseFreqs=
+
+# Whether to count the reads in the bam file and calculate their insert size
+# distribution with tools/GetBamReadStats.py (which requires the python module
+# pysam), taking the read count from the bam index and reading the bam once,
+# instead of converting the whole bam file to text with samtools view twice.
+BamStatsWithPysam=false
+
 # Parameters for calling the consensus base at each position:
 # The minimum coverage (number of reads) to call a base instead of a '?'
 MinCov1=15
@@ -244,6 +340,14 @@ AlignContigsToConsensus=false
 # filenames - handy if you want to keep them. (By request of shiver-pro Tanya!)
 KeepPreMappingReads=false
 
+# Whether shiver_map_reads.sh should record the wall time, CPU time, peak memory
+# and input and output file sizes of every program and python script it runs
+# (including those run for mapping and for processing the bam files), writing
+# them to a json file ending in the TimingsSuffix below, and printing a summary
+# table at the end of the run. Each program is run through
+# tools/RecordResourceUse.py, which adds a small overhead to each call.
+RecordTimings=false
+
 # Finally, these two options are only needed for the deprecated 'fully automatic'
 # version of shiver (bin/deprecated/shiver_full_auto.sh): the maximum allowed
 # percentage of gaps inside contigs when aligned to their closest reference (too
@@ -263,6 +367,7 @@ BaseFreqsSuffix='_BaseFreqs.csv'
 BaseFreqsWGlobalSuffix='_BaseFreqs_ForGlobalAln.csv'
 BaseFreqsWHXB2Suffix='_BaseFreqs_WithHXB2.csv'
 InsertSizeCountsSuffix='_InsertSizeCounts.csv'
+TimingsSuffix='_timings.json'
 CoordsDictSuffix='_coords.csv'
 BlastSuffix='.blast'
 MergedBlastSuffix='_MergedHits.blast'
@@ -280,6 +385,7 @@ TempContigAlignment1='temp_HIVcontigs_wRefs_MafftAdd.fasta'
 TempContigAlignment2='temp_HIVcontigs_wRefs_MafftAddFrags.fasta'
 TempContigAlignment3='temp_HIVcontigs_wRefs_3.fasta'
 TempRefAlignment='temp_RefAlignment.fasta'
+TimingRecords='temp_TimingRecords.jsonl'
 GappyRefWithExtraSeq='temp_GappyRefWithExtraSeq.fasta'
 FlattenedContigs='temp_FlattenedContigs.fasta'
 AllContigsList='temp_AllContigsList.txt'
@@ -297,15 +403,23 @@ AllSeqsInAln='temp_AllSeqsInAln.txt'
 reads1asFasta='temp_reads1.fasta'
 reads2asFasta='temp_reads2.fasta'
 reads1blast1='temp_reads1_1.blast'
-reads2blast1='temp_reads2_1.blast'
 reads1blast2='temp_reads1_2.blast'
-reads2blast2='temp_reads2_2.blast'
+reads1blastPipe='temp_reads1_blast.pipe'
+reads2blastPipe='temp_reads2_blast.pipe'
+reads1duplicates='temp_reads1_duplicates.csv'
+reads2duplicates='temp_reads2_duplicates.csv'
+WellMappedReadNames='temp_WellMappedReads.txt'
+SuspiciousReadsBaseName='temp_SuspiciousReads'
+ScreenedBam='temp_Screened.bam'
+ScreenedReads1='temp_ScreenedReads_1.fastq'
+ScreenedReads2='temp_ScreenedReads_2.fastq'
 reads1sorted='temp_1_sorted.fastq'
 reads2sorted='temp_2_sorted.fastq'
 MapOutAsSam='temp_MapOut.sam'
 MapOutConversion1='temp_MapOutStep1'
 MapOutConversion2='temp_MapOutStep2'
 MapOutConversion3='temp_MapOutStep3'
+MappingShardStem='temp_MappingShard'
 InsertSizes1='temp_InsertSizes.txt'
 InsertSizes2='temp_InsertSizes2.txt'
 PileupFile='temp_MapOut.pileup'
@@ -12,32 +12,12 @@ else
     source /shiver/pipeline.conf
 fi
 
-# copy shiver config:
-if [ -z ${ShiverConfig+x} ]
-then
-    printf "Shiver config file is not found, using the default one\n"
-    SIVERCONFIGPATH="/shiver/config.sh"
-else
-    printf "Shiver config file found, using the given one\n"
-    SIVERCONFIGPATH="/data/$ShiverConfig"
-fi
-
-LOGFILE="/data/$Prefix.log"
-
-# check if pipeline mode is Paired or Unpaired
-if [ -z ${ReverseReads+x} ]
-then 
-    printf "ReverseReads argument not found in pipeline.conf, mode set to Unpaired" | tee -a $LOGFILE
-    Paired=false
-    if [ -z ${ForwardReads+x} ]
-    then
-        printf "ForwardReads argument not found in pipeline.conf. Exit run" | tee -a $LOGFILE
-        exit 2
-    fi
-else
-    printf "ReverseReads argument found in pipeline.conf, mode set to Paired" | tee -a $LOGFILE
-    Paired=true
-fi
+# The scratch directory for this run, and the one holding the output of
+# shiver_init. They are the same unless set by the batch command, which runs
+# shiver_init once for all its samples and gives each worker its own scratch.
+TmpDir=${PIPELINE_TMPDIR:-/data_tmp}
+InitTmpDir=${PIPELINE_INITDIR:-$TmpDir}
+ShiverConfigCopy=${PIPELINE_SHIVER_CONFIG:-$InitTmpDir/config.sh}
 
 function usage {
     echo "SHIVER pipeline"
@@ -66,8 +46,25 @@ function usage {
     echo "    drug_resistance:"
     echo "        Run drug_resistance"
     echo ""
+    echo "    reconsensus:"
+    echo "        Call the consensuses again from the base frequencies of a previous"
+    echo "        map_reads run, with MinCov1, MinCov2 and MinBaseFrac from the shiver"
+    echo "        config, then redo the global alignment and drug resistance outputs"
+    echo ""
+    echo "    batch:"
+    echo "        Run the full pipeline for every sample in a sample sheet (--sample-sheet,"
+    echo "        or SampleSheet in pipeline.conf): one line per sample of"
+    echo "        SampleID,ForwardReads,ReverseReads[,Contigs]. shiver_init is run once,"
+    echo "        and the samples are run in parallel within the BatchCPUs and"
+    echo "        BatchMemoryGB budgets, using CPUsPerSample and MemoryGBPerSample each."
+    echo "        Each sample's log is <SampleID>.log."
+    echo ""
     echo "    full:"
-    echo "        Run full pipeleine"
+    echo "        Run full pipeleine. Each stage (${Stages[*]})"
+    echo "        records its inputs, config and outputs in <Prefix>_checkpoints, and is"
+    echo "        skipped on a rerun if none of them has changed. Options:"
+    echo "        --from-stage <stage>: start from this stage, always rerunning it"
+    echo "        --to-stage <stage>: stop after this stage"
     echo ""
     echo ""
 }
@@ -85,43 +82,46 @@ function de_novo_assembly {
     # run de novo assembly algorithm
     if [ $Paired = true ]; then 
         printf "\n========== start IVA ==========\n" 2>&1 | tee -a $LOGFILE
-        cd /data_tmp
+        cd $TmpDir
         # reads_1.fastq
         if [[ /data/$ForwardReads == *.gz ]]
         then
-            cp /data/$ForwardReads /data_tmp/reads_1.fastq.gz 2>&1 | tee -a $LOGFILE
+            cp /data/$ForwardReads $TmpDir/reads_1.fastq.gz 2>&1 | tee -a $LOGFILE
         else
-            cp /data/$ForwardReads /data_tmp/reads_1.fastq 2>&1 | tee -a $LOGFILE
-            gzip /data_tmp/reads_1.fastq 2>&1 | tee -a $LOGFILE
+            cp /data/$ForwardReads $TmpDir/reads_1.fastq 2>&1 | tee -a $LOGFILE
+            gzip $TmpDir/reads_1.fastq 2>&1 | tee -a $LOGFILE
         fi
         # reads_2.fastq
         if [[ /data/$ReverseReads == *.gz ]]
         then
-            cp /data/$ReverseReads /data_tmp/reads_2.fastq.gz 2>&1 | tee -a $LOGFILE
+            cp /data/$ReverseReads $TmpDir/reads_2.fastq.gz 2>&1 | tee -a $LOGFILE
         else
-            cp /data/$ReverseReads /data_tmp/reads_2.fastq 2>&1 | tee -a $LOGFILE
-            gzip /data_tmp/reads_2.fastq 2>&1 | tee -a $LOGFILE
+            cp /data/$ReverseReads $TmpDir/reads_2.fastq 2>&1 | tee -a $LOGFILE
+            gzip $TmpDir/reads_2.fastq 2>&1 | tee -a $LOGFILE
         fi
-        #python3 /usr/bin/spades.py --isolate -1 reads_1.fastq.gz -2 reads_2.fastq.gz -o /data_tmp/SPADESout | tee -a $LOGFILE
-        #cp /data_tmp/SPADESout/contigs.fasta /data/${Prefix}_DeNovoContigs.fasta 2>&1 | tee -a $LOGFILE
-        iva -vv --seed_stop_length 400 -f reads_1.fastq.gz -r reads_2.fastq.gz /data_tmp/IVAout 2>&1 | tee -a $LOGFILE
-        cp /data_tmp/IVAout/contigs.fasta /data/${Prefix}_DeNovoContigs.fasta 2>&1 | tee -a $LOGFILE
+        #python3 /usr/bin/spades.py --isolate -1 reads_1.fastq.gz -2 reads_2.fastq.gz -o $TmpDir/SPADESout | tee -a $LOGFILE
+        #cp $TmpDir/SPADESout/contigs.fasta /data/${Prefix}_DeNovoContigs.fasta 2>&1 | tee -a $LOGFILE
+        timed iva -vv --seed_stop_length 400 -f reads_1.fastq.gz -r reads_2.fastq.gz $TmpDir/IVAout 2>&1 | tee -a $LOGFILE
+        cp $TmpDir/IVAout/contigs.fasta /data/${Prefix}_DeNovoContigs.fasta 2>&1 | tee -a $LOGFILE
+        StageStatus=$?
         printf "\n========== IVA finished ==========\n" 2>&1 | tee -a $LOGFILE
     else
         printf "\n========== start spades ==========\n" 2>&1 | tee -a $LOGFILE
-        cd /data_tmp
+        cd $TmpDir
         # reads_1.fastq
         if [[ /data/$ForwardReads == *.gz ]]
         then
-            cp /data/$ForwardReads /data_tmp/reads_1.fastq.gz 2>&1 | tee -a $LOGFILE
+            cp /data/$ForwardReads $TmpDir/reads_1.fastq.gz 2>&1 | tee -a $LOGFILE
         else
-            cp /data/$ForwardReads /data_tmp/reads_1.fastq 2>&1 | tee -a $LOGFILE
-            gzip /data_tmp/reads_1.fastq 2>&1 | tee -a $LOGFILE
+            cp /data/$ForwardReads $TmpDir/reads_1.fastq 2>&1 | tee -a $LOGFILE
+            gzip $TmpDir/reads_1.fastq 2>&1 | tee -a $LOGFILE
         fi
-        python3 /usr/bin/spades.py --isolate -s reads_1.fastq.gz -o /data_tmp/SPADESout | tee -a $LOGFILE
-        cp /data_tmp/SPADESout/contigs.fasta /data/${Prefix}_DeNovoContigs.fasta 2>&1 | tee -a $LOGFILE
+        timed python3 /usr/bin/spades.py --isolate -s reads_1.fastq.gz -o $TmpDir/SPADESout | tee -a $LOGFILE
+        cp $TmpDir/SPADESout/contigs.fasta /data/${Prefix}_DeNovoContigs.fasta 2>&1 | tee -a $LOGFILE
+        StageStatus=$?
         printf "\n========== spades finished ==========\n" 2>&1 | tee -a $LOGFILE
     fi
+    return $StageStatus
 }
 
 function shiver_init {
@@ -131,14 +131,16 @@ function shiver_init {
     if [ -f $SIVERCONFIGPATH ]; then printf ""; else printf "error: file not found $SIVERCONFIGPATH\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
     if [ -f /data/$RefAlignment ]; then printf ""; else printf "error: file not found $RefAlignment\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
     printf "\n========== start shiver_init.sh ==========\n" 2>&1 | tee -a $LOGFILE
-    cd /data_tmp
+    cd $InitTmpDir
     mkdir ShiverInitDir 2>&1 | tee -a $LOGFILE
-    cp $SIVERCONFIGPATH /data_tmp/config.sh 2>&1 | tee -a $LOGFILE
-    cp /data/$RefAlignment /data_tmp/RefAlignment.fasta 2>&1 | tee -a $LOGFILE
-    cp /data/$Adapters /data_tmp/Adapters.fasta 2>&1 | tee -a $LOGFILE
-    cp /data/$Primers /data_tmp/Primers.fasta 2>&1 | tee -a $LOGFILE
-    bash /shiver/shiver_init.sh /data_tmp/ShiverInitDir /data_tmp/config.sh /data_tmp/RefAlignment.fasta /data_tmp/Adapters.fasta /data_tmp/Primers.fasta 2>&1 | tee -a $LOGFILE
+    cp $SIVERCONFIGPATH $InitTmpDir/config.sh 2>&1 | tee -a $LOGFILE
+    cp /data/$RefAlignment $InitTmpDir/RefAlignment.fasta 2>&1 | tee -a $LOGFILE
+    cp /data/$Adapters $InitTmpDir/Adapters.fasta 2>&1 | tee -a $LOGFILE
+    cp /data/$Primers $InitTmpDir/Primers.fasta 2>&1 | tee -a $LOGFILE
+    timed bash /shiver/shiver_init.sh $InitTmpDir/ShiverInitDir $InitTmpDir/config.sh $InitTmpDir/RefAlignment.fasta $InitTmpDir/Adapters.fasta $InitTmpDir/Primers.fasta 2>&1 | tee -a $LOGFILE
+    StageStatus=$?
     printf "\n========== shiver shiver_init.sh ==========\n" 2>&1 | tee -a $LOGFILE
+    return $StageStatus
 }
 
 function shiver_align_contigs {
@@ -148,14 +150,16 @@ function shiver_align_contigs {
     if [ -f $SIVERCONFIGPATH ]; then printf ""; else printf "error: file not found $SIVERCONFIGPATH\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
     if [ -f /data/$RefAlignment ]; then printf ""; else printf "error: file not found $RefAlignment\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
     printf "\n========== start shiver_align_contigs.sh ==========\n" 2>&1 | tee -a $LOGFILE
-    cd /data_tmp
+    cd $TmpDir
     # Contigs.fasta
     if [ -f /data/${Prefix}_DeNovoContigs.fasta ]; then printf ""; else printf "error: file not found ${Prefix}_DeNovoContigs.fasta\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
-    cp /data/${Prefix}_DeNovoContigs.fasta /data_tmp/Contigs.fasta 2>&1 | tee -a $LOGFILE
+    cp /data/${Prefix}_DeNovoContigs.fasta $TmpDir/Contigs.fasta 2>&1 | tee -a $LOGFILE
     # run
-    bash /shiver/shiver_align_contigs.sh /data_tmp/ShiverInitDir /data_tmp/config.sh /data_tmp/Contigs.fasta $Prefix 2>&1 | tee -a $LOGFILE
+    timed bash /shiver/shiver_align_contigs.sh $InitTmpDir/ShiverInitDir $ShiverConfigCopy $TmpDir/Contigs.fasta $Prefix 2>&1 | tee -a $LOGFILE
+    StageStatus=$?
     printf "\n========== stop shiver_align_contigs.sh ==========\n" 2>&1 | tee -a $LOGFILE
-    cp /data_tmp/${Prefix}* /data/.
+    cp $TmpDir/${Prefix}* /data/.
+    return $StageStatus
 }
 
 function shiver_map_reads {
@@ -167,58 +171,335 @@ function shiver_map_reads {
         printf "cut_wRefs file was not  generated by Shiver, using ${Prefix}_raw_wRefs.fasta as ${Prefix}_cut_wRefs.fasta\n" 2>&1 | tee -a $LOGFILE
         cp /data/${Prefix}_raw_wRefs.fasta /data/${Prefix}_cut_wRefs.fasta 2>&1 | tee -a $LOGFILE
     fi
-    mkdir /data_tmp/tmp 2>&1 | tee -a $LOGFILE
-    cd /data_tmp
+    mkdir $TmpDir/tmp 2>&1 | tee -a $LOGFILE
+    cd $TmpDir
     # reads_1.fastq
     if [[ /data/$ForwardReads == *.gz ]]
     then
-        cp /data/$ForwardReads /data_tmp/reads_1.fastq.gz 2>&1 | tee -a $LOGFILE
+        cp /data/$ForwardReads $TmpDir/reads_1.fastq.gz 2>&1 | tee -a $LOGFILE
         gunzip reads_1.fastq.gz 2>&1 | tee -a $LOGFILE
     else
-        cp /data/$ForwardReads /data_tmp/reads_1.fastq 2>&1 | tee -a $LOGFILE
+        cp /data/$ForwardReads $TmpDir/reads_1.fastq 2>&1 | tee -a $LOGFILE
     fi
-    awk '{if (NR%4 == 1) {print $1 "/1"} else print}' /data_tmp/reads_1.fastq > /data_tmp/reads_1.fastq_tmp 2>&1 | tee -a $LOGFILE
-    rm /data_tmp/reads_1.fastq 2>&1 | tee -a $LOGFILE
-    mv /data_tmp/reads_1.fastq_tmp /data_tmp/tmp/reads_1_tmp.fastq 2>&1 | tee -a $LOGFILE
+    awk '{if (NR%4 == 1) {print $1 "/1"} else print}' $TmpDir/reads_1.fastq > $TmpDir/reads_1.fastq_tmp 2>&1 | tee -a $LOGFILE
+    rm $TmpDir/reads_1.fastq 2>&1 | tee -a $LOGFILE
+    mv $TmpDir/reads_1.fastq_tmp $TmpDir/tmp/reads_1_tmp.fastq 2>&1 | tee -a $LOGFILE
     if [ $Paired = true ]; then
         # reads_2.fastq
         if [[ /data/$ReverseReads == *.gz ]]
         then
-            cp /data/$ReverseReads /data_tmp/reads_2.fastq.gz 2>&1 | tee -a $LOGFILE
+            cp /data/$ReverseReads $TmpDir/reads_2.fastq.gz 2>&1 | tee -a $LOGFILE
             gunzip reads_2.fastq.gz 2>&1 | tee -a $LOGFILE
         else
-            cp /data/$ReverseReads /data_tmp/reads_2.fastq 2>&1 | tee -a $LOGFILE
+            cp /data/$ReverseReads $TmpDir/reads_2.fastq 2>&1 | tee -a $LOGFILE
         fi
-        awk '{if (NR%4 == 1) {print $1 "/2"} else print}' /data_tmp/reads_2.fastq > /data_tmp/reads_2.fastq_tmp 2>&1 | tee -a $LOGFILE
-        rm /data_tmp/reads_2.fastq 2>&1 | tee -a $LOGFILE
-        mv /data_tmp/reads_2.fastq_tmp /data_tmp/tmp/reads_2_tmp.fastq 2>&1 | tee -a $LOGFILE
+        awk '{if (NR%4 == 1) {print $1 "/2"} else print}' $TmpDir/reads_2.fastq > $TmpDir/reads_2.fastq_tmp 2>&1 | tee -a $LOGFILE
+        rm $TmpDir/reads_2.fastq 2>&1 | tee -a $LOGFILE
+        mv $TmpDir/reads_2.fastq_tmp $TmpDir/tmp/reads_2_tmp.fastq 2>&1 | tee -a $LOGFILE
     fi
 
     # Contigs.fasta
     if [ -f /data/${Prefix}_DeNovoContigs.fasta ]; then printf ""; else printf "error: file not found ${Prefix}_DeNovoContigs.fasta\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
-    cp /data/${Prefix}_DeNovoContigs.fasta /data_tmp/${Prefix}_DeNovoContigs.fasta 2>&1 | tee -a $LOGFILE
+    cp /data/${Prefix}_DeNovoContigs.fasta $TmpDir/${Prefix}_DeNovoContigs.fasta 2>&1 | tee -a $LOGFILE
     # SID.blast
     if [ -f /data/${Prefix}.blast ]; then printf ""; else printf "error: file not found ${Prefix}.blast\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
-    cp /data/${Prefix}.blast /data_tmp/${Prefix}.blast 2>&1 | tee -a $LOGFILE
+    cp /data/${Prefix}.blast $TmpDir/${Prefix}.blast 2>&1 | tee -a $LOGFILE
     # SID.blast
     if [ -f /data/${Prefix}_cut_wRefs.fasta ]; then printf ""; else printf "error: file not found ${Prefix}_cut_wRefs.fasta\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
-    cp /data/${Prefix}_cut_wRefs.fasta /data_tmp/${Prefix}_cut_wRefs.fasta 2>&1 | tee -a $LOGFILE
+    cp /data/${Prefix}_cut_wRefs.fasta $TmpDir/${Prefix}_cut_wRefs.fasta 2>&1 | tee -a $LOGFILE
 
     if [ $Paired = true ]; then
-        bash /shiver/shiver_map_reads.sh /data_tmp/ShiverInitDir /data_tmp/config.sh /data_tmp/${Prefix}_DeNovoContigs.fasta $Prefix /data_tmp/${Prefix}.blast /data_tmp/${Prefix}_cut_wRefs.fasta /data_tmp/tmp/reads_1_tmp.fastq /data_tmp/tmp/reads_2_tmp.fastq 2>&1 | tee -a $LOGFILE
+        timed bash /shiver/shiver_map_reads.sh $InitTmpDir/ShiverInitDir $ShiverConfigCopy $TmpDir/${Prefix}_DeNovoContigs.fasta $Prefix $TmpDir/${Prefix}.blast $TmpDir/${Prefix}_cut_wRefs.fasta $TmpDir/tmp/reads_1_tmp.fastq $TmpDir/tmp/reads_2_tmp.fastq 2>&1 | tee -a $LOGFILE
     else
-        bash /shiver/shiver_map_reads.sh /data_tmp/ShiverInitDir /data_tmp/config.sh /data_tmp/${Prefix}_DeNovoContigs.fasta $Prefix /data_tmp/${Prefix}.blast /data_tmp/${Prefix}_cut_wRefs.fasta /data_tmp/tmp/reads_1_tmp.fastq 2>&1 | tee -a $LOGFILE
+        timed bash /shiver/shiver_map_reads.sh $InitTmpDir/ShiverInitDir $ShiverConfigCopy $TmpDir/${Prefix}_DeNovoContigs.fasta $Prefix $TmpDir/${Prefix}.blast $TmpDir/${Prefix}_cut_wRefs.fasta $TmpDir/tmp/reads_1_tmp.fastq 2>&1 | tee -a $LOGFILE
     fi
+    StageStatus=$?
     printf "\n========== stop shiver_map_reads.sh ==========\n" 2>&1 | tee -a $LOGFILE
-    cp /data_tmp/${Prefix}* /data/. 2>&1 | tee -a $LOGFILE
+    cp $TmpDir/${Prefix}* /data/. 2>&1 | tee -a $LOGFILE
+    return $StageStatus
 }
 
 function run_drug_resistance {
+    # The consensus file can be given as an argument; by default it is the one
+    # from shiver's remapping with the default coverage thresholds.
+    local consensus=${1:-/data/${Prefix}_remap_consensus_MinCov_15_30.fasta}
+    local ConsensusName=$(awk '/^>/ {print substr($1,2); exit}' "$consensus")
     printf "\n========== start drug_res.py ==========\n" 2>&1 | tee -a $LOGFILE
-    python3 /shiver/tools/SplitFasta.py /data/${Prefix}_remap_consensus_MinCov_15_30.fasta /data_tmp
-    cat /data_tmp/${Prefix}_remap_consensus.fasta | sed "s/\?/N/g" | sed "s/-//g" | awk "NF" > /data/${Prefix}_shiver_cons.fasta
-    /usr/bin/python3 /shiver/drug_res.py /data/${Prefix}_shiver_cons.fasta /data/${Prefix}_drug_resistance.xlsx 2>&1 | tee -a $LOGFILE
+    timed python3 /shiver/tools/SplitFasta.py "$consensus" $TmpDir
+    cat $TmpDir/${ConsensusName}.fasta | sed "s/\?/N/g" | sed "s/-//g" | awk "NF" > /data/${Prefix}_shiver_cons.fasta
+    timed /usr/bin/python3 /shiver/drug_res.py /data/${Prefix}_shiver_cons.fasta /data/${Prefix}_drug_resistance.xlsx 2>&1 | tee -a $LOGFILE
+    StageStatus=$?
     printf "\n========== stop drug_res.py ==========\n" 2>&1 | tee -a $LOGFILE
+    return $StageStatus
+}
+
+function timed {
+    # Run the command given by the args, recording the resources it used if
+    # RecordTimings is true in pipeline.conf.
+    if [ -z "${SHIVER_TIMINGS_FILE:-}" ]; then
+        "$@"
+        return
+    fi
+    python3 /shiver/tools/RecordResourceUse.py -C "${FUNCNAME[1]}" "$SHIVER_TIMINGS_FILE" "$@"
+}
+
+function summarise_timings {
+    # Write the resources used by each step to <Prefix>_timings.json and print a
+    # table of them, if they were recorded.
+    if [ -z "${SHIVER_TIMINGS_FILE:-}" ] || [ ! -f "$SHIVER_TIMINGS_FILE" ]; then
+        return 0
+    fi
+    printf "\n========== resources used by each step ==========\n" 2>&1 | tee -a $LOGFILE
+    python3 /shiver/tools/SummariseResourceUse.py "$SHIVER_TIMINGS_FILE" --json-out /data/${Prefix}_timings.json 2>&1 | tee -a $LOGFILE
+}
+
+function shiver_config_value {
+    # Print the value of the named variable in the shiver config file.
+    bash -c 'source "$0" > /dev/null && printf "%s" "${!1}"' "$SIVERCONFIGPATH" "$1"
+}
+
+function reconsensus {
+    # Call the consensuses again from the base frequencies of a previous run of
+    # map_reads, using the coverage thresholds currently in the shiver config
+    # file, then redo the global alignment version of the consensus and the
+    # drug resistance report. The reference for the remapping is unchanged: it
+    # is the consensus from the first round with the previous thresholds.
+    if [ -f $SIVERCONFIGPATH ]; then printf ""; else printf "error: file not found $SIVERCONFIGPATH\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
+    printf "\n========== start reconsensus ==========\n" 2>&1 | tee -a $LOGFILE
+    local MinCov1=$(shiver_config_value MinCov1)
+    local MinCov2=$(shiver_config_value MinCov2)
+    local MinBaseFrac=$(shiver_config_value MinBaseFrac)
+    local round stem RefName consensus
+    local FinalConsensus=""
+    for round in "" _remap; do
+        stem=/data/${Prefix}${round}
+        if [ ! -f ${stem}_BaseFreqs.csv ]; then
+            if [ -z "$round" ]; then printf "error: file not found ${Prefix}_BaseFreqs.csv\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
+            printf "${Prefix}_remap_BaseFreqs.csv not found, using the consensus from the first round of mapping\n" 2>&1 | tee -a $LOGFILE
+            break
+        fi
+        if [ -f ${stem}_ref.fasta ]; then printf ""; else printf "error: file not found ${Prefix}${round}_ref.fasta\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
+        RefName=$(awk '/^>/ {print substr($1,2); exit}' ${stem}_ref.fasta)
+        consensus=${stem}_consensus_MinCov_${MinCov1}_${MinCov2}.fasta
+        timed python3 /shiver/tools/CallConsensus.py ${stem}_BaseFreqs.csv "$MinCov1" "$MinCov2" "$MinBaseFrac" --consensus-seq-name ${Prefix}${round}_consensus --ref-seq-name "$RefName" > "$consensus" 2>> $LOGFILE || { printf "ERROR: problem calling the consensus from ${Prefix}${round}_BaseFreqs.csv\n" 2>&1 | tee -a $LOGFILE; return 1; }
+        if [ -z "$round" ] && [ -f ${stem}_coords.csv ]; then
+            timed python3 /shiver/tools/MergeAlignments.py -C ${stem}_coords.csv --ref-seq-name "$RefName" "$consensus" > ${stem}_consensus_MinCov_${MinCov1}_${MinCov2}_ForGlobalAln.fasta 2>> $LOGFILE || { printf "ERROR: problem translating the consensus for the global alignment\n" 2>&1 | tee -a $LOGFILE; return 1; }
+        fi
+        FinalConsensus=$consensus
+    done
+    printf "\n========== stop reconsensus ==========\n" 2>&1 | tee -a $LOGFILE
+    run_drug_resistance "$FinalConsensus"
+}
+
+# The stages of the full pipeline, in order, and the functions running them.
+Stages=(de_novo_assembly init align_contigs map_reads drug_resistance)
+StageFunctions=(de_novo_assembly shiver_init shiver_align_contigs shiver_map_reads run_drug_resistance)
+
+function file_hash {
+    sha256sum "$1" | awk '{print $1}'
+}
+
+function stage_manifest_inputs {
+    # Print the input files (with their hashes) and config values a stage
+    # depends on, one per line. The shiver stages depend on everything that
+    # shiver_init uses, since its outputs only last as long as the container.
+    local stage=$1
+    local InputFiles=()
+    local ConfigVars=()
+    local InitInputs=("$SIVERCONFIGPATH" "/data/$RefAlignment" "/data/$Adapters" "/data/$Primers")
+    local ReadFiles=("/data/$ForwardReads")
+    if [ $Paired = true ]; then ReadFiles+=("/data/$ReverseReads"); fi
+    case $stage in
+    de_novo_assembly)
+        InputFiles=("${ReadFiles[@]}")
+        ConfigVars=(Paired)
+        ;;
+    init)
+        InputFiles=("${InitInputs[@]}")
+        ;;
+    align_contigs)
+        InputFiles=("${InitInputs[@]}" "/data/${Prefix}_DeNovoContigs.fasta")
+        ConfigVars=(Prefix)
+        ;;
+    map_reads)
+        InputFiles=("${InitInputs[@]}" "${ReadFiles[@]}" "/data/${Prefix}_DeNovoContigs.fasta" "/data/${Prefix}.blast" "/data/${Prefix}_raw_wRefs.fasta" "/data/${Prefix}_cut_wRefs.fasta")
+        ConfigVars=(Prefix Paired)
+        ;;
+    drug_resistance)
+        InputFiles=("/data/${Prefix}_remap_consensus_MinCov_15_30.fasta")
+        ConfigVars=(Prefix)
+        ;;
+    esac
+    local file var
+    for file in "${InputFiles[@]}"; do
+        if [ -f "$file" ]; then
+            printf "input %s %s\n" "$(file_hash "$file")" "$file"
+        else
+            printf "input missing %s\n" "$file"
+        fi
+    done
+    for var in "${ConfigVars[@]}"; do
+        printf "config %s=%s\n" "$var" "${!var}"
+    done
+}
+
+function stage_is_current {
+    # Succeed if the stage's manifest records the same inputs and config values
+    # as now, and all the outputs it records are still present and unchanged.
+    local Manifest="$CheckpointDir/$1.manifest"
+    [ -f "$Manifest" ] || return 1
+    [ "$(stage_manifest_inputs $1)" = "$(grep -v '^output ' "$Manifest")" ] || return 1
+    local kind hash file
+    while read -r kind hash file; do
+        [ -f "$file" ] && [ "$(file_hash "$file")" = "$hash" ] || return 1
+    done < <(grep '^output ' "$Manifest")
+}
+
+function run_stage {
+    # Run a stage of the full pipeline, unless its checkpoint shows it is up to
+    # date (or it is forced to run), then write its manifest: its inputs, config
+    # values and the files it wrote, with their hashes.
+    local stage=$1
+    local StageFunction=$2
+    local force=$3
+    local Manifest="$CheckpointDir/$stage.manifest"
+    local StartMarker="$CheckpointDir/$stage.started"
+    if [ $stage = init ] && [ -n "${PIPELINE_INITDIR:-}" ]; then
+        printf "\n========== using the shiver_init output shared by the batch ==========\n" 2>&1 | tee -a $LOGFILE
+        return 0
+    fi
+    mkdir -p "$CheckpointDir"
+    if [ "$force" != true ] && stage_is_current $stage; then
+        printf "\n========== $stage is up to date, skipping it ==========\n" 2>&1 | tee -a $LOGFILE
+        return 0
+    fi
+    # The outputs of shiver_init only last as long as the container.
+    if [ $stage = align_contigs ] || [ $stage = map_reads ]; then
+        [ -d $InitTmpDir/ShiverInitDir ] || run_stage init shiver_init false
+    fi
+    rm -f "$Manifest"
+    touch "$StartMarker"
+    $StageFunction || { printf "ERROR: stage $stage failed\n" 2>&1 | tee -a $LOGFILE; exit 1; }
+    {
+        stage_manifest_inputs $stage
+        if [ $stage = init ]; then
+            find $InitTmpDir/ShiverInitDir -type f
+        else
+            # Match on the separator after the prefix, so that in a batch a
+            # sample whose ID starts with this one's (S1, S10) isn't included.
+            find /data -maxdepth 1 -type f \( -name "${Prefix}_*" -o -name "${Prefix}.*" \) ! -name "${Prefix}.log*" ! -name "${Prefix}_timings.json*" -newer "$StartMarker"
+        fi | sort | while read -r file; do
+            printf "output %s %s\n" "$(file_hash "$file")" "$file"
+        done
+    } > "$Manifest.tmp" && mv "$Manifest.tmp" "$Manifest"
+    rm -f "$StartMarker"
+}
+
+function stage_index {
+    # Print the position of the named stage in Stages, or fail.
+    local i
+    for i in "${!Stages[@]}"; do
+        if [ "${Stages[$i]}" = "$1" ]; then echo $i; return 0; fi
+    done
+    printf "ERROR: unknown stage $1; the stages are: ${Stages[*]}\n" >&2
+    return 1
+}
+
+function positive_int_or_exit {
+    # Exit unless the named variable is an integer greater than 0.
+    if ! [[ "${!1}" =~ ^[0-9]+$ ]] || [ "${!1}" -lt 1 ]; then
+        printf "ERROR: $1 should be an integer greater than 0\n" 2>&1 | tee -a $LOGFILE
+        exit 2
+    fi
+}
+
+function run_batch {
+    # Run the full pipeline for every sample in the sample sheet, which has one
+    # comma-separated line per sample: the sample ID (used as its prefix), the
+    # forward reads, the reverse reads (empty if unpaired) and optionally the
+    # contigs (in which case de novo assembly is skipped), with file names
+    # relative to /data. shiver_init is run once for all samples. The samples
+    # are run as separate pipelines, as many at a time as fit in the CPU and
+    # memory budgets, each worker with its own scratch directory.
+    local SampleSheetFile="/data/${SampleSheet:-samples.csv}"
+    if [ -f "$SampleSheetFile" ]; then printf ""; else printf "error: file not found $SampleSheetFile\n" 2>&1 | tee -a $LOGFILE; exit 3; fi
+    BatchCPUs=${BatchCPUs:-$(nproc)}
+    BatchMemoryGB=${BatchMemoryGB:-$(awk '/^MemTotal:/ {print int($2 / 1048576)}' /proc/meminfo)}
+    CPUsPerSample=${CPUsPerSample:-4}
+    MemoryGBPerSample=${MemoryGBPerSample:-8}
+    local var
+    for var in BatchCPUs BatchMemoryGB CPUsPerSample MemoryGBPerSample; do
+        positive_int_or_exit $var
+    done
+    local NumWorkers=$((BatchCPUs / CPUsPerSample))
+    if [ $((BatchMemoryGB / MemoryGBPerSample)) -lt $NumWorkers ]; then
+        NumWorkers=$((BatchMemoryGB / MemoryGBPerSample))
+    fi
+    if [ $NumWorkers -lt 1 ]; then NumWorkers=1; fi
+    printf "\n========== running the samples in $SampleSheetFile with $NumWorkers workers ==========\n" 2>&1 | tee -a $LOGFILE
+
+    # Run shiver_init once, in a directory shared by the workers.
+    InitTmpDir=$TmpDir/shared
+    mkdir -p $InitTmpDir
+    shiver_init || { printf "ERROR: shiver_init failed\n" 2>&1 | tee -a $LOGFILE; exit 1; }
+
+    # Each worker gets a scratch directory, and a copy of the shiver config
+    # setting the number of threads its tools use.
+    local k
+    local WorkerPIDs=()
+    for ((k = 0; k < NumWorkers; k++)); do
+        mkdir -p $TmpDir/worker_$k
+        cp $InitTmpDir/config.sh $TmpDir/worker_$k/config.sh
+        printf "\nNumThreads=$CPUsPerSample\n" >> $TmpDir/worker_$k/config.sh
+        WorkerPIDs+=("")
+    done
+
+    local BatchSummary="/data/${Prefix}_BatchSummary.csv"
+    echo "SampleID,ExitStatus" > "$BatchSummary"
+    local SampleLines=()
+    mapfile -t SampleLines < <(grep -v '^#' "$SampleSheetFile" | sed $'s/\r//' | awk 'NF')
+    local line ID R1 R2 contigs worker FromStageArgs
+    for line in "${SampleLines[@]}"; do
+        IFS=, read -r ID R1 R2 contigs <<< "$line"
+        if [ "$ID" = SampleID ]; then continue; fi
+
+        # Wait for a free worker.
+        worker=""
+        while [ -z "$worker" ]; do
+            for ((k = 0; k < NumWorkers; k++)); do
+                if [ -z "${WorkerPIDs[$k]}" ] || ! kill -0 ${WorkerPIDs[$k]} 2> /dev/null; then
+                    worker=$k
+                    break
+                fi
+            done
+            if [ -z "$worker" ]; then wait -n; fi
+        done
+
+        FromStageArgs=()
+        if [ -n "${contigs:-}" ]; then
+            if [ "$contigs" != "${ID}_DeNovoContigs.fasta" ]; then
+                cp "/data/$contigs" "/data/${ID}_DeNovoContigs.fasta"
+            fi
+            FromStageArgs=(--from-stage init)
+        fi
+        printf "Starting sample $ID on worker $worker\n" 2>&1 | tee -a $LOGFILE
+        (
+            rm -rf $TmpDir/worker_$worker/scratch
+            mkdir $TmpDir/worker_$worker/scratch
+            PIPELINE_TMPDIR=$TmpDir/worker_$worker/scratch PIPELINE_INITDIR=$InitTmpDir \
+            PIPELINE_SHIVER_CONFIG=$TmpDir/worker_$worker/config.sh \
+            bash "${BASH_SOURCE[0]}" full --prefix "$ID" --forward-reads "$R1" --reverse-reads "${R2:-}" "${FromStageArgs[@]}" > /dev/null 2>&1
+            echo "$ID,$?" >> "$BatchSummary"
+        ) &
+        WorkerPIDs[$worker]=$!
+    done
+    wait
+
+    # Summarise.
+    local NumFailed=$(awk -F, 'NR > 1 && $2 != 0' "$BatchSummary" | wc -l)
+    printf "\n========== batch finished: $(($(wc -l < "$BatchSummary") - 1)) samples, $NumFailed failed ==========\n" 2>&1 | tee -a $LOGFILE
+    awk -F, '{printf "%-40s %s\n", $1, $2}' "$BatchSummary" 2>&1 | tee -a $LOGFILE
+    [ $NumFailed -eq 0 ]
 }
 
 function init_log {
@@ -296,6 +577,21 @@ while [[ $# -gt 0 ]]; do
 		shift
 		shift
 		;;
+	--from-stage)
+		FromStage="$2"
+		shift
+		shift
+		;;
+	--sample-sheet)
+		SampleSheet="$2"
+		shift
+		shift
+		;;
+	--to-stage)
+		ToStage="$2"
+		shift
+		shift
+		;;
 	-h|--help)
         usage
 		exit 0
@@ -308,6 +604,43 @@ while [[ $# -gt 0 ]]; do
 done
 set -- "${POSITIONAL[@]}"
 
+# copy shiver config:
+if [ -z ${ShiverConfig+x} ]
+then
+    printf "Shiver config file is not found, using the default one\n"
+    SIVERCONFIGPATH="/shiver/config.sh"
+else
+    printf "Shiver config file found, using the given one\n"
+    SIVERCONFIGPATH="/data/$ShiverConfig"
+fi
+
+LOGFILE="/data/$Prefix.log"
+
+# Record the resources used by each step of this run, if desired. The shiver
+# scripts add the records of the steps they run to the same file.
+if [ "${RecordTimings:-false}" = true ]; then
+    export SHIVER_TIMINGS_FILE="/data/${Prefix}_timings.jsonl"
+    rm -f "$SHIVER_TIMINGS_FILE" /data/${Prefix}_timings.json
+    trap summarise_timings EXIT
+else
+    unset SHIVER_TIMINGS_FILE
+fi
+
+# check if pipeline mode is Paired or Unpaired
+if [ -z "${ReverseReads:-}" ]
+then 
+    printf "ReverseReads argument not found in pipeline.conf, mode set to Unpaired" | tee -a $LOGFILE
+    Paired=false
+    if [ -z "${ForwardReads:-}" ] && [ "${1:-}" != batch ]
+    then
+        printf "ForwardReads argument not found in pipeline.conf. Exit run" | tee -a $LOGFILE
+        exit 2
+    fi
+else
+    printf "ReverseReads argument found in pipeline.conf, mode set to Paired" | tee -a $LOGFILE
+    Paired=true
+fi
+
 case $1 in
 help)
     usage
@@ -351,20 +684,29 @@ drug_resistance)
     run_drug_resistance
     exit 0
     ;;
+reconsensus)
+    init_log "reconsensus"
+    reconsensus || exit 1
+    printf "========== DONE ================================================================\n" >> $LOGFILE
+    exit 0
+    ;;
+batch)
+    init_log "batch"
+    run_batch || exit 1
+    printf "========== DONE ================================================================\n" >> $LOGFILE
+    exit 0
+    ;;
 full)
+    FromIndex=$(stage_index ${FromStage:-${Stages[0]}}) || exit 1
+    ToIndex=$(stage_index ${ToStage:-${Stages[-1]}}) || exit 1
     init_log "full pipeline"
-    de_novo_assembly
-    shiver_init
-    shiver_align_contigs
-    refseqfile="/data/${Prefix}_cut_wRefs.fasta"
-    if [ -f "$refseqfile" ]; then
-        printf "cut_wRefs file was generated by Shiver, using ${Prefix}_cut_wRefs.fasta" 2>&1 | tee -a $LOGFILE
-    else
-        printf "cut_wRefs file was not  generated by Shiver, using ${Prefix}_raw_wRefs.fasta as ${Prefix}_cut_wRefs.fasta" 2>&1 | tee -a $LOGFILE
-        cp /data/${Prefix}_raw_wRefs.fasta /data/${Prefix}_cut_wRefs.fasta 2>&1 | tee -a $LOGFILE
-    fi
-    shiver_map_reads
-    run_drug_resistance
+    CheckpointDir="/data/${Prefix}_checkpoints"
+    # Stages before --from-stage are not run; that stage itself is always run,
+    # and later ones only if their checkpoint is out of date.
+    for ((i = FromIndex; i <= ToIndex; i++)); do
+        if [ $i -eq $FromIndex ] && [ -n "${FromStage:-}" ]; then force=true; else force=false; fi
+        run_stage ${Stages[$i]} ${StageFunctions[$i]} $force
+    done
     printf "========== DONE ================================================================\n" >> $LOGFILE
     exit 0
     ;;
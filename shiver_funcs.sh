@@ -17,6 +17,7 @@ Code_FillConsensusGaps="$ToolsDir/FillConsensusGaps.py"
 Code_FindContaminantReadPairs="$ToolsDir/FindContaminantReadPairs.py"
 Code_FindReadsInFastq="$ToolsDir/FindNamedReadsInSortedFastq.py"
 Code_FindSeqsInFasta="$ToolsDir/FindSeqsInFasta.py"
+Code_GetBaseFreqsFromBam="$ToolsDir/GetBaseFreqsFromBamFile.py"
 Code_MergeAlignments="$ToolsDir/MergeAlignments.py"
 Code_RemoveBlankCols="$ToolsDir/RemoveBlankColumns.py"
 Code_SplitFasta="$ToolsDir/SplitFasta.py"
@@ -26,11 +27,33 @@ Code_CutAlignedContigs="$ToolsDir/CutAlignedContigs.py"
 Code_PrintSeqLengths="$ToolsDir/PrintSeqLengths.py"
 Code_AddSNPsToSeqs="$ToolsDir/AddAllPossibleSNPsToSeqs.py"
 Code_KeepBestLinesInDataFile="$ToolsDir/KeepBestLinesInDataFile.py"
+Code_ClassifyReadsByKmers="$ToolsDir/ClassifyReadsByKmers.py"
+Code_FindContaminantReadPairsFromBlast="$ToolsDir/FindContaminantReadPairsFromBlast.py"
+Code_FindWellMappedReads="$ToolsDir/FindWellMappedReads.py"
+Code_RemoveNamedReadsFromBam="$ToolsDir/RemoveNamedReadsFromBam.py"
 Code_ConvertFastqToFasta="$ToolsDir/ConvertFastqToFasta.py"
+Code_GetBamReadStats="$ToolsDir/GetBamReadStats.py"
+Code_RecordResourceUse="$ToolsDir/RecordResourceUse.py"
+Code_SummariseResourceUse="$ToolsDir/SummariseResourceUse.py"
 
 # Only needed if GiveHXB2coords is set to true in the config file
 HXB2file='/shiver/data/external/B.FR.83.HXB2_LAI_IIIB_BRU.K03455.fasta'
 
+# Run the command given by the args. If the variable TimingsFile is set, run it
+# through RecordResourceUse.py, appending a record of the resources it used to
+# that file, noting the function we were called from.
+function RunTimed {
+  if [[ -z "${TimingsFile:-}" ]]; then
+    "$@"
+    return
+  fi
+  TimingContext="${FUNCNAME[1]:-main}"
+  if [[ "$TimingContext" == "main" ]]; then
+    TimingContext=$(basename "$0")
+  fi
+  "$python" "$Code_RecordResourceUse" -C "$TimingContext" "$TimingsFile" "$@"
+}
+
 function CheckHXB2fileExists {
   if [[ ! -f "$HXB2file" ]]; then
     echo "The HXB2 sequence file, expected to be at $HXB2file, was not found." \
@@ -60,6 +83,9 @@ function AlignContigsToRefs {
   SwapContigsToTopArg=$6
   OldMafftArg=$7
   ContigNames=$(awk '/^>/ {print substr($1,2)}' "$ContigFile")
+  if [[ "$Aligner" == "$mafft" ]]; then
+    AlignerOptions="$AlignerOptions --thread $NumThreadsMafft"
+  fi
 
   # Do the inital alignment. Call the $Aligner arg with the desired Python 
   # executable if it's shiver's aligner, not if it's mafft.
@@ -257,23 +283,102 @@ function sam_to_bam {
   Paired=$4
 
   # Thanks to Nick Croucher for these steps.
-  "$samtools" view -bS $samtoolsReadFlags -t "$LocalRefFAIindex" -o \
-  "$MapOutConversion1".bam "$InSam" &&
-  "$samtools" sort -n "$MapOutConversion1".bam -o "$MapOutConversion2".bam -T \
-  "$SamtoolsSortFile" ||
+  RunTimed "$samtools" view -bS -@ "$SamtoolsExtraThreads" $samtoolsReadFlags -t \
+  "$LocalRefFAIindex" -o "$MapOutConversion1".bam "$InSam" &&
+  RunTimed "$samtools" sort -n -@ "$SamtoolsExtraThreads" "$MapOutConversion1".bam -o \
+  "$MapOutConversion2".bam -T "$SamtoolsSortFile" ||
   { echo 'Failed to convert from sam to bam format.' >&2 ; return 1 ; }
   if [[ "$Paired" == "true" ]]; then
-    "$samtools" fixmate "$MapOutConversion2".bam "$MapOutConversion3".bam ||
+    RunTimed "$samtools" fixmate "$MapOutConversion2".bam "$MapOutConversion3".bam ||
     { echo 'Failed to convert from sam to bam format.' >&2 ; return 1 ; }
   else
     mv "$MapOutConversion2.bam" "$MapOutConversion3.bam"
   fi
-  "$samtools" sort "$MapOutConversion3".bam -o "$OutBam" -T \
-  "$SamtoolsSortFile" ||
+  RunTimed "$samtools" sort -@ "$SamtoolsExtraThreads" "$MapOutConversion3".bam -o \
+  "$OutBam" -T "$SamtoolsSortFile" ||
   { echo 'Failed to convert from sam to bam format.' >&2 ; return 1 ; }
 
 }
 
+function sam_stream_to_bam {
+  # Check for the right number of args
+  ExpectedNumArgs=3
+  if [[ "$#" -ne "$ExpectedNumArgs" ]]; then
+    echo "sam_stream_to_bam function called with $# args; expected"\
+    "$ExpectedNumArgs. Quitting." >&2
+    return 1
+  fi
+
+  # Assign the args
+  LocalRefFAIindex=$1
+  OutBam=$2
+  Paired=$3
+
+  # The same steps as sam_to_bam, but reading the sam from stdin and passing
+  # uncompressed data between the steps instead of writing files. The two sorts
+  # run at the same time, so need different temporary files.
+  if [[ "$Paired" == "true" ]]; then
+    RunTimed "$samtools" view -u $samtoolsReadFlags -t "$LocalRefFAIindex" - |
+    RunTimed "$samtools" sort -n -l 0 -@ "$SamtoolsExtraThreads" \
+    -m "$SamtoolsSortMemPerThread" -T "$SamtoolsSortFile"_n -O bam - |
+    RunTimed "$samtools" fixmate -O bam --output-fmt-option level=0 - - |
+    RunTimed "$samtools" sort -@ "$SamtoolsExtraThreads" -m "$SamtoolsSortMemPerThread" \
+    -T "$SamtoolsSortFile" -o "$OutBam" - ||
+    { echo 'Failed to convert from sam to bam format.' >&2 ; return 1 ; }
+  else
+    RunTimed "$samtools" view -u $samtoolsReadFlags -t "$LocalRefFAIindex" - |
+    RunTimed "$samtools" sort -@ "$SamtoolsExtraThreads" -m "$SamtoolsSortMemPerThread" \
+    -T "$SamtoolsSortFile" -o "$OutBam" - ||
+    { echo 'Failed to convert from sam to bam format.' >&2 ; return 1 ; }
+  fi
+}
+
+function run_mapper_to_bam {
+  # Check for the right number of args: four, then the mapping command
+  ExpectedMinNumArgs=5
+  if [[ "$#" -lt "$ExpectedMinNumArgs" ]]; then
+    echo "run_mapper_to_bam function called with $# args; expected at least"\
+    "$ExpectedMinNumArgs. Quitting." >&2
+    return 1
+  fi
+
+  # Assign the args. The remaining args are the mapping command, which should
+  # print the sam to stdout.
+  MapperName=$1
+  LocalRef=$2
+  OutFileAsBam=$3
+  Paired=$4
+  shift 4
+
+  # Make the reference's .fai index if needed.
+  LocalRefFAIindex="$LocalRef".fai
+  if [[ ! -f "$LocalRefFAIindex" ]]; then
+    RunTimed "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
+    { echo 'Problem indexing the refererence with samtools. Quitting.' >&2 ; 
+    return 1 ; }
+  fi
+
+  # Either pipe the mapper's output straight into the conversion to a sorted
+  # bam, or write it to a sam file first.
+  if [[ "$StreamSamToBam" == "true" ]]; then
+    PipeStatus=(0 0)
+    RunTimed "$@" | sam_stream_to_bam "$LocalRefFAIindex" "$OutFileAsBam" "$Paired" ||
+    PipeStatus=("${PIPESTATUS[@]}")
+    if [[ "${PipeStatus[0]}" -ne 0 ]]; then
+      echo "$MapperName mapping failed." >&2
+      return 1
+    elif [[ "${PipeStatus[1]}" -ne 0 ]]; then
+      echo 'Problem converting from sam to bam format.' >&2
+      return 1
+    fi
+  else
+    RunTimed "$@" > "$MapOutAsSam" || { echo "$MapperName mapping failed." >&2 ;
+    return 1 ; }
+    sam_to_bam "$MapOutAsSam" "$LocalRefFAIindex" "$OutFileAsBam" "$Paired" ||
+    { echo 'Problem converting from sam to bam format.' >&2 ; return 1 ; }
+  fi
+}
+
 function map_with_smalt {
   # Check for the right number of args
   ExpectedNumArgs=4
@@ -289,28 +394,12 @@ function map_with_smalt {
   LocalRef=$3
   OutFileAsBam=$4
 
-  # Index the ref
-  "$smalt" index $smaltIndexOptions "$smaltIndex" "$LocalRef" ||
-  { echo 'Problem indexing the refererence with smalt.' >&2 ;
-  return 1 ; }
-
   # Do the mapping!
   echo "Now mapping using smalt with options \"$smaltMapOptions\". Typically a"\
   "slow step."
-  "$smalt" map $smaltMapOptions -o "$MapOutAsSam" "$smaltIndex" \
-  "$ReadsToMap1" "$ReadsToMap2" || \
-  { echo 'Smalt mapping failed.' >&2 ; return 1 ; }
-
-  # Make the reference's .fai index if needed.
-  LocalRefFAIindex="$LocalRef".fai
-  if [[ ! -f "$LocalRefFAIindex" ]]; then
-    "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
-    { echo 'Problem indexing the refererence with samtools. Quitting.' >&2 ; 
-    return 1 ; }
-  fi
-
-  sam_to_bam "$MapOutAsSam" "$LocalRefFAIindex" "$OutFileAsBam" true ||
-  { echo 'Problem converting from sam to bam format.' >&2 ; return 1 ; }
+  run_mapper_to_bam 'Smalt' "$LocalRef" "$OutFileAsBam" true \
+  "$smalt" map -n "$NumThreadsMapper" $smaltMapOptions "$smaltIndex" \
+  "$ReadsToMap1" "$ReadsToMap2"
 }
 
 function map_with_smalt_unpaired {
@@ -328,28 +417,12 @@ function map_with_smalt_unpaired {
   LocalRef=$2
   OutFileAsBam=$3
 
-  # Index the ref
-  "$smalt" index $smaltIndexOptions "$smaltIndex" "$LocalRef" ||
-  { echo 'Problem indexing the refererence with smalt.' >&2 ;
-  return 1 ; }
-
   # Do the mapping!
   echo "Now mapping using smalt with options \"$smaltMapOptions\". Typically a"\
   "slow step."
-  "$smalt" map $smaltMapOptions -o "$MapOutAsSam" "$smaltIndex" \
-  "$ReadsToMap" || \
-  { echo 'Smalt mapping failed.' >&2 ; return 1 ; }
-
-  # Make the reference's .fai index if needed.
-  LocalRefFAIindex="$LocalRef".fai
-  if [[ ! -f "$LocalRefFAIindex" ]]; then
-    "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
-    { echo 'Problem indexing the refererence with samtools. Quitting.' >&2 ; 
-    return 1 ; }
-  fi
-
-  sam_to_bam "$MapOutAsSam" "$LocalRefFAIindex" "$OutFileAsBam" false ||
-  { echo 'Problem converting from sam to bam format.' >&2 ; return 1 ; }
+  run_mapper_to_bam 'Smalt' "$LocalRef" "$OutFileAsBam" false \
+  "$smalt" map -n "$NumThreadsMapper" $smaltMapOptions "$smaltIndex" \
+  "$ReadsToMap"
 }
 
 function map_with_bwa_mem {
@@ -367,27 +440,12 @@ function map_with_bwa_mem {
   LocalRef=$3
   OutFileAsBam=$4
 
-  # Index the ref
-  "$bwa" index "$LocalRef" ||
-  { echo 'Problem indexing the refererence with bwa.' >&2 ;
-  return 1 ; }
-
   # Do the mapping!
   echo "Now mapping using bwa mem with options \"$bwaOptions\". Typically a"\
   "slow step."
-  "$bwa" mem "$LocalRef" "$ReadsToMap1" "$ReadsToMap2" $bwaOptions > \
-  "$MapOutAsSam" || { echo 'bwa mem mapping failed.' >&2 ; return 1 ; }
-
-  # Make the reference's .fai index if needed.
-  LocalRefFAIindex="$LocalRef".fai
-  if [[ ! -f "$LocalRefFAIindex" ]]; then
-    "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
-    { echo 'Problem indexing the refererence with samtools. Quitting.' >&2 ; 
-    return 1 ; }
-  fi
-
-  sam_to_bam "$MapOutAsSam" "$LocalRefFAIindex" "$OutFileAsBam" true ||
-  { echo 'Problem converting from sam to bam format.' >&2 ; return 1 ; }
+  run_mapper_to_bam 'bwa mem' "$LocalRef" "$OutFileAsBam" true \
+  "$bwa" mem -t "$NumThreadsMapper" "$LocalRef" "$ReadsToMap1" "$ReadsToMap2" \
+  $bwaOptions
 }
 
 function map_with_bwa_mem_unpaired {
@@ -405,27 +463,11 @@ function map_with_bwa_mem_unpaired {
   LocalRef=$2
   OutFileAsBam=$3
 
-  # Index the ref
-  "$bwa" index "$LocalRef" ||
-  { echo 'Problem indexing the refererence with bwa.' >&2 ;
-  return 1 ; }
-
   # Do the mapping!
   echo "Now mapping using bwa mem with options \"$bwaOptions\". Typically a"\
   "slow step."
-  "$bwa" mem "$LocalRef" "$ReadsToMap" $bwaOptions > \
-  "$MapOutAsSam" || { echo 'bwa mem mapping failed.' >&2 ; return 1 ; }
-
-  # Make the reference's .fai index if needed.
-  LocalRefFAIindex="$LocalRef".fai
-  if [[ ! -f "$LocalRefFAIindex" ]]; then
-    "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
-    { echo 'Problem indexing the refererence with samtools. Quitting.' >&2 ; 
-    return 1 ; }
-  fi
-
-  sam_to_bam "$MapOutAsSam" "$LocalRefFAIindex" "$OutFileAsBam" false ||
-  { echo 'Problem converting from sam to bam format.' >&2 ; return 1 ; }
+  run_mapper_to_bam 'bwa mem' "$LocalRef" "$OutFileAsBam" false \
+  "$bwa" mem -t "$NumThreadsMapper" "$LocalRef" "$ReadsToMap" $bwaOptions
 }
 
 function map_with_bowtie {
@@ -443,28 +485,12 @@ function map_with_bowtie {
   LocalRef=$3
   OutFileAsBam=$4
 
-  # Index the ref
-  "$bowtie2_build" "$LocalRef" "$bowtieIndex" ||
-  { echo 'Problem indexing the refererence with bowtie2.' >&2 ;
-  return 1 ; }
-
   # Do the mapping!
   echo "Now mapping using bowtie2 with options \"$bowtieOptions\". Typically a"\
   "slow step."
-  "$bowtie2" -x "$bowtieIndex" -1 "$ReadsToMap1" -2 "$ReadsToMap2" -S \
-  "$MapOutAsSam" $bowtieOptions || \
-  { echo 'bowtie2 mapping failed.' >&2 ; return 1 ; }
-
-  # Make the reference's .fai index if needed.
-  LocalRefFAIindex="$LocalRef".fai
-  if [[ ! -f "$LocalRefFAIindex" ]]; then
-    "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
-    { echo 'Problem indexing the refererence with samtools. Quitting.' >&2 ; 
-    return 1 ; }
-  fi
-
-  sam_to_bam "$MapOutAsSam" "$LocalRefFAIindex" "$OutFileAsBam" true ||
-  { echo 'Problem converting from sam to bam format.' >&2 ; return 1 ; }
+  run_mapper_to_bam 'bowtie2' "$LocalRef" "$OutFileAsBam" true \
+  "$bowtie2" -p "$NumThreadsMapper" -x "$bowtieIndex" -1 "$ReadsToMap1" \
+  -2 "$ReadsToMap2" $bowtieOptions
 }
 
 function map_with_bowtie_unpaired {
@@ -482,28 +508,340 @@ function map_with_bowtie_unpaired {
   LocalRef=$2
   OutFileAsBam=$3
 
-  # Index the ref
-  "$bowtie2_build" "$LocalRef" "$bowtieIndex" ||
-  { echo 'Problem indexing the refererence with bowtie2.' >&2 ;
-  return 1 ; }
-
   # Do the mapping!
   echo "Now mapping using bowtie2 with options \"$bowtieOptions\". Typically a"\
   "slow step."
-  "$bowtie2" -x "$bowtieIndex" -U "$ReadsToMap1" -S \
-  "$MapOutAsSam" $bowtieOptions || \
-  { echo 'bowtie2 mapping failed.' >&2 ; return 1 ; }
+  run_mapper_to_bam 'bowtie2' "$LocalRef" "$OutFileAsBam" false \
+  "$bowtie2" -p "$NumThreadsMapper" -x "$bowtieIndex" -U "$ReadsToMap1" \
+  $bowtieOptions
+}
 
-  # Make the reference's .fai index if needed.
-  LocalRefFAIindex="$LocalRef".fai
-  if [[ ! -f "$LocalRefFAIindex" ]]; then
-    "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
-    { echo 'Problem indexing the refererence with samtools. Quitting.' >&2 ; 
+function TrimCache {
+
+  # Delete the least recently used entries of the cache until its total size is
+  # at most CacheMaxSizeMB. An entry's modification time is updated whenever it
+  # is used.
+  CacheMaxSizeKB=$((CacheMaxSizeMB * 1024))
+  CacheEntries=()
+  CacheEntrySizes=()
+  CacheSizeKB=0
+  while read -r EntryTime CacheEntry; do
+    EntrySize=$(du -sk "$CacheEntry" | awk '{print $1}') || continue
+    CacheEntries+=("$CacheEntry")
+    CacheEntrySizes+=("$EntrySize")
+    CacheSizeKB=$((CacheSizeKB + EntrySize))
+  done < <(find "$CacheDir" -mindepth 1 -maxdepth 1 -type d ! -name 'temp_*' \
+  -printf '%T@ %p\n' | sort -n)
+  for i in "${!CacheEntries[@]}"; do
+    if [[ "$CacheSizeKB" -le "$CacheMaxSizeKB" ]]; then
+      break
+    fi
+    rm -rf "${CacheEntries[$i]}"
+    CacheSizeKB=$((CacheSizeKB - ${CacheEntrySizes[$i]}))
+  done
+}
+
+function WriteStdoutTo {
+  # Run the command given by all args after the first, writing its stdout to
+  # the file given by the first arg.
+  OutFile=$1
+  shift
+  "$@" > "$OutFile"
+}
+
+function RunCached {
+
+  # Args: the output file, or the prefix shared by the output files; a
+  # space-separated list of glob patterns which, appended to that prefix, give
+  # the output files (empty if there is a single output file, the first arg);
+  # the number of input files N; the N input files; the command to run.
+  # The outputs are looked up in the cache (if CacheDir is set) with a key made
+  # from the contents of the input files and the command. Args of the command
+  # that are one of the input files or the output prefix are put into the key by
+  # their role instead of their name, so that the key does not depend on the
+  # names of the files. If found, the outputs are copied from the cache instead
+  # of running the command; otherwise the command is run and its outputs stored.
+  if [[ "$#" -lt 4 ]]; then
+    echo "RunCached function called with $# args; at least 4 required."\
+    "Quitting." >&2
+    return 1
+  fi
+  CacheOutPrefix=$1
+  CacheOutPatterns=$2
+  CacheNumInputs=$3
+  shift 3
+  if ! [[ "$CacheNumInputs" =~ $NonNegativeIntRegex ]] || \
+  [[ "$#" -le "$CacheNumInputs" ]]; then
+    echo "RunCached function: expected $CacheNumInputs input files followed"\
+    "by a command. Quitting." >&2
+    return 1
+  fi
+  CacheInputs=("${@:1:$CacheNumInputs}")
+  shift "$CacheNumInputs"
+
+  if [[ -z "$CacheDir" ]]; then
+    "$@"
+    return
+  fi
+
+  # Make the key.
+  CacheKeyText="$CacheOutPatterns"
+  for CacheInput in "${CacheInputs[@]}"; do
+    InputHash=$(sha256sum < "$CacheInput" | awk '{print $1}') ||
+    { echo "Problem hashing $CacheInput for the cache." >&2 ; return 1 ; }
+    CacheKeyText+=$'\n'"$InputHash"
+  done
+  for CommandWord in "$@"; do
+    KeyWord="$CommandWord"
+    for i in "${!CacheInputs[@]}"; do
+      if [[ "$CommandWord" == "${CacheInputs[$i]}" ]]; then
+        KeyWord="<input $i>"
+        break
+      fi
+    done
+    if [[ "$KeyWord" == "$CommandWord" ]] && \
+    [[ "$CommandWord" == "$CacheOutPrefix" ]]; then
+      KeyWord='<output>'
+    fi
+    CacheKeyText+=$'\n'"$KeyWord"
+  done
+  CacheKey=$(printf '%s' "$CacheKeyText" | sha256sum | awk '{print $1}')
+  CacheEntry="$CacheDir/$CacheKey"
+
+  # If the outputs are in the cache, copy them into place (they are stored with
+  # the prefix replaced by 'out'). If copying fails, e.g. because the entry was
+  # just evicted by another run sharing the cache, run the command instead.
+  if [[ -d "$CacheEntry" ]]; then
+    touch "$CacheEntry"
+    CopiedFromCache=true
+    for CachedFile in "$CacheEntry"/out*; do
+      CachedFileName=$(basename "$CachedFile")
+      cp "$CachedFile" "$CacheOutPrefix${CachedFileName#out}" ||
+      { CopiedFromCache=false ; break ; }
+    done
+    if [[ "$CopiedFromCache" == "true" ]]; then
+      echo "Using the cached version of $CacheOutPrefix."
+      return 0
+    fi
+  fi
+
+  "$@" || return 1
+
+  # Store the outputs in a temporary directory which is then renamed, so that
+  # incomplete entries are never used. Failing to store is only a warning.
+  CacheTempEntry=$(mktemp -d "$CacheDir/temp_XXXXXX") ||
+  { echo "Warning: could not write to the cache $CacheDir." >&2 ; return 0 ; }
+  StoredInCache=true
+  NumFilesStored=0
+  if [[ -z "$CacheOutPatterns" ]]; then
+    cp "$CacheOutPrefix" "$CacheTempEntry/out" &&
+    NumFilesStored=1 || StoredInCache=false
+  else
+    for CacheOutPattern in $CacheOutPatterns; do
+      for OutFile in "$CacheOutPrefix"$CacheOutPattern; do
+        if [[ -f "$OutFile" ]]; then
+          cp "$OutFile" "$CacheTempEntry/out${OutFile#"$CacheOutPrefix"}" &&
+          NumFilesStored=$((NumFilesStored + 1)) || StoredInCache=false
+        fi
+      done
+    done
+  fi
+  if [[ -d "$CacheEntry" ]]; then
+    # Another run sharing the cache has stored the same outputs meanwhile.
+    rm -rf "$CacheTempEntry"
+  elif [[ "$StoredInCache" == "true" ]] && [[ "$NumFilesStored" -gt 0 ]]; then
+    mv -T "$CacheTempEntry" "$CacheEntry" 2> /dev/null ||
+    rm -rf "$CacheTempEntry"
+  else
+    echo "Warning: could not store $CacheOutPrefix in the cache $CacheDir." >&2
+    rm -rf "$CacheTempEntry"
+  fi
+  TrimCache
+}
+
+function IndexRefForMapping {
+
+  # Check for the right number of args
+  ExpectedNumArgs=1
+  if [[ "$#" -ne "$ExpectedNumArgs" ]]; then
+    echo "IndexRefForMapping function called with $# args; expected"\
+    "$ExpectedNumArgs. Quitting." >&2
+    return 1
+  fi
+  LocalRef=$1
+
+  # Index the ref with the chosen mapper.
+  if [[ "$mapper" == "smalt" ]]; then
+    RunCached "$smaltIndex" '.sma .smi' 1 "$LocalRef" \
+    RunTimed "$smalt" index $smaltIndexOptions "$smaltIndex" "$LocalRef" ||
+    { echo 'Problem indexing the refererence with smalt.' >&2 ;
+    return 1 ; }
+  elif [[ "$mapper" == "bowtie" ]]; then
+    RunCached "$bowtieIndex" '.*.bt2 .*.bt2l' 1 "$LocalRef" \
+    RunTimed "$bowtie2_build" --threads "$NumThreadsMapper" "$LocalRef" "$bowtieIndex" ||
+    { echo 'Problem indexing the refererence with bowtie2.' >&2 ;
     return 1 ; }
+  elif [[ "$mapper" == "bwa" ]]; then
+    RunCached "$LocalRef" '.amb .ann .bwt .pac .sa' 1 "$LocalRef" \
+    RunTimed "$bwa" index "$LocalRef" ||
+    { echo 'Problem indexing the refererence with bwa.' >&2 ;
+    return 1 ; }
+  else
+    echo "Unrecognised value $mapper for the 'mapper' config file variable;"\
+    "possible values are 'smalt', 'bowtie' or 'bwa'." >&2
+    return 1
+  fi
+}
+
+function MapWithChosenMapper {
+
+  # Check for the right number of args
+  if [[ "$#" -eq 4 ]]; then
+    Paired=true
+    ReadsToMap2=$4
+  elif [[ "$#" -eq 3 ]]; then
+    Paired=false
+  else
+    echo "MapWithChosenMapper function called with $# args; 3 or 4 required."\
+    "Quitting." >&2
+    return 1
   fi
 
-  sam_to_bam "$MapOutAsSam" "$LocalRefFAIindex" "$OutFileAsBam" false ||
-  { echo 'Problem converting from sam to bam format.' >&2 ; return 1 ; }
+  # Assign the args. The reference should already have been indexed with
+  # IndexRefForMapping.
+  LocalRef=$1
+  OutFileAsBam=$2
+  ReadsToMap1=$3
+
+  if [[ "$Paired" == "true" ]]; then
+    # Map with the chosen mapper.
+    if [[ "$mapper" == "smalt" ]]; then
+      map_with_smalt "$ReadsToMap1" "$ReadsToMap2" "$LocalRef" \
+      "$OutFileAsBam" ||
+      { echo 'Problem mapping with smalt.' >&2 ; return 1 ; }
+    elif [[ "$mapper" == "bowtie" ]]; then
+      map_with_bowtie "$ReadsToMap1" "$ReadsToMap2" "$LocalRef" \
+      "$OutFileAsBam" ||
+      { echo 'Problem mapping with bowtie.' >&2 ; return 1 ; }
+    elif [[ "$mapper" == "bwa" ]]; then
+      map_with_bwa_mem "$ReadsToMap1" "$ReadsToMap2" "$LocalRef" \
+      "$OutFileAsBam" ||
+      { echo 'Problem mapping with bwa mem.' >&2 ; return 1 ; }
+    else
+      echo "Unrecognised value $mapper for the 'mapper' config file variable;"\
+      "possible values are 'smalt', 'bowtie' or 'bwa'." >&2
+      return 1
+    fi
+  else
+    # Map with the chosen mapper.
+    if [[ "$mapper" == "smalt" ]]; then
+      map_with_smalt_unpaired "$ReadsToMap1" "$LocalRef" \
+      "$OutFileAsBam" ||
+      { echo 'Problem mapping with smalt.' >&2 ; return 1 ; }
+    elif [[ "$mapper" == "bowtie" ]]; then
+      map_with_bowtie_unpaired "$ReadsToMap1" "$LocalRef" \
+      "$OutFileAsBam" ||
+      { echo 'Problem mapping with bowtie.' >&2 ; return 1 ; }
+    elif [[ "$mapper" == "bwa" ]]; then
+      map_with_bwa_mem_unpaired "$ReadsToMap1" "$LocalRef" \
+      "$OutFileAsBam" ||
+      { echo 'Problem mapping with bwa mem.' >&2 ; return 1 ; }
+    else
+      echo "Unrecognised value $mapper for the 'mapper' config file variable;"\
+      "possible values are 'smalt', 'bowtie' or 'bwa'." >&2
+      return 1
+    fi
+  fi
+}
+
+function MapInShards {
+
+  # Check for the right number of args
+  if [[ "$#" -eq 4 ]]; then
+    Paired=true
+    ReadsToMap2=$4
+  elif [[ "$#" -eq 3 ]]; then
+    Paired=false
+  else
+    echo "MapInShards function called with $# args; 3 or 4 required."\
+    "Quitting." >&2
+    return 1
+  fi
+
+  # Assign the args. The reference should already have been indexed with
+  # IndexRefForMapping.
+  LocalRef=$1
+  OutFileAsBam=$2
+  ReadsToMap1=$3
+
+  # Split the reads into NumMappingShards fastq files, dealing out the reads in
+  # turn; doing the same for both files of paired reads keeps pairs together.
+  ShardStem="$MappingShardStem"
+  rm -f "$ShardStem"_*
+  for ReadsNum in 1 2; do
+    if [[ "$ReadsNum" -eq 2 ]] && [[ "$Paired" != "true" ]]; then
+      break
+    fi
+    if [[ "$ReadsNum" -eq 1 ]]; then
+      ReadsToSplit="$ReadsToMap1"
+    else
+      ReadsToSplit="$ReadsToMap2"
+    fi
+    awk -v NumShards="$NumMappingShards" -v stem="$ShardStem" \
+    -v ReadsNum="$ReadsNum" '{if (NR % 4 == 1) {shard = ((NR - 1) / 4) % NumShards}
+    print > (stem "_" shard "_" ReadsNum ".fastq")}' "$ReadsToSplit" ||
+    { echo "Problem splitting $ReadsToSplit into shards." >&2 ; return 1 ; }
+  done
+
+  # Map the shards concurrently, each in a subshell with its own temporary
+  # files, then wait for all of them.
+  echo "Now mapping the reads in $NumMappingShards shards concurrently."
+  ShardPIDs=()
+  ShardBams=()
+  for ((shard = 0; shard < NumMappingShards; shard++)); do
+    ShardBam="$ShardStem"_"$shard".bam
+    ShardBams+=("$ShardBam")
+    if [[ ! -f "$ShardStem"_"$shard"_1.fastq ]]; then
+      # Fewer reads than shards.
+      continue
+    fi
+    (
+      MapOutAsSam="$ShardStem"_"$shard"_MapOut.sam
+      MapOutConversion1="$ShardStem"_"$shard"_MapOutStep1
+      MapOutConversion2="$ShardStem"_"$shard"_MapOutStep2
+      MapOutConversion3="$ShardStem"_"$shard"_MapOutStep3
+      SamtoolsSortFile="$ShardStem"_"$shard"_SamtoolsSortFile
+      if [[ "$Paired" == "true" ]]; then
+        MapWithChosenMapper "$LocalRef" "$ShardBam" \
+        "$ShardStem"_"$shard"_1.fastq "$ShardStem"_"$shard"_2.fastq
+      else
+        MapWithChosenMapper "$LocalRef" "$ShardBam" \
+        "$ShardStem"_"$shard"_1.fastq
+      fi
+    ) &
+    ShardPIDs+=($!)
+  done
+  ShardFailed=false
+  for ShardPID in "${ShardPIDs[@]}"; do
+    wait "$ShardPID" || ShardFailed=true
+  done
+  if [[ "$ShardFailed" == "true" ]]; then
+    echo "Problem mapping one or more shards of the reads." >&2
+    return 1
+  fi
+
+  # Merge the sorted bams of the shards.
+  ExistingShardBams=()
+  for ShardBam in "${ShardBams[@]}"; do
+    if [[ -f "$ShardBam" ]]; then
+      ExistingShardBams+=("$ShardBam")
+    fi
+  done
+  RunTimed "$samtools" merge -f -@ "$SamtoolsExtraThreads" "$OutFileAsBam" \
+  "${ExistingShardBams[@]}" ||
+  { echo "Problem merging the bam files of the mapped shards." >&2 ;
+  return 1 ; }
+  rm -f "$ShardStem"_*
 }
 
 function map {
@@ -540,7 +878,7 @@ function map {
   fi
 
   # Index the ref
-  "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
+  RunTimed "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
   { echo 'Problem indexing the refererence with samtools. Quitting.' >&2 ; 
   return 1 ; }
 
@@ -552,56 +890,35 @@ function map {
     FinalConversionStepOut="$FinalOutBam"
   fi
 
-  if [[ "$Paired" == "true" ]]; then
-    # Map with the chosen mapper.
-    if [[ "$mapper" == "smalt" ]]; then
-      map_with_smalt "$ReadsToMap1" "$ReadsToMap2" "$LocalRef" \
-      "$FinalConversionStepOut" ||
-      { echo 'Problem mapping with smalt.' >&2 ; return 1 ; }
-    elif [[ "$mapper" == "bowtie" ]]; then
-      map_with_bowtie "$ReadsToMap1" "$ReadsToMap2" "$LocalRef" \
-      "$FinalConversionStepOut" ||
-      { echo 'Problem mapping with bowtie.' >&2 ; return 1 ; }
-    elif [[ "$mapper" == "bwa" ]]; then
-      map_with_bwa_mem "$ReadsToMap1" "$ReadsToMap2" "$LocalRef" \
-      "$FinalConversionStepOut" ||
-      { echo 'Problem mapping with bwa mem.' >&2 ; return 1 ; }
+  # Index the ref for the mapper, then map, either all the reads at once or in
+  # shards.
+  IndexRefForMapping "$LocalRef" || return 1
+  if [[ "$NumMappingShards" -gt 1 ]]; then
+    if [[ "$Paired" == "true" ]]; then
+      MapInShards "$LocalRef" "$FinalConversionStepOut" "$ReadsToMap1" \
+      "$ReadsToMap2" || return 1
     else
-      echo "Unrecognised value $mapper for the 'mapper' config file variable;"\
-      "possible values are 'smalt', 'bowtie' or 'bwa'." >&2
+      MapInShards "$LocalRef" "$FinalConversionStepOut" "$ReadsToMap1" ||
       return 1
     fi
+  elif [[ "$Paired" == "true" ]]; then
+    MapWithChosenMapper "$LocalRef" "$FinalConversionStepOut" "$ReadsToMap1" \
+    "$ReadsToMap2" || return 1
   else
-    # Map with the chosen mapper.
-    if [[ "$mapper" == "smalt" ]]; then
-      map_with_smalt_unpaired "$ReadsToMap1" "$LocalRef" \
-      "$FinalConversionStepOut" ||
-      { echo 'Problem mapping with smalt.' >&2 ; return 1 ; }
-    elif [[ "$mapper" == "bowtie" ]]; then
-      map_with_bowtie_unpaired "$ReadsToMap1" "$LocalRef" \
-      "$FinalConversionStepOut" ||
-      { echo 'Problem mapping with bowtie.' >&2 ; return 1 ; }
-    elif [[ "$mapper" == "bwa" ]]; then
-      map_with_bwa_mem_unpaired "$ReadsToMap1" "$LocalRef" \
-      "$FinalConversionStepOut" ||
-      { echo 'Problem mapping with bwa mem.' >&2 ; return 1 ; }
-    else
-      echo "Unrecognised value $mapper for the 'mapper' config file variable;"\
-      "possible values are 'smalt', 'bowtie' or 'bwa'." >&2
-      return 1
-    fi
+    MapWithChosenMapper "$LocalRef" "$FinalConversionStepOut" "$ReadsToMap1" ||
+    return 1
   fi
 
   # Deduplicate if desired
   if [[ "$deduplicate" == true ]]; then
-    $DeduplicationCommand REMOVE_DUPLICATES=True I="$FinalConversionStepOut" \
+    RunTimed $DeduplicationCommand REMOVE_DUPLICATES=True I="$FinalConversionStepOut" \
     O="$FinalOutBam" M="$DedupStats" &&
     ls "$FinalOutBam" > /dev/null ||
     { echo "Problem running $DeduplicationCommand" >&2 ; return 1 ; }
   fi
 
   # Index the bam
-  "$samtools" index "$FinalOutBam" ||
+  RunTimed "$samtools" index "$FinalOutBam" ||
   { echo "Problem running $samtools index" >&2 ; return 1 ; }
 
   # Stop here if desired
@@ -648,42 +965,71 @@ function ProcessBam {
   fi
   LocalRefName=$(awk '/^>/ {print substr($1,2)}' "$LocalRef")
   if [[ ! -f "$LocalRef".fai ]]; then
-    "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
+    RunTimed "$samtools" faidx "$LocalRef" && ls "$LocalRef".fai > /dev/null ||
     { echo 'Problem indexing the refererence with samtools.' >&2 ; 
     return 1 ; }
   fi
 
-  # Check at least one read was mapped
-  NumMappedReads=$("$samtools" view "$bam" | wc -l)
+  # Check at least one read was mapped, and calculate the normalised insert size
+  # distribution for paired reads - with pysam, in one pass through the bam, if
+  # desired.
+  if [[ "$BamStatsWithPysam" == "true" ]]; then
+    rm -f "$InsertSizeCounts"
+    if [[ "$Paired" == "true" ]]; then
+      NumMappedReads=$(RunTimed "$python" "$Code_GetBamReadStats" "$bam" \
+      -@ "$NumThreadsSamtools" --insert-size-counts "$InsertSizeCounts")
+    else
+      NumMappedReads=$(RunTimed "$python" "$Code_GetBamReadStats" "$bam" \
+      -@ "$NumThreadsSamtools")
+    fi || { echo "Problem running $Code_GetBamReadStats on $bam." >&2 ;
+    return 1 ; }
+  else
+    NumMappedReads=$(RunTimed "$samtools" view "$bam" | wc -l)
+  fi
   if [[ $NumMappedReads -eq 0 ]]; then
     echo "$bam is empty - no reads were mapped!" >&2
     return 3
   fi
-
-  # Calculate the normalised insert size distribution, for paired reads
   if [[ "$Paired" == "true" ]]; then 
-    "$samtools" view "$bam" | awk '{if ($9 > 0) print $9}' > "$InsertSizes1"
-    InsertCount=$(wc -l "$InsertSizes1" | awk '{print $1}')
-    if [[ $InsertCount -gt 0 ]]; then
-      echo "Insert size,Count,Unit-normalised count" > "$InsertSizeCounts"
-      sort -n "$InsertSizes1" | uniq -c > "$InsertSizes2"
-      awk '{print $2 "," $1 "," $1/'$InsertCount'}' "$InsertSizes2" >> \
-      "$InsertSizeCounts"
+    if [[ "$BamStatsWithPysam" == "true" ]]; then
+      HaveInsertSizes=false
+      [[ -f "$InsertSizeCounts" ]] && HaveInsertSizes=true
     else
+      RunTimed "$samtools" view "$bam" | awk '{if ($9 > 0) print $9}' > "$InsertSizes1"
+      InsertCount=$(wc -l "$InsertSizes1" | awk '{print $1}')
+      HaveInsertSizes=false
+      if [[ $InsertCount -gt 0 ]]; then
+        HaveInsertSizes=true
+        echo "Insert size,Count,Unit-normalised count" > "$InsertSizeCounts"
+        sort -n "$InsertSizes1" | uniq -c > "$InsertSizes2"
+        awk '{print $2 "," $1 "," $1/'$InsertCount'}' "$InsertSizes2" >> \
+        "$InsertSizeCounts"
+      fi
+    fi
+    if [[ "$HaveInsertSizes" != "true" ]]; then
       echo "Warning: no read in $bam was identified as having"\
       "positive insert size. Unexpected. We'll skip making an insert size"\
       "distribution and continue."
     fi
   fi
 
-  # Generate pileup
-  echo 'Now calculating pileup - typically a slow step.'
-  "$samtools" mpileup $mpileupOptions -f "$LocalRef" "$bam" > \
-  "$PileupFile" || { echo 'Failed to generate pileup.' >&2 ; return 1 ; }
+  # Generate the base frequencies, either directly from the bam or via a pileup.
+  if [[ "$BaseFreqsFromBam" == "true" ]]; then
+    echo 'Now calculating base frequencies from the bam file.'
+    RunTimed "$python" "$Code_GetBaseFreqsFromBam" "$bam" "$LocalRef" $mpileupOptions \
+    --num-processes "$NumThreadsBaseFreqs" > "$BaseFreqs" || { echo 'Problem' \
+    "calculating base frequencies from $bam." >&2 ; return 1 ; }
+  else
 
-  # Generate the base frequencies
-  "$python" "$Code_AnalysePileup" "$PileupFile" "$LocalRef" > "$BaseFreqs" || \
-  { echo 'Problem analysing the pileup.' >&2 ; return 1 ; }
+    # Generate pileup
+    echo 'Now calculating pileup - typically a slow step.'
+    RunTimed "$samtools" mpileup $mpileupOptions -f "$LocalRef" "$bam" > \
+    "$PileupFile" || { echo 'Failed to generate pileup.' >&2 ; return 1 ; }
+
+    # Generate the base frequencies
+    RunTimed "$python" "$Code_AnalysePileup" "$PileupFile" "$LocalRef" > "$BaseFreqs" || \
+    { echo 'Problem analysing the pileup.' >&2 ; return 1 ; }
+  fi
 
   # Generate a version of the base freqs file with HXB2 coordinates, if desired.
   if [[ "$GiveHXB2coords" == "true" ]]; then
@@ -703,16 +1049,18 @@ function ProcessBam {
       cat "$HXB2file" >> "$RefWHXB2unaln"
     fi
 
-    "$mafft" $MafftArgsForPairwise "$RefWHXB2unaln" > "$RefWHXB2aln" ||
+    RunCached "$RefWHXB2aln" '' 1 "$RefWHXB2unaln" WriteStdoutTo \
+    "$RefWHXB2aln" RunTimed "$mafft" --thread "$NumThreadsMafft" \
+    $MafftArgsForPairwise "$RefWHXB2unaln" ||
     { echo "Problem running $mafft $MafftArgsForPairwise" >&2 ; return 1 ; }
-    "$python" "$Code_MergeBaseFreqsAndCoords" "$BaseFreqs" --pairwise-aln \
+    RunTimed "$python" "$Code_MergeBaseFreqsAndCoords" "$BaseFreqs" --pairwise-aln \
     "$RefWHXB2aln" > "$BaseFreqsWHXB2" ||
     { echo "Problem running $Code_MergeBaseFreqsAndCoords" >&2 ; return 1 ; }
 
   fi
 
   # Call the consensuses
-  "$python" "$Code_CallConsensus" "$BaseFreqs" "$MinCov1" "$MinCov2" "$MinBaseFrac" \
+  RunTimed "$python" "$Code_CallConsensus" "$BaseFreqs" "$MinCov1" "$MinCov2" "$MinBaseFrac" \
   --consensus-seq-name "$OutFileStem"'_consensus' --ref-seq-name "$LocalRefName" > \
   "$Consensus" || \
   { echo 'Problem calling the consensus.' >&2 ; return 1 ; }
@@ -779,18 +1127,158 @@ function MapUnpairedReadsStandAlone {
 
   # Do the mapping!
   echo 'Now mapping - typically a slow step.'
-  "$smalt" map $smaltMapOptions -o "$MapOutAsSam" "$smaltIndex" \
-  "$ReadsToMap" || { echo 'Smalt mapping failed.' >&2 ; return 1 ; }
+  "$smalt" map -n "$NumThreadsMapper" $smaltMapOptions -o "$MapOutAsSam" \
+  "$smaltIndex" "$ReadsToMap" || { echo 'Smalt mapping failed.' >&2 ;
+  return 1 ; }
 
   # Convert that sam file into a bam file. Thanks Nick Croucher!
-  "$samtools" view -bS $samtoolsReadFlags -t "$LocalRef".fai -o \
-  "$MapOutConversion1".bam "$MapOutAsSam" &&
-  "$samtools" sort "$MapOutConversion1".bam -o "$OutFileStem".bam -T "$SamtoolsSortFile" &&
+  "$samtools" view -bS -@ "$SamtoolsExtraThreads" $samtoolsReadFlags -t \
+  "$LocalRef".fai -o "$MapOutConversion1".bam "$MapOutAsSam" &&
+  "$samtools" sort -@ "$SamtoolsExtraThreads" "$MapOutConversion1".bam -o \
+  "$OutFileStem".bam -T "$SamtoolsSortFile" &&
   "$samtools" index "$FinalOutBam" || \
   { echo 'Failed to convert from sam to bam format.' >&2 ; return 1 ; }
 
 }
 
+# Find the reads (or read pairs) that look more like the contaminant contigs
+# than the reference, using the method chosen in the config file, writing their
+# names to "$BadReadsBaseName"_1.txt (and "$BadReadsBaseName"_2.txt for paired
+# reads). The reference and contaminant contigs should be in
+# $RefAndContaminantContigs.
+function FindContaminantReads {
+
+  # Check for the right number of args
+  if [[ "$#" -eq 2 ]]; then
+    PairedReads=true
+    ReadsToClean2=$2
+  elif [[ "$#" -eq 1 ]]; then
+    PairedReads=false
+  else
+    echo "FindContaminantReads function called with $# args; 1 or 2"\
+    "required. Quitting." >&2
+    return 1
+  fi
+  ReadsToClean1=$1
+
+  if [[ "$ReadCleaningMethod" == "kmers" ]]; then
+    # Find the reads (or read pairs) that share more k-mers with contaminant
+    # contigs than with the reference, without blasting.
+    echo 'Now classifying the reads by their k-mers.'
+    if $PairedReads; then
+      RunTimed "$python" "$Code_ClassifyReadsByKmers" "$RefAndContaminantContigs" \
+      "$RefName" "$BadReadsBaseName" "$ReadsToClean1" "$ReadsToClean2" -k "$CleaningKmerLength" \
+      -M "$CleaningMinSharedKmers" || \
+      { echo 'Problem finding contaminant read pairs using' \
+      "$Code_ClassifyReadsByKmers. Quitting." >&2 ; return 1 ; }
+    else
+      RunTimed "$python" "$Code_ClassifyReadsByKmers" "$RefAndContaminantContigs" \
+      "$RefName" "$BadReadsBaseName" "$ReadsToClean1" -k "$CleaningKmerLength" \
+      -M "$CleaningMinSharedKmers" || \
+      { echo 'Problem finding contaminant reads using' \
+      "$Code_ClassifyReadsByKmers. Quitting." >&2 ; return 1 ; }
+    fi
+
+  else
+    # Make a blast database out of the contaminant contigs and the ref.
+    RunCached "$BlastDB" '.*' 1 "$RefAndContaminantContigs" \
+    RunTimed "$BlastDBcommand" -dbtype nucl -in "$RefAndContaminantContigs" \
+    -input_type fasta -out "$BlastDB" || \
+    { echo 'Problem creating a blast database. Quitting.' >&2 ; return 1 ; }
+
+    # Convert fastq to fasta, keeping only one read of each sequence if
+    # desired. The blast hits are then given to the other reads too when
+    # finding the best hits.
+    if [[ "$BlastDistinctReadSeqsOnly" == "true" ]]; then
+      rm -f "$reads1duplicates" "$reads2duplicates"
+      DuplicatesOption1="--deduplicate=$reads1duplicates"
+      DuplicatesOption2="--deduplicate=$reads2duplicates"
+      ExpandDuplicatesOption="--expand-duplicates=$reads1duplicates"
+      PairDuplicatesOptions="--duplicates-1=$reads1duplicates \
+      --duplicates-2=$reads2duplicates"
+    else
+      DuplicatesOption1=''
+      DuplicatesOption2=''
+      ExpandDuplicatesOption=''
+      PairDuplicatesOptions=''
+    fi
+    RunTimed "$python" "$Code_ConvertFastqToFasta" "$ReadsToClean1" "$reads1asFasta" \
+    $DuplicatesOption1 || \
+      { echo 'Problem converting the reads from fastq to fasta. Quitting.' >&2 ; \
+      return 1 ; }
+    if $PairedReads; then
+      RunTimed "$python" "$Code_ConvertFastqToFasta" "$ReadsToClean2" "$reads2asFasta" \
+      $DuplicatesOption2 || \
+      { echo 'Problem converting the reads from fastq to fasta. Quitting.' >&2 ; \
+      return 1 ; }
+    fi
+
+    # Blast reads and determine if they blast to something other than the reference
+    # Blast the reads.
+    echo 'Now blasting the reads - typically a slow step.'
+    if $PairedReads; then
+      # Paired reads: blast both sets of reads at once, sharing the threads,
+      # streaming the hits through named pipes straight into finding the read
+      # pairs that blast best to something other than the reference. (We
+      # redirect blast's output instead of using -out so that each pipe is
+      # opened, and so closed again, even if blast fails to start.)
+      NumThreadsBlastPerMate=$(( (NumThreadsBlast + 1) / 2 ))
+      rm -f "$reads1blastPipe" "$reads2blastPipe"
+      mkfifo "$reads1blastPipe" "$reads2blastPipe" || \
+      { echo 'Problem creating named pipes for the blast output. Quitting.' >&2 ;
+      return 1 ; }
+      RunTimed "$BlastNcommand" -query "$reads1asFasta" -db "$BlastDB" \
+      -num_threads "$NumThreadsBlastPerMate" -max_target_seqs 1 -outfmt \
+      '10 qacc sacc sseqid evalue pident qstart qend sstart send' > \
+      "$reads1blastPipe" &
+      Blast1PID=$!
+      RunTimed "$BlastNcommand" -query "$reads2asFasta" -db "$BlastDB" \
+      -num_threads "$NumThreadsBlastPerMate" -max_target_seqs 1 -outfmt \
+      '10 qacc sacc sseqid evalue pident qstart qend sstart send' > \
+      "$reads2blastPipe" &
+      Blast2PID=$!
+      RunTimed "$python" "$Code_FindContaminantReadPairsFromBlast" \
+      "$reads1blastPipe" "$reads2blastPipe" "$RefName" "$BadReadsBaseName" \
+      $PairDuplicatesOptions && ls "$BadReadsBaseName"_1.txt \
+      "$BadReadsBaseName"_2.txt > /dev/null 2>&1 || \
+      { echo 'Problem finding contaminant read pairs using' \
+      "$Code_FindContaminantReadPairsFromBlast. Quitting." >&2 ;
+      # Don't leave blast running, or waiting to open a pipe that will never be
+      # read.
+      kill "$Blast1PID" "$Blast2PID" 2> /dev/null ;
+      wait "$Blast1PID" "$Blast2PID" 2> /dev/null ;
+      rm -f "$reads1blastPipe" "$reads2blastPipe" ; return 1 ; }
+      wait "$Blast1PID" && wait "$Blast2PID" || \
+      { echo 'Problem blasting the reads. Quitting.' >&2 ;
+      wait "$Blast2PID" 2> /dev/null ;
+      rm -f "$reads1blastPipe" "$reads2blastPipe" ; return 1 ; }
+      rm "$reads1blastPipe" "$reads2blastPipe"
+    else
+      RunTimed "$BlastNcommand" -query "$reads1asFasta" -db "$BlastDB" \
+      -num_threads "$NumThreadsBlast" -out \
+      "$reads1blast1" -max_target_seqs 1 -outfmt \
+      '10 qacc sacc sseqid evalue pident qstart qend sstart send' || \
+      { echo 'Problem blasting' "$ReadsToClean1"'. Quitting.' >&2 ; return 1 ; }
+
+      # For multiple blast hits, keep the one with the highest evalue
+      # TODO: test what blast does with fasta headers that have comments in them -
+      # does it include them too?
+      RunTimed "$python" "$Code_KeepBestLinesInDataFile" "$reads1blast1" \
+      "$reads1blast2" $ExpandDuplicatesOption || 
+      { echo "Problem extracting the best blast hits using"\
+      "$Code_KeepBestLinesInDataFile. Quitting." >&2 ; return 1 ; }
+
+      # Unpaired reads: Find the reads which blast best to something other than the reference
+      RunTimed "$python" "$Code_FindContaminantReadPairs" --unpaired \
+      "$reads1blast2" "$RefName" "$BadReadsBaseName" && \
+      ls "$BadReadsBaseName"_1.txt > /dev/null 2>&1 || \
+      { echo 'Problem finding contaminant reads using' \
+      "$Code_FindContaminantReadPairs. Quitting." >&2 ; return 1 ; }
+    fi
+  fi
+
+}
+
 function GetHIVcontigs {
 
   # Check for the right number of args and assign them.
@@ -843,7 +1331,7 @@ function GetHIVcontigs {
   echo -n '' > "$BlastFile"
   for task in $BlastTasks; do 
     "$BlastNcommand" -query "$LongContigs" -db "$BlastDatabase" -task "$task" \
-    $ContigBlastArgs -outfmt \
+    -num_threads "$NumThreadsBlast" $ContigBlastArgs -outfmt \
     '10 qseqid sseqid evalue pident qlen qstart qend sstart send' \
     | awk -F, '($4/100 * ($7-$6+1))>='"$MinContigLength" >> "$BlastFile" || 
     { echo "Problem running $BlastNcommand on $LongContigs using -task $task." \
@@ -991,6 +1479,24 @@ function CheckConfig {
     "be either true or false."
     return 1
   fi
+  if [[ "$BlastDistinctReadSeqsOnly" != "true" ]] && \
+  [[ "$BlastDistinctReadSeqsOnly" != "false" ]]; then
+    echo "The 'BlastDistinctReadSeqsOnly' variable in the config file should"\
+    "be either true or false."
+    return 1
+  fi
+  if [[ "$CleanAfterMapping" != "true" ]] && \
+  [[ "$CleanAfterMapping" != "false" ]]; then
+    echo "The 'CleanAfterMapping' variable in the config file should"\
+    "be either true or false."
+    return 1
+  fi
+  if [[ "$ReadCleaningMethod" != "blast" ]] && \
+  [[ "$ReadCleaningMethod" != "kmers" ]]; then
+    echo "The 'ReadCleaningMethod' variable in the config file should be"\
+    "either 'blast' or 'kmers'."
+    return 1
+  fi
   if [[ "$remap" != "true" ]] && [[ "$remap" != "false" ]]; then
     echo "The 'remap' variable in the config file should"\
     "be either true or false."
@@ -1020,6 +1526,30 @@ function CheckConfig {
     "be either true or false."
     return 1
   fi
+  if [[ "$StreamSamToBam" != "true" ]] && \
+  [[ "$StreamSamToBam" != "false" ]]; then
+    echo "The 'StreamSamToBam' variable in the config file should"\
+    "be either true or false."
+    return 1
+  fi
+  if [[ "$BamStatsWithPysam" != "true" ]] && \
+  [[ "$BamStatsWithPysam" != "false" ]]; then
+    echo "The 'BamStatsWithPysam' variable in the config file should"\
+    "be either true or false."
+    return 1
+  fi
+  if [[ "$RecordTimings" != "true" ]] && \
+  [[ "$RecordTimings" != "false" ]]; then
+    echo "The 'RecordTimings' variable in the config file should"\
+    "be either true or false."
+    return 1
+  fi
+  if [[ "$BaseFreqsFromBam" != "true" ]] && \
+  [[ "$BaseFreqsFromBam" != "false" ]]; then
+    echo "The 'BaseFreqsFromBam' variable in the config file should"\
+    "be either true or false."
+    return 1
+  fi
 
   # Some checks only needed if we're mapping:
   if $CheckForMapping; then
@@ -1131,17 +1661,75 @@ function CheckConfig {
     if [[ "$GiveHXB2coords" == "true" ]]; then
       CheckHXB2fileExists
     fi
+
+    if [[ "$BamStatsWithPysam" == "true" ]]; then
+      "$python" -c 'import pysam' &> /dev/null || { echo "BamStatsWithPysam"\
+      "was set to true in the config file; this requires the python module"\
+      "pysam, which could not be imported using $python." >&2; return 1; }
+    fi
+
+    # Check the base frequencies can be calculated directly from the bam, if
+    # desired: BAQ is not implemented, and pysam is needed.
+    if [[ "$BaseFreqsFromBam" == "true" ]]; then
+      if ! [[ " $mpileupOptions " =~ " --no-BAQ " ]] && \
+      ! [[ " $mpileupOptions " =~ " -B " ]]; then
+        echo "BaseFreqsFromBam was set to true in the config file; this"\
+        "requires mpileupOptions to include --no-BAQ." >&2
+        return 1
+      fi
+      "$python" -c 'import pysam' &> /dev/null || { echo "BaseFreqsFromBam"\
+      "was set to true in the config file; this requires the python module"\
+      "pysam, which could not be imported using $python." >&2; return 1; }
+    fi
     
   fi
 
   # Check positive ints are positive ints
   NonNegativeIntRegex='^[0-9]+$'
-  if ! [[ "$NumThreadsTrimmomatic" =~ $NonNegativeIntRegex ]] || \
-  [[ "$NumThreadsTrimmomatic" -lt 1 ]]; then
-    echo "The 'NumThreadsTrimmomatic' variable in the config file should be an"\
+  if ! [[ "$NumThreads" =~ $NonNegativeIntRegex ]] || \
+  [[ "$NumThreads" -lt 1 ]]; then
+    echo "The 'NumThreads' variable in the config file should be an"\
     "integer greater than 0." >&2
     return 1
   fi
+  # Each per-tool number of threads left empty takes the value of NumThreads.
+  for NumThreadsVar in NumThreadsTrimmomatic NumThreadsMapper NumThreadsBlast \
+  NumThreadsSamtools NumThreadsMafft NumThreadsBaseFreqs; do
+    if [[ -z "${!NumThreadsVar:-}" ]]; then
+      printf -v "$NumThreadsVar" '%s' "$NumThreads"
+    elif ! [[ "${!NumThreadsVar}" =~ $NonNegativeIntRegex ]] || \
+    [[ "${!NumThreadsVar}" -lt 1 ]]; then
+      echo "The '$NumThreadsVar' variable in the config file should be an"\
+      "integer greater than 0, or empty to use the value of NumThreads." >&2
+      return 1
+    fi
+  done
+  # samtools' -@ option is the number of threads in addition to the main one.
+  SamtoolsExtraThreads=$((NumThreadsSamtools - 1))
+  if ! [[ "$NumMappingShards" =~ $NonNegativeIntRegex ]] || \
+  [[ "$NumMappingShards" -lt 1 ]]; then
+    echo "The 'NumMappingShards' variable in the config file should be an"\
+    "integer greater than 0." >&2
+    return 1
+  fi
+  if [[ -n "$CacheDir" ]]; then
+    mkdir -p "$CacheDir" && [[ -w "$CacheDir" ]] ||
+    { echo "The 'CacheDir' variable in the config file, $CacheDir, is not a"\
+    "writable directory." >&2 ; return 1 ; }
+    # Make the path absolute.
+    CacheDir=$(cd "$CacheDir" && pwd)
+    if ! [[ "$CacheMaxSizeMB" =~ $NonNegativeIntRegex ]] || \
+    [[ "$CacheMaxSizeMB" -lt 1 ]]; then
+      echo "The 'CacheMaxSizeMB' variable in the config file should be an"\
+      "integer greater than 0." >&2
+      return 1
+    fi
+  fi
+  if ! [[ "$SamtoolsSortMemPerThread" =~ ^[0-9]+[KMG]?$ ]]; then
+    echo "The 'SamtoolsSortMemPerThread' variable in the config file should be"\
+    "an integer, optionally followed by K, M or G." >&2
+    return 1
+  fi
   if ! [[ "$MinCov1" =~ $NonNegativeIntRegex ]] || \
   [[ "$MinCov1" -lt 1 ]]; then
     echo "The 'MinCov1' variable in the config file should be an"\
@@ -1154,6 +1742,14 @@ function CheckConfig {
     "integer greater than 0." >&2
     return 1
   fi
+  for KmerVar in CleaningKmerLength CleaningMinSharedKmers; do
+    if ! [[ "${!KmerVar}" =~ $NonNegativeIntRegex ]] || \
+    [[ "${!KmerVar}" -lt 1 ]]; then
+      echo "The '$KmerVar' variable in the config file should be an"\
+      "integer greater than 0." >&2
+      return 1
+    fi
+  done
   if ! [[ "$MinContigLength" =~ $NonNegativeIntRegex ]] || \
   [[ "$MinContigLength" -lt 1 ]]; then
     echo "The 'MinContigLength' variable in the config file should be an"\
@@ -1179,6 +1775,19 @@ function CheckConfig {
     return 1
   fi
 
+  # Check the thresholds for screening reads after mapping are fractions.
+  for FracVar in ScreenReadsBelowIdentity ScreenReadsClippedFrac; do
+    FracVal="${!FracVar}"
+    if [[ "$FracVal" =~ $FloatRegex ]] && \
+    (( $(echo "$FracVal >= 0 && $FracVal <= 1" | bc -l) )); then
+      :
+    else
+      echo "The '$FracVar' variable in the config file should be a number"\
+      "between 0 and 1." >&2
+      return 1
+    fi
+  done
+
 }
 
 function CheckNonEmptyReads {
@@ -107,6 +107,17 @@ if [ ! -d "$InitDir" ]; then
 fi
 InitDir=$(cd "$InitDir"; pwd)
 
+# Record the resources used by each step, if desired. If we're being run by
+# something that records its own steps (and has told us where it records them),
+# add our records to the same file and leave the summary to it.
+TimingsFile="${SHIVER_TIMINGS_FILE:-}"
+SummariseTimings=false
+if [[ -z "$TimingsFile" ]] && [[ "$RecordTimings" == "true" ]]; then
+  TimingsFile="$TimingRecords"
+  rm -f "$TimingsFile"
+  SummariseTimings=true
+fi
+
 RefList="$InitDir"/'ExistingRefNamesSorted.txt'
 ExistingRefAlignment="$InitDir"/'ExistingRefAlignment.fasta'
 adapters="$InitDir"/'adapters.fasta'
@@ -190,7 +201,7 @@ elif [ "$NumSeqsInFastaFile" -eq 1 ]; then
 
   # Try to find the sequence in FastaFile in ExistingRefAlignment.
   RefName=$(awk '/^>/ {print substr($1,2)}' "$FastaFile")
-  "$python" "$Code_FindSeqsInFasta" "$ExistingRefAlignment" -g -N "$RefName" > \
+  RunTimed "$python" "$Code_FindSeqsInFasta" "$ExistingRefAlignment" -g -I -N "$RefName" > \
   "$RefFromAlignment" || \
   { echo "Could not find seq $RefName in $ExistingRefAlignment; that's OK," \
   'but after mapping we will not be able to produce a version of the' \
@@ -199,7 +210,7 @@ elif [ "$NumSeqsInFastaFile" -eq 1 ]; then
 
   # Compare the sequence in FastaFile to the one in ExistingRefAlignment.
   if $RefIsInAlignment; then
-    equal=$("$python" "$Code_CheckFastaFileEquality" "$RefFromAlignment" "$FastaFile") ||
+    equal=$(RunTimed "$python" "$Code_CheckFastaFileEquality" "$RefFromAlignment" "$FastaFile") ||
     { echo 'Problem running' "$Code_CheckFastaFileEquality"'. Quitting.' >&2 ; \
     exit 1 ; }
     if [[ "$equal" == "false" ]]; then
@@ -225,7 +236,7 @@ elif [ "$NumSeqsInFastaFile" -eq 1 ]; then
   # Extract those contigs that have a blast hit.
   NumHIVContigsOrig=$(wc -w "$HIVContigsListOrig" | awk '{print $1}')
   if [[ $NumHIVContigsOrig -gt 0 ]]; then
-    "$python" "$Code_FindSeqsInFasta" "$RawContigsFile" -F "$HIVContigsListOrig" > \
+    RunTimed "$python" "$Code_FindSeqsInFasta" "$RawContigsFile" -F "$HIVContigsListOrig" > \
     "$RawContigFile2" || \
     { echo 'Problem extracting the HIV contigs. Quitting.' >&2 ; exit 1 ; }
   fi
@@ -256,16 +267,16 @@ else
   # ContigToRefAlignment, and check that they are the same as in
   # ExistingRefAlignment. Also extract just the contigs, stripping gaps, ready
   # for later.
-  "$python" "$Code_FindSeqsInFasta" "$ContigToRefAlignment" -F "$HIVContigsListUser" -v > \
+  RunTimed "$python" "$Code_FindSeqsInFasta" "$ContigToRefAlignment" -F "$HIVContigsListUser" -v > \
   "$TempRefAlignment" &&
-  "$python" "$Code_FindSeqsInFasta" "$ContigToRefAlignment" -F "$HIVContigsListUser" -g > \
+  RunTimed "$python" "$Code_FindSeqsInFasta" "$ContigToRefAlignment" -F "$HIVContigsListUser" -g > \
   "$RawContigFile2" || { echo 'Problem separating the contigs and existing'\
   "refs in $ContigToRefAlignment. Quitting." >&2 ; exit 1 ; }
-  "$python" "$Code_RemoveBlankCols" "$TempRefAlignment" > "$AlignmentForTesting" || \
+  RunTimed "$python" "$Code_RemoveBlankCols" "$TempRefAlignment" > "$AlignmentForTesting" || \
   { echo "Problem removing pure-gap columns from $TempRefAlignment (which was"\
   "created by removing the contigs from $ContigToRefAlignment - that's"\
   "probably the problematic file). Quitting." >&2 ; exit 1; }
-  equal=$("$python" "$Code_CheckFastaFileEquality" "$AlignmentForTesting" \
+  equal=$(RunTimed "$python" "$Code_CheckFastaFileEquality" "$AlignmentForTesting" \
   "$ExistingRefAlignment") || { echo "Problem running"\
   "$Code_CheckFastaFileEquality. Quitting." >&2 ; exit 1 ; }
   if [[ "$equal" == "false" ]]; then
@@ -282,7 +293,7 @@ else
 
   # Construct the tailored ref
   HIVcontigNames=$(cat "$HIVContigsListUser")
-  "$python" "$Code_ConstructRef" "$ContigToRefAlignment" "$GappyRefWithExtraSeq" \
+  RunTimed "$python" "$Code_ConstructRef" "$ContigToRefAlignment" "$GappyRefWithExtraSeq" \
   $HIVcontigNames || \
   { echo 'Failed to construct a ref from the alignment. Quitting.' >&2 ; \
   exit 1 ; }
@@ -291,7 +302,7 @@ else
   awk '/^>/{if(N)exit;++N;} {print;}' "$GappyRefWithExtraSeq" > "$RefWithGaps"
 
   # Remove any gaps from the reference
-  "$python" "$Code_UngapFasta" "$RefWithGaps" > "$TheRef" || \
+  RunTimed "$python" "$Code_UngapFasta" "$RefWithGaps" > "$TheRef" || \
   { echo 'Gap stripping code failed. Quitting.' >&2 ; exit 1 ; }
 
   RefName=$(awk '/^>/ {print substr($1,2)}' "$TheRef")
@@ -369,11 +380,11 @@ HaveModifiedReads=false
 if [[ "$TrimReadsForAdaptersAndQual" == "true" ]]; then
   # Trim adapters and low-quality bases
   echo 'Now trimming reads - typically a slow step.'
-  $trimmomatic PE -quiet -threads $NumThreadsTrimmomatic \
+  RunTimed $trimmomatic PE -quiet -threads $NumThreadsTrimmomatic \
   "$reads1" "$reads2" "$reads1trim1" "$reads1trimmings" "$reads2trim1" \
   "$reads2trimmings" ILLUMINACLIP:"$adapters":"$IlluminaClipParams" \
   $BaseQualityParams || \
-  $trimmomatic PE -threads $NumThreadsTrimmomatic \
+  RunTimed $trimmomatic PE -threads $NumThreadsTrimmomatic \
   "$reads1" "$reads2" "$reads1trim1" "$reads1trimmings" "$reads2trim1" \
   "$reads2trimmings" ILLUMINACLIP:"$adapters":"$IlluminaClipParams" \
   $BaseQualityParams || { echo 'Problem running trimmomatic. Quitting.' >&2 ; \
@@ -387,7 +398,7 @@ fi
 if [[ "$TrimReadsForPrimers" == "true" ]]; then
 
   # Trim primers for paired reads
-  "$fastaq" 'sequence_trim' --revcomp "$reads1" "$reads2" "$reads1trim2" \
+  RunTimed "$fastaq" 'sequence_trim' --revcomp "$reads1" "$reads2" "$reads1trim2" \
   "$reads2trim2" "$PrimersToUse" || \
   { echo 'Problem running fastaq. Quitting.' >&2 ; exit 1 ; }
   echo "fastaq completed successfully."
@@ -405,6 +416,10 @@ if $HaveModifiedReads; then
   { echo 'No reads left after trimming. Quitting.' >&2; exit 3; }
 fi
 
+# Whether we're looking for contaminant reads only after mapping, among those
+# that map poorly; set below.
+ScreenAfterMapping=false
+
 # If RawContigsFile is empty we cannot do read cleaning, so switch it from true
 # to false if necessary, and warn.
 if [[ "$CleanReads" == "true" ]]; then
@@ -467,7 +482,7 @@ else
   # ...and now remove from these contigs those that are too short, leaving only
   # contaminants.
   if [ "$NumContaminantContigs" -gt 0 ]; then
-    "$python" "$Code_FindSeqsInFasta" "$RawContigsFile" -F "$DiscardedContigNames" \
+    RunTimed "$python" "$Code_FindSeqsInFasta" "$RawContigsFile" -F "$DiscardedContigNames" \
     --min-length "$MinContigLength" > "$RefAndContaminantContigs" ||
     { echo "Problem extracting contaminant contigs from $RawContigsFile." \
     "Quitting." >&2; exit 1; }
@@ -500,95 +515,18 @@ else
   # We enter this scope if there are some contaminant contigs:
   else
 
-    # Make a blast database out of the contaminant contigs and the ref.
+    # Add the ref to the contaminant contigs: reads are compared to all of them.
     cat "$TheRef" >> "$RefAndContaminantContigs"
-    "$BlastDBcommand" -dbtype nucl -in "$RefAndContaminantContigs" \
-    -input_type fasta -out "$BlastDB" || \
-    { echo 'Problem creating a blast database. Quitting.' >&2 ; exit 1 ; }
-
-    # Convert fastq to fasta.
-    "$python" "$Code_ConvertFastqToFasta" "$reads1" "$reads1asFasta" || \
-      { echo 'Problem converting the reads from fastq to fasta. Quitting.' >&2 ; \
-      exit 1 ; }
-    if $Paired; then
-      "$python" "$Code_ConvertFastqToFasta" "$reads2" "$reads2asFasta" || \
-      { echo 'Problem converting the reads from fastq to fasta. Quitting.' >&2 ; \
-      exit 1 ; }
-    fi
-
-    # Blast reads and determine if they blast to something other than the reference
-    # Blast the reads.
-    echo 'Now blasting the reads - typically a slow step.'
-    "$BlastNcommand" -query "$reads1asFasta" -db "$BlastDB" -out \
-    "$reads1blast1" -max_target_seqs 1 -outfmt \
-    '10 qacc sacc sseqid evalue pident qstart qend sstart send' || \
-    { echo 'Problem blasting' "$ContigFile"'. Quitting.' >&2 ; exit 1 ; }
-    if $Paired; then
-      "$BlastNcommand" -query "$reads2asFasta" -db "$BlastDB" -out \
-      "$reads2blast1" -max_target_seqs 1 -outfmt \
-      '10 qacc sacc sseqid evalue pident qstart qend sstart send' || \
-      { echo 'Problem blasting' "$ContigFile"'. Quitting.' >&2 ; exit 1 ; }
-    fi
 
-    # For multiple blast hits, keep the one with the highest evalue
-    # TODO: test what blast does with fasta headers that have comments in them -
-    # does it include them too?
-    "$python" "$Code_KeepBestLinesInDataFile" "$reads1blast1" "$reads1blast2" || 
-    { echo "Problem extracting the best blast hits using"\
-    "$Code_KeepBestLinesInDataFile. Quitting." >&2 ; exit 1 ; }
-    if $Paired; then
-      "$python" "$Code_KeepBestLinesInDataFile" "$reads2blast1" "$reads2blast2" || 
-      { echo "Problem extracting the best blast hits using"\
-      "$Code_KeepBestLinesInDataFile. Quitting." >&2 ; exit 1 ; }
-    fi
-
-    if $Paired; then
-      # Paired reads: Find the read pairs that blast best to something other than the reference.
-      "$python" "$Code_FindContaminantReadPairs" "$reads1blast2" "$reads2blast2" \
-      "$RefName" "$BadReadsBaseName" && ls "$BadReadsBaseName"_1.txt \
-      "$BadReadsBaseName"_2.txt > /dev/null 2>&1 || \
-      { echo 'Problem finding contaminant read pairs using' \
-      "$Code_FindContaminantReadPairs. Quitting." >&2 ; exit 1 ; }
+    if [[ "$CleanAfterMapping" == "true" ]]; then
+      # Contaminant reads will be looked for after mapping, among the reads
+      # that map poorly. Until then we have none.
+      ScreenAfterMapping=true
+      echo -n > "$BadReadsBaseName"_1.txt
+    elif $Paired; then
+      FindContaminantReads "$reads1" "$reads2" || exit 1
     else
-      # Unpaired reads: Find the reads which blast best to something other than the reference
-      # Check that the file exists
-      if [ ! -f "$reads1blast2" ]; then
-        echo "Error: '$reads1blast2' does not exist or is not a file. Quitting." >&2
-        exit 1
-      fi
-
-      # Assign columns
-      column_qacc=1
-      column_sacc=2
-      column_evalue=4
-
-      ContaminantReads=()
-
-      while IFS=',' read -r -a columns; do
-        qacc="${columns[$column_qacc-1]}"
-        sacc="${columns[$column_sacc-1]}"
-        evalue="${columns[$column_evalue-1]}"
-
-        if [ -z "${qacc+x}" ] || [ -z "${sacc+x}" ] || [ -z "${evalue+x}" ]; then
-          echo "Error: A column in '$reads1blast2' is missing or empty. Quitting." >&2
-          exit 1
-        fi
-
-        # Check for hits
-        if [ "$sacc" != "$RefName" ]; then
-          ContaminantReads+=("$qacc")
-        fi
-      done < "$reads1blast2"
-
-      # Write the output
-      OutFile_reads="$BadReadsBaseName"_1.txt
-      HaveSomeReads="${#ContaminantReads[@]}"
-      if [ "$HaveSomeReads" -gt 0 ]; then
-        printf "%s\n" "${ContaminantReads[@]}" > "$OutFile_reads"
-      else
-        # Empty file created in the case of no contaminants
-        touch "$BadReadsBaseName"_1.txt
-      fi
+      FindContaminantReads "$reads1" || exit 1
     fi
 
     # If none of the read pairs blast better to contaminant contigs than the
@@ -596,11 +534,13 @@ else
     NumContaminantReads=$(wc -l "$BadReadsBaseName"_1.txt | \
     awk '{print $1}')
     if [ "$NumContaminantReads" -eq 0 ]; then
-      echo 'There are no contaminant read pairs.'
-      if [[ "$MapContaminantReads" == "true" ]]; then
-        # Create a blank mapping file to more easily keep track of the fact that
-        # there are no contaminant reads in this case.
-        echo -n > "$MappedContaminantReads"
+      if ! $ScreenAfterMapping; then
+        echo 'There are no contaminant read pairs.'
+        if [[ "$MapContaminantReads" == "true" ]]; then
+          # Create a blank mapping file to more easily keep track of the fact
+          # that there are no contaminant reads in this case.
+          echo -n > "$MappedContaminantReads"
+        fi
       fi
       if $HaveModifiedReads; then
         mv "$reads1" "$cleaned1reads"
@@ -630,12 +570,12 @@ else
       fi
 
       # Extract the non-contaminant read pairs
-      "$python" "$Code_FindReadsInFastq" -v -s "$reads1" "$BadReadsBaseName"_1.txt > \
+      RunTimed "$python" "$Code_FindReadsInFastq" -v -s "$reads1" "$BadReadsBaseName"_1.txt > \
       "$cleaned1reads" || \
       { echo 'Problem extracting the non-contaminant reads using' \
       "$Code_FindReadsInFastq"'. Quitting.' >&2 ; exit 1 ; }
       if $Paired; then
-        "$python" "$Code_FindReadsInFastq" -v -s "$reads2" "$BadReadsBaseName"_2.txt > \
+        RunTimed "$python" "$Code_FindReadsInFastq" -v -s "$reads2" "$BadReadsBaseName"_2.txt > \
         "$cleaned2reads" || \
         { echo 'Problem extracting the non-contaminant reads using' \
         "$Code_FindReadsInFastq"'. Quitting.' >&2 ; exit 1 ; }
@@ -648,11 +588,11 @@ else
       # Map the contaminant reads to the reference, to measure how useful the
       # cleaning procedure was.
       if [[ "$MapContaminantReads" == "true" ]]; then
-        "$python" "$Code_FindReadsInFastq" -s "$reads1" "$BadReadsBaseName"_1.txt > \
+        RunTimed "$python" "$Code_FindReadsInFastq" -s "$reads1" "$BadReadsBaseName"_1.txt > \
         "$BadReadsBaseName"_1.fastq &&
         BamOnly=true
         if $Paired; then
-          "$python" "$Code_FindReadsInFastq" -s "$reads2" "$BadReadsBaseName"_2.txt > \
+          RunTimed "$python" "$Code_FindReadsInFastq" -s "$reads2" "$BadReadsBaseName"_2.txt > \
           "$BadReadsBaseName"_2.fastq || \
           { echo 'Problem extracting the contaminant reads using' \
           "$Code_FindReadsInFastq. Quitting." >&2 ; exit 1 ; }
@@ -687,14 +627,108 @@ fi
 
 OldMafft=false
 
-# Do the mapping
-BamOnly=false
+# Do the mapping. If we're looking for contaminant reads after mapping, stop
+# at the bam file.
+BamOnly=$ScreenAfterMapping
 if $Paired; then
   map "$TheRef" "$SID" "$BamOnly" "$cleaned1reads" "$cleaned2reads" 
 else 
   map "$TheRef" "$SID" "$BamOnly" "$cleaned1reads"
 fi
 MapStatus=$?
+
+# Look for contaminant reads among those that did not map well, remove them
+# from the bam file and from the reads (for remapping), then process the bam.
+if $ScreenAfterMapping && [[ $MapStatus == 0 ]]; then
+
+  echo 'Now looking for contaminant reads among those that mapped poorly.'
+  if $Paired; then
+    PairedOption='--paired'
+  else
+    PairedOption=''
+  fi
+  RunTimed "$python" "$Code_FindWellMappedReads" "$TheRef" "$SID.bam" \
+  "$WellMappedReadNames" --min-identity "$ScreenReadsBelowIdentity" \
+  --max-clipped-frac "$ScreenReadsClippedFrac" $PairedOption || \
+  { echo "Problem finding the reads that mapped well using" \
+  "$Code_FindWellMappedReads. Quitting." >&2 ; exit 1 ; }
+  RunTimed "$python" "$Code_FindReadsInFastq" -v --ignore-mate-suffix \
+  "$cleaned1reads" "$WellMappedReadNames" > "$SuspiciousReadsBaseName"_1.fastq \
+  || { echo 'Problem extracting the poorly mapped reads using' \
+  "$Code_FindReadsInFastq"'. Quitting.' >&2 ; exit 1 ; }
+  if $Paired; then
+    RunTimed "$python" "$Code_FindReadsInFastq" -v --ignore-mate-suffix \
+    "$cleaned2reads" "$WellMappedReadNames" > \
+    "$SuspiciousReadsBaseName"_2.fastq || { echo 'Problem extracting the' \
+    'poorly mapped reads using' "$Code_FindReadsInFastq"'. Quitting.' >&2 ;
+    exit 1 ; }
+  fi
+
+  NumSuspiciousReadsTimes4=$(wc -l "$SuspiciousReadsBaseName"_1.fastq | \
+  awk '{print $1}')
+  echo "$((NumSuspiciousReadsTimes4 / 4)) reads (or read pairs) will be" \
+  "checked for contamination."
+  if [[ $NumSuspiciousReadsTimes4 -eq 0 ]]; then
+    echo -n > "$BadReadsBaseName"_1.txt
+  elif $Paired; then
+    FindContaminantReads "$SuspiciousReadsBaseName"_1.fastq \
+    "$SuspiciousReadsBaseName"_2.fastq || exit 1
+  else
+    FindContaminantReads "$SuspiciousReadsBaseName"_1.fastq || exit 1
+  fi
+
+  NumContaminantReads=$(wc -l "$BadReadsBaseName"_1.txt | awk '{print $1}')
+  if [ "$NumContaminantReads" -eq 0 ]; then
+    echo 'There are no contaminant read pairs.'
+    if [[ "$MapContaminantReads" == "true" ]]; then
+      # Create a blank mapping file to more easily keep track of the fact that
+      # there are no contaminant reads in this case.
+      echo -n > "$MappedContaminantReads"
+    fi
+  else
+
+    # Remove the contaminant reads (both reads of contaminant pairs) from the
+    # bam, keeping those removed if desired, to measure how useful the cleaning
+    # procedure was.
+    if [[ "$MapContaminantReads" == "true" ]]; then
+      RemovedReadsOption="--removed-reads-bam=$MappedContaminantReads.bam"
+    else
+      RemovedReadsOption=''
+    fi
+    RunTimed "$python" "$Code_RemoveNamedReadsFromBam" "$SID.bam" \
+    "$BadReadsBaseName"_1.txt "$ScreenedBam" $RemovedReadsOption &&
+    mv "$ScreenedBam" "$SID.bam" &&
+    RunTimed "$samtools" index "$SID.bam" || \
+    { echo 'Problem removing the contaminant reads from' "$SID.bam" \
+    'using' "$Code_RemoveNamedReadsFromBam"'. Quitting.' >&2 ; exit 1 ; }
+
+    # Remove them from the reads too, which become the cleaned reads.
+    NewCleaned1reads="$SID$ReadsPreMapping1Suffix"
+    NewCleaned2reads="$SID$ReadsPreMapping2Suffix"
+    if [[ "$KeepPreMappingReads" == "false" ]]; then
+      NewCleaned1reads="temp_$NewCleaned1reads"
+      NewCleaned2reads="temp_$NewCleaned2reads"
+    fi
+    RunTimed "$python" "$Code_FindReadsInFastq" -v -s "$cleaned1reads" \
+    "$BadReadsBaseName"_1.txt > "$ScreenedReads1" &&
+    mv "$ScreenedReads1" "$NewCleaned1reads" || \
+    { echo 'Problem extracting the non-contaminant reads using' \
+    "$Code_FindReadsInFastq"'. Quitting.' >&2 ; exit 1 ; }
+    cleaned1reads="$NewCleaned1reads"
+    if $Paired; then
+      RunTimed "$python" "$Code_FindReadsInFastq" -v -s "$cleaned2reads" \
+      "$BadReadsBaseName"_2.txt > "$ScreenedReads2" &&
+      mv "$ScreenedReads2" "$NewCleaned2reads" || \
+      { echo 'Problem extracting the non-contaminant reads using' \
+      "$Code_FindReadsInFastq"'. Quitting.' >&2 ; exit 1 ; }
+      cleaned2reads="$NewCleaned2reads"
+    fi
+  fi
+
+  ProcessBam "$SID.bam" "$TheRef" "$SID" "$Paired"
+  MapStatus=$?
+fi
+
 if [[ $MapStatus == 3 ]]; then
   echo "Quitting." >&2
   exit 3
@@ -706,13 +740,13 @@ fi
 # Add gaps and excise unique insertions, to allow this consensus to be added to
 # a global alignment with others.
 if $RefIsInAlignment; then
-  "$python" "$Code_MergeAlignments" "$GlobalAlignExcisionFlag" -L "$CoordsDict" \
+  RunTimed "$python" "$Code_MergeAlignments" "$GlobalAlignExcisionFlag" -L "$CoordsDict" \
   "$TempRefAlignment" "$consensus" > "$ConsensusForGlobalAln" ||
   { echo 'Problem translating the coordinates of the consensus for the'\
   'global alignment. Quitting.' >&2 ; exit 1 ; }
 
   # Add the global alignment coordinates to the base frequencies file.
-  "$python" "$Code_MergeBaseFreqsAndCoords" "$BaseFreqs" -C "$CoordsDict" > \
+  RunTimed "$python" "$Code_MergeBaseFreqsAndCoords" "$BaseFreqs" -C "$CoordsDict" > \
   "$BaseFreqsWGlobal" || { echo 'Problem adding the global alignment'\
   'coordinates to the base frequencies file. Quitting.' >&2 ; exit 1 ; }
 
@@ -729,7 +763,7 @@ if [[ "$remap" == "true" ]]; then
 
   # Fill in any gaps in the consensus with the corresponding part of the orginal
   # reference for mapping.
-  "$python" "$Code_FillConsensusGaps" "$consensus" '--output-seq-name' \
+  RunTimed "$python" "$Code_FillConsensusGaps" "$consensus" '--output-seq-name' \
   "$NewRefName" > "$NewRef" || { echo 'Problem'\
   'filling in gaps in the consensus with the corresponding part of the orginal'\
   'reference for mapping. Quitting.' >&2 ; exit 1 ; }
@@ -745,4 +779,11 @@ if [[ "$remap" == "true" ]]; then
     { echo 'Problem remapping to the consensus from the first round of mapping.'\
     'Quitting.' >&2 ; exit 1 ; }
   fi
-fi
\ No newline at end of file
+fi
+
+if $SummariseTimings; then
+  echo "Resources used by each step (also recorded in $SID$TimingsSuffix):"
+  "$python" "$Code_SummariseResourceUse" "$TimingsFile" --json-out \
+  "$SID$TimingsSuffix" || { echo 'Problem summarising the resources used by'\
+  'each step. Quitting.' >&2 ; exit 1 ; }
+fi
@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 from __future__ import print_function
 from six.moves import map, range
+import argparse
 import os.path
 import sys
 import collections
 import operator
 from AuxiliaryFunctions import ReadSequencesFromFile
+from ShiverFuncs import ParsePileupString, ParsePileupBytes
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -34,15 +36,26 @@ if __name__ == "__main__":
   RefGenomeExtension = '.fasta'
   ################################################################################
   
-  # Check this file is called from the command line with two arguments
-  if len(sys.argv) != 3:
-    print('This script,', os.path.basename(sys.argv[0])+', requires two',\
-    'arguments: firstly a pileup file, then EITHER a fasta file containing the',\
-    'reference OR a directory of reference fasta files (one of which we want).', \
-    file=sys.stderr)
-    exit(1)
-  PileupFile = sys.argv[1]
-  ReferenceFileOrDir = sys.argv[2]
+  ExplanatoryMessage = '''Calculates the base frequencies at each position of
+  the reference from a pileup file. The second argument should be EITHER a fasta
+  file containing the reference OR a directory of reference fasta files (one of
+  which we want). Output is printed to stdout suitable for redirection into a
+  csv file.'''
+  
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('PileupFile')
+  parser.add_argument('ReferenceFileOrDir')
+  parser.add_argument('--engine', choices=['bytes', 'chars'], default='bytes',
+  help='''How to interpret each pileup string: 'bytes' (the default) cuts out
+  read-start, read-end and indel markers and counts bases in bulk; 'chars' is
+  the original implementation, visiting every character in turn, which is much
+  slower for deep coverage. The output is identical.''')
+  args = parser.parse_args()
+  PileupFile = args.PileupFile
+  ReferenceFileOrDir = args.ReferenceFileOrDir
+  UseBytesEngine = args.engine == 'bytes'
   
   # Check that the PileupFile exists and is a file
   if not os.path.isfile(PileupFile):
@@ -142,9 +155,36 @@ if __name__ == "__main__":
   
   
   
-  # Analyse the pileup file, line by line.
-  InfoFromAllPositions = []
-  with open(PileupFile, 'r') as f:
+  # We write the output as we go, rather than holding it all in memory, through
+  # a buffer that we flush every so many lines. Positions missing from the
+  # pileup file (because they have no coverage) are filled in as soon as we
+  # know they're missing.
+  OutputBuffer = []
+  OutputBufferMaxLines = 10000
+  def WriteLine(line):
+    OutputBuffer.append(line)
+    if len(OutputBuffer) >= OutputBufferMaxLines:
+      FlushOutput()
+  def FlushOutput():
+    if OutputBuffer:
+      sys.stdout.write('\n'.join(OutputBuffer) + '\n')
+      del OutputBuffer[:]
+  RightMostReferencePositionSoFar = 0
+  def WritePosition(SummaryList):
+    global RightMostReferencePositionSoFar
+    ReferencePosition = SummaryList[0]
+    if ReferencePosition != 'NA':
+      # Fill in positions skipped due to having no pileup information.
+      for SkippedPosition in range(RightMostReferencePositionSoFar+1,\
+      ReferencePosition):
+        WriteLine(str(SkippedPosition) + ',' + RefSeq[SkippedPosition-1] + \
+        ',' + MissingCoverageBaseCountsAsStr)
+      RightMostReferencePositionSoFar = ReferencePosition
+    WriteLine(','.join(map(str,SummaryList)))
+
+  # Analyse the pileup file, line by line. We read it as bytes: only the
+  # pileup string itself can be long, and the bytes engine works on it as is.
+  with open(PileupFile, 'rb') as f:
     for LineNumberMin1,line in enumerate(f):
   
       # Separate the line into fields based on whitespace
@@ -157,6 +197,7 @@ if __name__ == "__main__":
         print('Expected 4, 5 or 6 fields; encountered', NumFields, 'on line', \
         str(LineNumberMin1+1)+'.\nQuitting.', file=sys.stderr)
         exit(1)
+      RefNameHere = fields[0].decode()
   
       # If there's no coverage, check the fields are consistent with that:
       # depending on the version of samtools, there may or may not be a fifth
@@ -165,23 +206,23 @@ if __name__ == "__main__":
         NumReads = int(fields[3])
       except ValueError:
         print('On line', str(LineNumberMin1+1) + ', could not understand the',
-        'fourth field,', fields[3] + ', as an integer. Quitting.',
+        'fourth field,', fields[3].decode() + ', as an integer. Quitting.',
         file=sys.stderr)
         exit(1)
       assert NumReads >= 0, 'Number of mapped reads must be positive'
       NoCoverage = NumReads == 0
       if NumFields > 4:
         PileupString = fields[4]
-        if NoCoverage and PileupString != '*':
+        if NoCoverage and PileupString != b'*':
           print('On line ', LineNumberMin1+1, ', unexpected fifth field "',
-          PileupString, '" given that the number of mapped reads is zero (',
-          "expected either nothing or the placeholder '*'). Quitting.", sep='',
-          file=sys.stderr)
+          PileupString.decode(), '" given that the number of mapped reads is ',
+          "zero (expected either nothing or the placeholder '*'). Quitting.",
+          sep='', file=sys.stderr)
           exit(1)
   
       # On line 1, read the reference name. Check the file exists then read it in.
       if LineNumberMin1 == 0:
-        RefNameInPileup = fields[0]
+        RefNameInPileup = RefNameHere
         if RefMustBeFoundInDir:
           ReferenceFile = \
           os.path.join(ReferenceFileOrDir, RefNameInPileup+RefGenomeExtension)
@@ -193,17 +234,19 @@ if __name__ == "__main__":
           [(RefNameInFasta, RefSeq)], ReferenceLength = \
           ReadReferenceFromFile(ReferenceFile)
           RefSeq = RefSeq.upper()
+        WriteLine('position in ' + RefNameInPileup + ',base in ' + \
+        RefNameInPileup + ',A count,C count,G count,T count,gap count,N count')
   
       # On lines after line 1, check the reference is the same.
-      elif fields[0] != RefNameInPileup:
+      elif RefNameHere != RefNameInPileup:
         print('ERROR: a different reference is reported on the line\n'+\
-        line.rstrip()+'\nQuitting.', file=sys.stderr)
+        line.decode().rstrip()+'\nQuitting.', file=sys.stderr)
         exit(1)
   
       # Check the reference base here reported by the pileup file matches the one
       # in the reference file.
       BasePosition = int(fields[1])
-      ReferenceBase = fields[2].upper()
+      ReferenceBase = fields[2].decode().upper()
       if ReferenceBase != RefSeq[BasePosition-1]:
         print('The pileup file', PileupFile, 'reports a base "'+ReferenceBase+\
         '" at position', BasePosition, 'of the reference, but', ReferenceFile, \
@@ -214,62 +257,24 @@ if __name__ == "__main__":
       # appearing here and 'NA' for the frequencies (explained later), and skip.
       if NoCoverage:
         SummaryList = [BasePosition, ReferenceBase] + MissingCoverageBaseCounts
-        InfoFromAllPositions.append(SummaryList)
+        WritePosition(SummaryList)
         continue
   
       # We will only consider adding a new column(s) in between two reference
       # positions if more than half of the reads have an insertion here. If not,
       # we'll save time by not keeping track of the insertion information.
-      NumReadsWithInsertion = PileupString.count('+')
+      NumReadsWithInsertion = PileupString.count(b'+')
       NumReadsWithoutInsertion = NumReads - NumReadsWithInsertion
       MostReadsHaveInsertion = NumReadsWithInsertion > NumReadsWithoutInsertion
   
-      # Iterate through PileupString, modifying the 
-      # base counts by interpreting the pileup format appropriately.
-      # The character following a ^ should be ignored. $ should be ignored.
-      # After a '+' or '-' then a number, that number of characters should be
-      # ignored.
-      PileupString_OnlyBases = ''
-      SkipThisManyBases = 0
-      insertions = {}
-      for position,char in enumerate(PileupString):
-        if SkipThisManyBases > 0:
-          SkipThisManyBases -= 1
-          continue
-        if char == '$':
-          continue
-        if char == '^':
-          SkipThisManyBases = 1
-          continue
-        if char == '-' or char == '+':
-          # Next in the string will be an unknown number of digits, together
-          # comprising a number specifying the indel size.
-          IndelSizeNumDigits = 0
-          while PileupString[position+1+IndelSizeNumDigits] in \
-          ['0','1','2','3','4','5','6','7','8','9']:
-            IndelSizeNumDigits += 1
-          IndelSize = int(PileupString[position+1:position+1+IndelSizeNumDigits])
-          SkipThisManyBases = IndelSizeNumDigits+IndelSize
-  
-          # If most reads have insertions, we record the insertions: as a
-          # dictionary of lists, indexed by the length of the insertion. e.g.
-          # insertions[1] = ['A','A','C']; insertions[2] =  ['GG','CT'] etc.
-          if char == '+' and MostReadsHaveInsertion:
-            insertion = PileupString[position+1+IndelSizeNumDigits:\
-            position+1+IndelSizeNumDigits+IndelSize]
-            if IndelSize in insertions:
-              insertions[IndelSize].append(insertion)
-            else:
-              insertions[IndelSize] = [insertion]
-          continue
-  
-        # If we get to here, the character is just a regular base.
-        PileupString_OnlyBases += char
-  
-      # Start by counting all the different characters at this position.
-      # Ignore case.
-      PileupString_OnlyBases = PileupString_OnlyBases.upper()
-      BaseCounts = collections.Counter(PileupString_OnlyBases)
+      # Count the bases in the pileup string, interpreting the pileup format
+      # appropriately.
+      if UseBytesEngine:
+        BaseCounts, insertions = ParsePileupBytes(PileupString,
+        MostReadsHaveInsertion)
+      else:
+        BaseCounts, insertions = ParsePileupString(PileupString.decode(),
+        MostReadsHaveInsertion)
   
       # Process the base counts. ('False' means this position isn't an insertion.)
       SummaryList = ProcessBaseCounts(BaseCounts, BasePosition, ReferenceBase, \
@@ -284,7 +289,7 @@ if __name__ == "__main__":
         '.\nQuitting.', file=sys.stderr)
         exit(1)
   
-      InfoFromAllPositions.append(SummaryList)
+      WritePosition(SummaryList)
   
       # Find the most common insertion size here.
       MostCommonInsertionSize = 0
@@ -309,42 +314,19 @@ if __name__ == "__main__":
           BaseCounts = collections.Counter(BasesHere)
           SummaryList = ProcessBaseCounts(BaseCounts, BasePosition, \
           '-', True, ReferenceLength)
-          InfoFromAllPositions.append(SummaryList)
+          WritePosition(SummaryList)
   
   # Check we've got information from at least one position
-  if len(InfoFromAllPositions) == 0:
+  if RightMostReferencePositionSoFar == 0:
     print('Found no pileup information. Quitting.', file=sys.stderr)
     exit(1)
   
-  print('position in ', RefNameInPileup, ',base in ', RefNameInPileup, \
-  ',A count,C count,G count,T count,gap count,N count', sep='')
-  
-  RightMostReferencePositionSoFar = 0
-  for PositionWithPileup in InfoFromAllPositions:
-    ReferencePosition = PositionWithPileup[0]
-  
-    if ReferencePosition == 'NA':
-      # This is an insertion with respect to the reference  
-      print(','.join(map(str,PositionWithPileup)))
-      continue
-  
-    if ReferencePosition != RightMostReferencePositionSoFar+1:
-      # We have skipped some positions with respect to the reference, due to
-      # having no pileup information there. Let's fill in those blanks.  
-      for SkippedPosition in range(RightMostReferencePositionSoFar+1,\
-      ReferencePosition):
-        print(SkippedPosition, RefSeq[SkippedPosition-1], \
-        MissingCoverageBaseCountsAsStr, sep=',')
-  
-    print(','.join(map(str,PositionWithPileup)))
-    RightMostReferencePositionSoFar = ReferencePosition
-  
   # Include any missing lines after the data finishes
-  if RightMostReferencePositionSoFar != ReferenceLength:
-    for SkippedPosition in range(RightMostReferencePositionSoFar+1,\
-      ReferenceLength+1):
-        print(SkippedPosition, RefSeq[SkippedPosition-1], \
-        MissingCoverageBaseCountsAsStr, sep=',')
+  for SkippedPosition in range(RightMostReferencePositionSoFar+1,\
+  ReferenceLength+1):
+    WriteLine(str(SkippedPosition) + ',' + RefSeq[SkippedPosition-1] + ',' + \
+    MissingCoverageBaseCountsAsStr)
+  FlushOutput()
   
   
   '''
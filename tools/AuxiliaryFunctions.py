@@ -2,7 +2,12 @@ from __future__ import print_function, division
 import os
 import sys
 import collections
+import mmap
 from six.moves import range
+try:
+  from collections.abc import Mapping
+except ImportError:
+  from collections import Mapping
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -158,6 +163,42 @@ def PropagateNoCoverageChar(seq, LeftToRightDone=False):
   return ResultingSeq
 
 
+def IterateFastaRecords(DataFile):
+  '''Yields the name, title (the whole header line after the '>') and sequence
+  of each sequence in a fasta file, in order.
+
+  Whitespace at the start and end of each line is stripped, blank lines are
+  ignored, as is everything before the first sequence. Each sequence is joined
+  together from its lines once, rather than grown line by line.'''
+  title = None
+  with open(DataFile, 'r') as f:
+    for line in f:
+
+      # Strip whitespace
+      ThisLine = line.strip()
+
+      # Ignore blank lines
+      if ThisLine == '':
+        continue
+
+      # If we're at the start of a new sequence, finish the previous one and
+      # start collecting the lines of this one.
+      if ThisLine[0] == '>':
+        if title is not None:
+          yield name, title, ''.join(SeqLines)
+        title = ThisLine[1:]
+        name = title.split(None, 1)[0] if title.strip() else ''
+        SeqLines = []
+
+      # If we haven't read any sequences yet, there's nothing to do (i.e. we
+      # ignore everything that comes before the name of the first sequence).
+      elif title is not None:
+        SeqLines.append(ThisLine)
+
+  if title is not None:
+    yield name, title, ''.join(SeqLines)
+
+
 def ReadSequencesFromFile(DataFile,IsAlignment=True):
   '''Reads in all sequences from a file into a dictionary.'''
 
@@ -174,38 +215,12 @@ def ReadSequencesFromFile(DataFile,IsAlignment=True):
 
   # Read in all sequences
   AllSequences = {}
-  HaveReachedFirstSequence = False
-  with open(DataFile, 'r') as f:
-    for line in f:
-
-      # Strip whitespace
-      ThisLine = line.strip()
-
-      # Ignore blank lines
-      if ThisLine == '':
-        continue
-
-      # If we're at the start of a new sequence, check its name hasn't already
-      # been encountered, then start an empty string to which we'll append the
-      # sequence contained in subsequent lines of the file.
-      if ThisLine[0] == '>':
-        NameOfCurrentSequence = ThisLine[1:].split()[0]
-        if NameOfCurrentSequence in AllSequences:
-          print('Found a second sequence titled', NameOfCurrentSequence+\
-          '; sequence names should be unique.\nQuitting.', file=sys.stderr)
-          exit(1)
-        AllSequences[NameOfCurrentSequence] = ''
-        HaveReachedFirstSequence = True
-        continue
-
-      # If we're not at the start of a new sequence and we haven't read any
-      # sequences yet, there's nothing to do (i.e. we ignore everything that comes
-      # before the name of the first sequence).
-      elif not HaveReachedFirstSequence:
-        continue
-
-      # If we're here, we should read in sequence data.
-      AllSequences[NameOfCurrentSequence] += ThisLine
+  for NameOfCurrentSequence, title, seq in IterateFastaRecords(DataFile):
+    if NameOfCurrentSequence in AllSequences:
+      print('Found a second sequence titled', NameOfCurrentSequence+\
+      '; sequence names should be unique.\nQuitting.', file=sys.stderr)
+      exit(1)
+    AllSequences[NameOfCurrentSequence] = seq
 
 
   # Check we have at least one sequence
@@ -245,36 +260,8 @@ def ReadSequencesFromFile_ordered(DataFile,IsAlignment=True):
     exit(1)
 
   # Read in all sequences
-  AllSequences = []
-  HaveReachedFirstSequence = False
-  with open(DataFile, 'r') as f:
-    for line in f:
-
-      # Strip whitespace
-      ThisLine = line.strip()
-
-      # Ignore blank lines
-      if ThisLine == '':
-        continue
-
-      # If we're at the start of a new sequence, check its name hasn't already
-      # been encountered, then start an empty string to which we'll append the
-      # sequence contained in subsequent lines of the file.
-      if ThisLine[0] == '>':
-        NameOfCurrentSequence = ThisLine[1:].split()[0]
-        AllSequences.append([NameOfCurrentSequence,''])
-        HaveReachedFirstSequence = True
-        continue
-
-      # If we're not at the start of a new sequence and we haven't read any
-      # sequences yet, there's nothing to do (i.e. we ignore everything that comes
-      # before the name of the first sequence).
-      elif not HaveReachedFirstSequence:
-        continue
-
-      # If we're here, we should read in sequence data.
-      AllSequences[-1][1] += ThisLine
-
+  AllSequences = [[_name, _seq] for _name, _title, _seq in \
+  IterateFastaRecords(DataFile)]
 
   # Check we have at least one sequence
   if len(AllSequences) == 0:
@@ -288,7 +275,7 @@ def ReadSequencesFromFile_ordered(DataFile,IsAlignment=True):
     OtherSeqs = [_item[1] for _item in AllSequences[1:]]
     if not all(len(_OtherSeq) == FirstSeqLength for _OtherSeq in OtherSeqs):
       for [SeqName,seq] in AllSequences[1:]:
-        if len(item[1]) != FirstSeqLength:
+        if len(seq) != FirstSeqLength:
           print(SeqName, 'has length', len(seq), 'whereas', \
           FirstSeqName, 'has length', FirstSeqLength, \
       'Aligned sequences were expected.\nQuitting.', file=sys.stderr)
@@ -297,7 +284,140 @@ def ReadSequencesFromFile_ordered(DataFile,IsAlignment=True):
   return AllSequences, FirstSeqLength
 
 
-
+def IndexFasta(DataFile):
+  '''Scans a fasta file and returns an OrderedDict whose keys are the sequence
+  names and whose values are lists of the five numbers that samtools faidx
+  records for each sequence in a .fai file: the sequence length, the byte offset
+  of its first base, the number of bases per line and the number of bytes per
+  line (including the newline).
+
+  Such an index only works for sequences wrapped at the same width on every line
+  except the last. If that's not the case for every sequence, if there are
+  blank lines or other whitespace inside sequences, or if a name is duplicated,
+  we return None.'''
+  index = collections.OrderedDict()
+  with open(DataFile, 'rb') as f:
+    data = f.read()
+  if data.startswith(b'>'):
+    HeaderStart = 0
+  else:
+    HeaderStart = data.find(b'\n>') + 1
+    if HeaderStart == 0:
+      return index
+  while HeaderStart < len(data):
+    SeqStart = data.find(b'\n', HeaderStart) + 1
+    if SeqStart == 0:
+      SeqStart = len(data)
+    HeaderWords = data[HeaderStart + 1:SeqStart].split()
+    if not HeaderWords:
+      return None
+    name = HeaderWords[0].decode()
+    if name in index:
+      return None
+    NextHeaderStart = data.find(b'\n>', SeqStart - 1) + 1
+    if NextHeaderStart == 0:
+      NextHeaderStart = len(data)
+    lines = data[SeqStart:NextHeaderStart].split(b'\n')
+    while lines and lines[-1].strip() == b'':
+      lines.pop()
+    if lines:
+      LineWidth = len(lines[0]) + 1
+      LineBases = len(lines[0].rstrip(b'\r'))
+      length = LineBases * (len(lines) - 1) + len(lines[-1].rstrip(b'\r'))
+      if any(len(_line) != LineWidth - 1 for _line in lines[:-1]) or \
+      not 0 < len(lines[-1]) <= LineWidth - 1 or \
+      len(b''.join(data[SeqStart:NextHeaderStart].split())) != length:
+        return None
+    else:
+      LineWidth, LineBases, length = 0, 0, 0
+    index[name] = [length, SeqStart, LineBases, LineWidth]
+    HeaderStart = NextHeaderStart
+  return index
+
+
+def ReadFastaIndex(DataFile):
+  '''Reads the .fai index of a fasta file, returning it in the form returned by
+  IndexFasta, or None if there's no index or it's older than the fasta file.'''
+  IndexFile = DataFile + '.fai'
+  if not os.path.isfile(IndexFile) or \
+  os.path.getmtime(IndexFile) < os.path.getmtime(DataFile):
+    return None
+  index = collections.OrderedDict()
+  with open(IndexFile, 'r') as f:
+    for line in f:
+      fields = line.split('\t')
+      index[fields[0]] = [int(_field) for _field in fields[1:5]]
+  return index
+
+
+def GetFastaIndex(DataFile, WriteIndex=False):
+  '''Returns the index of a fasta file (see IndexFasta), using its .fai file if
+  that's up to date and otherwise scanning the fasta file. If WriteIndex is
+  True, in the latter case we also write the .fai file (if we can), for next
+  time. Returns None if the file can't be indexed.'''
+  index = ReadFastaIndex(DataFile)
+  if index is not None:
+    return index
+  index = IndexFasta(DataFile)
+  if index is not None and WriteIndex:
+    # Write to a temporary file then rename it, so that anything else reading
+    # the index at the same time never sees it half-written.
+    IndexFile = DataFile + '.fai'
+    TempIndexFile = IndexFile + '.' + str(os.getpid()) + '.tmp'
+    try:
+      with open(TempIndexFile, 'w') as f:
+        for name, entry in index.items():
+          f.write('\t'.join([name] + [str(_value) for _value in entry]) + '\n')
+      os.rename(TempIndexFile, IndexFile)
+    except (IOError, OSError):
+      print('Warning: could not write the index', IndexFile, file=sys.stderr)
+  return index
+
+
+class IndexedFasta(Mapping):
+  '''A read-only dictionary-like view of the sequences in an indexed fasta file,
+  keyed by name in file order. The file is memory-mapped, and each sequence is
+  only read (joining its lines) when it is looked up.'''
+
+  def __init__(self, DataFile, index=None):
+    if index is None:
+      index = GetFastaIndex(DataFile)
+      if index is None:
+        raise ValueError(DataFile + ' cannot be indexed.')
+    self.DataFile = DataFile
+    self.index = index
+    self._file = open(DataFile, 'rb')
+    if os.path.getsize(DataFile) > 0:
+      self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self._data = b''
+
+  def __getitem__(self, name):
+    length, offset, LineBases, LineWidth = self.index[name]
+    if length == 0:
+      return ''
+    NumFullLines, NumBasesInLastLine = divmod(length, LineBases)
+    end = offset + NumFullLines * LineWidth + NumBasesInLastLine
+    return self._data[offset:end].translate(None, b'\r\n').decode()
+
+  def __iter__(self):
+    return iter(self.index)
+
+  def __len__(self):
+    return len(self.index)
+
+  def title(self, name):
+    '''The whole header line (after the '>') of the named sequence.'''
+    HeaderEnd = self.index[name][1]
+    if self._data[HeaderEnd - 1:HeaderEnd] == b'\n':
+      HeaderEnd -= 1
+    HeaderStart = self._data.rfind(b'\n', 0, HeaderEnd) + 1
+    return self._data[HeaderStart + 1:HeaderEnd].strip().decode()
+
+  def close(self):
+    if not isinstance(self._data, bytes):
+      self._data.close()
+    self._file.close()
 
 
 def ReadPatientFile(OneLinePerPatientOnly, filename):
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import collections
+import sys
+import argparse
+import json
+import pysam
+from Bio import SeqIO
+from ShiverFuncs import BamQCStats, IterateReadsWithIdentity, \
+InsertSizeCountsCsv, PysamThreads
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''Reads a bam file (of reads mapped to a single
+  reference) once, and writes the output of GetCoverageFromBamFile.py,
+  FindClippingHotSpots.py and FindNumMappedBases.py for it, together with the
+  insert size distribution (as made by shiver) and a json file summarising all of
+  these and the number of mapped reads. The files written are OutFileStem
+  followed by _coverage.csv, _ClippingHotSpots.csv, _NumMappedBases.csv (a single
+  number, or with --identity-binning a csv file), _InsertSizeCounts.csv (if any
+  read has a positive insert size) and _BamQC.json.'''
+
+  # Define a function to check files exist, as a type for the argparse.
+  def File(MyFile):
+    if not os.path.isfile(MyFile):
+      raise argparse.ArgumentTypeError(MyFile+' does not exist or is not a file.')
+    return MyFile
+
+  # Define a comma-separated float pair object, as a type for the argparse.
+  def CommaSeparatedFloatPair(FloatPairAsString):
+    try:
+      values = FloatPairAsString.split(',')
+      assert len(values) == 2
+      values = [float(_value) for _value in values]
+    except:
+      raise argparse.ArgumentTypeError('Unable to understand ' +\
+      FloatPairAsString + ' as a comma-separated pair of floats.')
+    else:
+      return values
+
+  # Define a function to check ints are positive, as a type for the argparse.
+  def PositiveInt(MyInt):
+    try:
+      MyInt = int(MyInt)
+      assert MyInt > 0
+    except (ValueError, AssertionError):
+      raise argparse.ArgumentTypeError(str(MyInt) + ' is not a positive integer.')
+    return MyInt
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('BamFile', type=File)
+  parser.add_argument('OutFileStem')
+  parser.add_argument('-C', '--min-clip-length', type=int, default=1,
+  help='''As the MinClipLength argument of FindClippingHotSpots.py: don't count
+  clipped ends whose length is less than this (default 1).''')
+  parser.add_argument('-N', '--min-read-count', type=int, default=1, help='''As
+  for FindClippingHotSpots.py: don't report positions where the number of reads
+  clipped is less than this value (default 1).''')
+  parser.add_argument('-I', '--identity-binning', type=CommaSeparatedFloatPair,
+  help='''As for FindNumMappedBases.py: break down the number of mapped bases by
+  the identity of their reads. Requires --ref-file.''')
+  parser.add_argument('--use-md-tags', action='store_true', help='''For
+  --identity-binning, calculate read identities from the reads' MD tags (or NM
+  tags), where present, instead of comparing the reads to the reference.''')
+  parser.add_argument('-R', '--ref-file', type=File, help='''The file
+  containing the sequence of the reference (to which reads were mapped in the bam
+  file).''')
+  parser.add_argument('-@', '--threads', type=PositiveInt, default=1,
+  help='''The number of threads to use for decompressing the bam file (default
+  1).''')
+  args = parser.parse_args()
+
+  BamFile = pysam.AlignmentFile(args.BamFile, "rb",
+  threads=PysamThreads(args.threads))
+
+  # Find the reference in the bam file; there should only be one.
+  AllReferences = BamFile.references
+  if len(AllReferences) != 1:
+    print('Expected exactly one reference in', args.BamFile+'; found',\
+    str(len(AllReferences))+'.\nQuitting.', file=sys.stderr)
+    exit(1)
+  RefName = AllReferences[0]
+  RefLength = BamFile.lengths[0]
+
+  BinByIdentity = args.identity_binning != None
+  if BinByIdentity:
+
+    if args.ref_file == None:
+      print('The --identity-binning option requires the --ref-file option.', \
+      'Quitting.', file=sys.stderr)
+      exit(1)
+
+    SeqList = list(SeqIO.parse(open(args.ref_file), 'fasta'))
+    if len(SeqList) != 1:
+      print('There are', len(SeqList), 'sequences in', args.ref_file +\
+      '. There should be exactly 1. Quitting.', file=sys.stderr)
+      exit(1)
+    RefSeq = str(SeqList[0].seq)
+
+    Min, BinWidth = args.identity_binning
+    if not 0 <= Min < 1:
+      print('The minimum for the --identity-binning option must be', \
+      '0 <= Min < 1. Quitting.', file=sys.stderr)
+      exit(1)
+    if not 0 < BinWidth < 1. - Min:
+      print('The bin width for the --identity-binning option must be positive', \
+      'and less than one minus the minimum (so that there is at least one bin).',\
+      'Quitting.', file=sys.stderr)
+      exit(1)
+
+  # Read through the bam file once.
+  stats = BamQCStats(RefLength, args.min_clip_length, args.identity_binning)
+  if BinByIdentity:
+    stats.AddReads(IterateReadsWithIdentity(BamFile.fetch(RefName), RefSeq,
+    args.use_md_tags), WithIdentity=True)
+  else:
+    stats.AddReads(BamFile.fetch(RefName))
+  BamFile.close()
+
+  if stats.NumReadsWithMappedBases == 0:
+    print('Warning: no mapped reads found in', args.BamFile + '.',
+    file=sys.stderr)
+
+  def WriteLines(suffix, lines):
+    with open(args.OutFileStem + suffix, 'w') as f:
+      f.write('\n'.join(lines) + '\n')
+
+  WriteLines('_coverage.csv', stats.CoverageCsv())
+  WriteLines('_ClippingHotSpots.csv', stats.ClippingCsv(args.min_read_count))
+  if BinByIdentity:
+    WriteLines('_NumMappedBases.csv', stats.MappedBasesByIdentityCsv())
+  else:
+    WriteLines('_NumMappedBases.csv', [str(stats.NumMappedBases)])
+  if stats.InsertSizeCounts.sum() > 0:
+    WriteLines('_InsertSizeCounts.csv',
+    InsertSizeCountsCsv(stats.InsertSizeCounts))
+
+  summary = collections.OrderedDict([('BamFile', args.BamFile),
+  ('Reference', RefName)])
+  summary.update(stats.Summary())
+  with open(args.OutFileStem + '_BamQC.json', 'w') as f:
+    json.dump(summary, f, indent=2)
+    f.write('\n')
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from six.moves import range
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''Benchmarks the two engines AnalysePileup.py can use to
+  interpret pileup strings ('bytes' and 'chars'), on a synthetic pileup with very
+  high depth, and checks that they produce identical base frequency files. The
+  synthetic pileup contains mismatches, deletions, read starts (with arbitrary
+  mapping quality characters) and ends, and insertions and deletions of
+  different sizes, including positions where most reads have an insertion.'''
+
+  # Define a function to check ints are positive, as a type for the argparse.
+  def PositiveInt(MyInt):
+    try:
+      MyInt = int(MyInt)
+      assert MyInt > 0
+    except (ValueError, AssertionError):
+      raise argparse.ArgumentTypeError(str(MyInt) + ' is not a positive integer.')
+    return MyInt
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('-D', '--depth', type=PositiveInt, default=100000,
+  help='The number of reads covering each position (default 100000).')
+  parser.add_argument('-L', '--length', type=PositiveInt, default=100,
+  help='The length of the synthetic reference (default 100).')
+  parser.add_argument('-S', '--seed', type=int, default=1,
+  help='The seed for the random number generator (default 1).')
+  parser.add_argument('-K', '--keep-files', action='store_true',
+  help='''Don't delete the synthetic pileup, reference, and base frequency files
+  (we print the directory they're in).''')
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+  ThisDir = os.path.dirname(os.path.abspath(__file__))
+  AnalysePileup = os.path.join(ThisDir, 'AnalysePileup.py')
+  RefName = 'SyntheticRef'
+  bases = 'ACGT'
+  QualChars = [chr(_i) for _i in range(33, 127)]
+
+  def RandomIndel(sign):
+    size = random.choice([1, 1, 2, 3, 12])
+    return sign + str(size) + ''.join(random.choice('ACGTNacgtn') for _i in \
+    range(size))
+
+  def PileupToken(RefBase, InsertionFraction):
+    '''One read's contribution to the pileup string at this position.'''
+    r = random.random()
+    if r < 0.7:
+      token = random.choice('.,')
+    elif r < 0.85:
+      token = random.choice([_base for _base in bases + bases.lower() if \
+      _base.upper() != RefBase])
+    elif r < 0.9:
+      token = '*'
+    else:
+      token = random.choice('nN')
+    if random.random() < 0.01:
+      token = '^' + random.choice(QualChars) + token
+    if random.random() < 0.01:
+      token += '$'
+    if random.random() < InsertionFraction:
+      token += RandomIndel('+')
+    elif random.random() < 0.02:
+      token += RandomIndel('-')
+    return token
+
+  # Draw a pool of tokens for each kind of position once, and sample from them,
+  # to avoid spending longer generating the pileup than analysing it.
+  PoolSize = min(args.depth, 10000)
+  TokenPools = {}
+  for RefBase in bases:
+    for InsertionFraction in [0.01, 0.8]:
+      TokenPools[(RefBase, InsertionFraction)] = [PileupToken(RefBase, \
+      InsertionFraction) for _i in range(PoolSize)]
+
+  WorkingDir = tempfile.mkdtemp(prefix='BenchmarkAnalysePileup_')
+  RefFile = os.path.join(WorkingDir, 'ref.fasta')
+  PileupFile = os.path.join(WorkingDir, 'synthetic.pileup')
+  RefSeq = ''.join(random.choice(bases) for _i in range(args.length))
+  with open(RefFile, 'w') as f:
+    f.write('>' + RefName + '\n' + RefSeq + '\n')
+
+  print('Writing a synthetic pileup of depth', args.depth, 'and length',
+  args.length, 'to', PileupFile)
+  quals = 'I' * args.depth
+  with open(PileupFile, 'w') as f:
+    for PosMin1, RefBase in enumerate(RefSeq):
+      # Leave a gap in coverage, to check that gets filled in.
+      if args.length // 3 <= PosMin1 < args.length // 3 + 5:
+        continue
+      InsertionFraction = 0.8 if PosMin1 % 10 == 0 else 0.01
+      pool = TokenPools[(RefBase, InsertionFraction)]
+      PileupString = ''.join(random.choice(pool) for _i in range(args.depth))
+      f.write('\t'.join([RefName, str(PosMin1 + 1), RefBase, str(args.depth),
+      PileupString, quals]) + '\n')
+  print('Pileup file size:', os.path.getsize(PileupFile), 'bytes.')
+
+  outputs = {}
+  for engine in ['bytes', 'chars']:
+    OutFile = os.path.join(WorkingDir, 'BaseFreqs_' + engine + '.csv')
+    StartTime = time.time()
+    with open(OutFile, 'w') as f:
+      subprocess.check_call([sys.executable, AnalysePileup, PileupFile,
+      RefFile, '--engine', engine], stdout=f)
+    ElapsedTime = time.time() - StartTime
+    print('Engine', engine + ':', '%.2f' % ElapsedTime, 'seconds.')
+    with open(OutFile, 'r') as f:
+      outputs[engine] = f.read()
+
+  if outputs['bytes'] == outputs['chars']:
+    print('The two engines produced identical base frequency files.')
+    ExitStatus = 0
+  else:
+    print('ERROR: the two engines produced different base frequency files.',
+    file=sys.stderr)
+    ExitStatus = 1
+
+  if args.keep_files:
+    print('Files kept in', WorkingDir)
+  else:
+    shutil.rmtree(WorkingDir)
+  exit(ExitStatus)
@@ -4,10 +4,12 @@ from six.moves import zip, map
 import os.path
 import sys
 import itertools
-from AuxiliaryFunctions import ReverseIUPACdict2, PropagateNoCoverageChar
+from AuxiliaryFunctions import PropagateNoCoverageChar
 import argparse
 from Bio import SeqIO, Seq
 from re import sub
+import numpy as np
+from ShiverFuncs import CallConsensusFromCounts
 #
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -19,7 +21,9 @@ if __name__ == "__main__":
   This script interprets a base frequency file of the format produced by
   AnalysePileup.py and calls the consensus sequence, which is printed to stdout
   suitable for redirection to a fasta-format file. The consensus is printed with
-  the reference used for mapping, as a pairwise alignment.
+  the reference used for mapping, as a pairwise alignment. The consensus can be
+  called for several sets of thresholds at once with --thresholds, writing each
+  to its own file.
   '''
   ##
   ################################################################################
@@ -33,16 +37,25 @@ if __name__ == "__main__":
     if not os.path.isfile(MyFile):
       raise argparse.ArgumentTypeError(MyFile+' does not exist or is not a file.')
     return MyFile
+
+  # Define a function to check a threshold triple, as a type for the argparse.
+  def ThresholdTriple(MyTriple):
+    try:
+      MinCoverage, MinCovForUpper, MinFracToCall = MyTriple.split(',')
+      return int(MinCoverage), int(MinCovForUpper), float(MinFracToCall)
+    except ValueError:
+      raise argparse.ArgumentTypeError(MyTriple + ' is not of the form ' + \
+      'MinCoverage,MinCovForUpper,MinFracToCall, e.g. 15,30,0.5')
   
   # Set up the arguments for this script
   parser = argparse.ArgumentParser(description=ExplanatoryMessage)
   parser.add_argument('BaseFreqFile', type=File)
   parser.add_argument('MinCoverage', help='The minimum coverage (number of ' + \
   'reads at a given position in the genome) before a base is called. Below ' + \
-  'this we call "?" instead of a base.', type=int)
+  'this we call "?" instead of a base.', type=int, nargs='?')
   parser.add_argument('MinCovForUpper', help='The minimum coverage before upper'+\
   ' case is used instead of lower case, to signal increased confidence.', \
-  type=int)
+  type=int, nargs='?')
   parser.add_argument('MinFracToCall', help='The minimum fraction of reads at a'+\
   ' position before we call that base (or those bases, when one base alone does'+\
   ' not reach that threshold fraction; e.g. say you have 60%% A, 30%% C and ' +\
@@ -51,7 +64,16 @@ if __name__ == "__main__":
   'V for "A, C or G".). Alternatively, if you choose a negative value, we '+\
   'always call the single most common base regardless of its fraction, unless ' +\
   'two or more bases are equally (most) common, then we call the ' + \
-  'ambiguity code for those bases.', type=float)
+  'ambiguity code for those bases.', type=float, nargs='?')
+  parser.add_argument('-T', '--thresholds', nargs='+', type=ThresholdTriple,
+  metavar='MinCoverage,MinCovForUpper,MinFracToCall', help='''Instead of the
+  three positional threshold arguments, call the consensus for each of these
+  comma-separated threshold triples, reading the base frequency file only once.
+  Requires --out-file-format.''')
+  parser.add_argument('-O', '--out-file-format', help='''With --thresholds, the
+  name of the file to write each consensus to, in which {MinCoverage},
+  {MinCovForUpper} and {MinFracToCall} are replaced by the values of each
+  triple, e.g. MySample_consensus_MinCov_{MinCoverage}_{MinCovForUpper}.fasta''')
   parser.add_argument('-C', '--consensus-seq-name', help='The name used for the'+\
   ' consensus in the fasta-format output (default: "consensus").', \
   default='consensus')
@@ -78,208 +100,158 @@ if __name__ == "__main__":
   args = parser.parse_args()
   
   BaseFreqFile = args.BaseFreqFile
-  MinCoverage = args.MinCoverage
-  MinCovForUpper = args.MinCovForUpper
-  
-  # Check that MinCoverage and MinCovForUpper are positive integers, the 
-  # latter not smaller than the former.
-  if MinCoverage < 1:
-    print('The specified MinumumCoverageToCallBase of', MinCoverage, \
-    'is less than 1. Quitting.', file=sys.stderr)
-    exit(1)
-  if MinCovForUpper < MinCoverage:
-    print('The specified MinumumCoverageToUseUpperCase of', MinCoverage, \
-    'is less than the specified MinumumCoverageToCallBase. Quitting.', \
-    file=sys.stderr)
-    exit(1)
-  
-  # MinFracToCall should be <= 1 and != 0
-  if args.MinFracToCall > 1:
-    print('MinFracToCall cannot be greater than 1. Quitting.', file=sys.stderr)
-    exit(1)
-  FloatTolerance = 1e-5
-  if abs(args.MinFracToCall) < FloatTolerance:
-    print('MinFracToCall should not equal zero. Quitting.', file=sys.stderr)
-    exit(1)
-  
-  CallMostCommon = args.MinFracToCall < 0
-  
-  def CallAmbigBaseIfNeeded(bases, coverage):
-    '''If several bases are supplied, calls an ambiguity code. Uses upper/lower
-    case appropriately.'''
-  
-    bases = ''.join(sorted(bases))
-    NumBases = len(bases)
-    assert NumBases > 0, 'CallAmbigBaseIfNeeded function called with no bases.'
-    if len(bases) == 1:
-      BaseHere = bases
-    else:
-      # If a gap is one of the things most common at this position, call an 'N';
-      # otherwise, find the ambiguity code for this set of bases.
-      if GapChar in bases:
-        BaseHere = 'N'
-      else:  
-        try:
-          BaseHere = ReverseIUPACdict2[bases]
-        except KeyError:
-          print('Unexpected set of bases', bases, 'found in', BaseFreqFile, \
-          ', not found amonst those for which we have ambiguity codes, namely:', \
-          ' '.join(list(ReverseIUPACdict2.keys())) + '. Quitting.', file=sys.stderr)
-          raise
-    if coverage < MinCovForUpper - 0.5:
-      return BaseHere.lower()
-    else:
-      return BaseHere.upper()
-  
-  ExpectedBasesNoN = ['A', 'C', 'G', 'T', '-']
-  NumExpectedBases = len(ExpectedBasesNoN)
-  def CallEnoughBases(BaseCounts, MinCoverage, coverage):
-    '''Analyse base counts to see how many bases need to be called to hit the
-    minimum required count.'''
+
+  # Gather the threshold triples: either the three positional arguments, or
+  # those given with --thresholds.
+  PositionalThresholds = [args.MinCoverage, args.MinCovForUpper,
+  args.MinFracToCall]
+  if args.thresholds is None:
+    if any(_threshold is None for _threshold in PositionalThresholds):
+      print('The MinCoverage, MinCovForUpper and MinFracToCall arguments are',
+      'required unless --thresholds is used. Quitting.', file=sys.stderr)
+      exit(1)
+    if args.out_file_format is not None:
+      print('--out-file-format should only be used with --thresholds.',
+      'Quitting.', file=sys.stderr)
+      exit(1)
+    thresholds = [tuple(PositionalThresholds)]
+  else:
+    if any(_threshold is not None for _threshold in PositionalThresholds):
+      print('The MinCoverage, MinCovForUpper and MinFracToCall arguments',
+      'should not be used with --thresholds. Quitting.', file=sys.stderr)
+      exit(1)
+    if args.out_file_format is None:
+      print('--thresholds requires --out-file-format. Quitting.',
+      file=sys.stderr)
+      exit(1)
+    thresholds = args.thresholds
+    OutFiles = [args.out_file_format.format(MinCoverage=_MinCov,
+    MinCovForUpper=_MinCovForUpper, MinFracToCall=_MinFrac) for _MinCov,
+    _MinCovForUpper, _MinFrac in thresholds]
+    if len(set(OutFiles)) < len(OutFiles):
+      print('--out-file-format', args.out_file_format, 'gives the same file',
+      'name for two of the threshold triples. Quitting.', file=sys.stderr)
+      exit(1)
+
+  for MinCoverage, MinCovForUpper, MinFracToCall in thresholds:
   
-    # Sort the counts from largest to smallest, and sort the associated bases into
-    # a matching order.
-    SortedBaseCounts, SortedExpectedBases = \
-    zip(*sorted(zip(BaseCounts, ExpectedBasesNoN), reverse=True))
+    # Check that MinCoverage and MinCovForUpper are positive integers, the 
+    # latter not smaller than the former.
+    if MinCoverage < 1:
+      print('The specified MinumumCoverageToCallBase of', MinCoverage, \
+      'is less than 1. Quitting.', file=sys.stderr)
+      exit(1)
+    if MinCovForUpper < MinCoverage:
+      print('The specified MinumumCoverageToUseUpperCase of', MinCoverage, \
+      'is less than the specified MinumumCoverageToCallBase. Quitting.', \
+      file=sys.stderr)
+      exit(1)
   
-    # Iterate through the counts, from largest to smallest, updating the total
-    # so far. We should stop once we reach the desired total, but not if the next
-    # count is the same as the current one - then we should take that one too.
-    # If we reach the end of the list, there's no 'next' to check: we need all the
-    # bases.
-    CountSoFar = 0  
-    for i, count in enumerate(SortedBaseCounts):
-      if i == NumExpectedBases - 1:
-        NumBasesNeeded = i+1
-        break
-      CountSoFar += count
-      if count == SortedBaseCounts[i+1]:
-        continue
-      if CountSoFar >= MinCoverage:
-        NumBasesNeeded = i+1
-        break
-    BasesNeeded = SortedExpectedBases[:NumBasesNeeded]
-    return CallAmbigBaseIfNeeded(BasesNeeded, coverage)
+    # MinFracToCall should be <= 1 and != 0
+    if MinFracToCall > 1:
+      print('MinFracToCall cannot be greater than 1. Quitting.', file=sys.stderr)
+      exit(1)
+    FloatTolerance = 1e-5
+    if abs(MinFracToCall) < FloatTolerance:
+      print('MinFracToCall should not equal zero. Quitting.', file=sys.stderr)
+      exit(1)
   
-  # Read in the base frequency file
-  consensus = ''
+  # Read in the base frequency file, checking the number of fields on each line.
   ExpectedNumFields = 7
   if not args.ref_seq_missing:
     ExpectedNumFields += 1
-    RefSeq = ''
   if args.N_count_missing:
     ExpectedNumFields -= 1
+  FirstCountField = 1 if args.ref_seq_missing else 2
   with open(BaseFreqFile, 'r') as f:
-  
-    # Loop through all lines in the file
-    for LineNumMin1, line in enumerate(f):
-  
-      if LineNumMin1 == 0:
-        continue
-  
-      # Split up the line into fields separated by commas
-      fields = line.split(args.separator)
-      if len(fields) != ExpectedNumFields:
-        print('Line', str(LineNumMin1+1) + ',\n' + line + 'in', BaseFreqFile, \
-        'contains', len(fields), 'fields; expected', str(ExpectedNumFields) + \
-        '. Quitting', file=sys.stderr)
-        exit(1)
-  
-      # Append the reference base to the ref seq, if we have one
-      if args.ref_seq_missing:
-        counts = fields[1:]
-      else:
+    lines = f.readlines()[1:]
+  AllFields = [_line.split(args.separator) for _line in lines]
+  for LineNumMin1, (line, fields) in enumerate(zip(lines, AllFields), 1):
+    if len(fields) != ExpectedNumFields:
+      print('Line', str(LineNumMin1+1) + ',\n' + line + 'in', BaseFreqFile, \
+      'contains', len(fields), 'fields; expected', str(ExpectedNumFields) + \
+      '. Quitting', file=sys.stderr)
+      exit(1)
+
+  # Make the reference, if we have one.
+  if not args.ref_seq_missing:
+    RefSeq = ''.join(_fields[1] for _fields in AllFields)
+    if len(RefSeq) != len(AllFields):
+      for LineNumMin1, (line, fields) in enumerate(zip(lines, AllFields), 1):
         RefBase = fields[1]
-        counts = fields[2:]
-        if len(RefBase) == 1:
-          RefSeq += RefBase
-        else:
+        if len(RefBase) != 1:
           print('The reference base on line', str(LineNumMin1+1), ',\n', line, \
           'in', BaseFreqFile, 'is', RefBase + \
           '. One character only was expected. Quitting.', file=sys.stderr)
           exit(1)
-  
-      # Convert to ints    
+
+  # Convert the counts to an array of ints (positions by bases).
+  NumCounts = ExpectedNumFields - FirstCountField
+  try:
+    counts = np.fromiter(map(int, itertools.chain.from_iterable(
+    _fields[FirstCountField:] for _fields in AllFields)), dtype=np.int64,
+    count=len(AllFields) * NumCounts).reshape(len(AllFields), NumCounts)
+  except ValueError:
+    for LineNumMin1, (line, fields) in enumerate(zip(lines, AllFields), 1):
       try:
-        counts = list(map(int, counts))
+        list(map(int, fields[FirstCountField:]))
       except ValueError:
         print('Could not understand the base counts as ints on line', \
         str(LineNumMin1+1), ',\n', line, 'in', BaseFreqFile + \
         '. Quitting', file=sys.stderr)
         exit(1)
-  
-      # Check positive
-      if any(_count < 0 for _count in counts):
-        print('Negative count on line', str(LineNumMin1+1), ',\n', \
-        line, 'in', BaseFreqFile + '. Quitting', file=sys.stderr)
-        exit(1)
-  
-      # Ignore the count for 'N'. Sum the counts.
-      if not args.N_count_missing:
-        counts = counts[:-1]
-      coverage = sum(counts)
-  
-      # Call the appropriate character if coverage is below the threshold.
-      if coverage < MinCoverage:
-        consensus += '?'
-        continue
-  
-      # Find the base with the highest count (or bases, if they have joint-highest
-      # counts).
-      MaxCount = max(counts)
-      BasesWithMaxCount = [ExpectedBasesNoN[_i] for _i, _count in enumerate(counts) \
-      if _count == MaxCount]
-  
-      # If we're calling the most common base regardless of count:
-      if CallMostCommon: 
-        BaseToCall = CallAmbigBaseIfNeeded(BasesWithMaxCount, coverage)
-  
-      else:
-        CountToCallBase = coverage * args.MinFracToCall
-        # This next 'if' would also be covered by the 'else', but the explicit
-        # 'if' scope is faster and is what is usually needed.
-        if MaxCount * len(BasesWithMaxCount) >= CountToCallBase:
-          BaseToCall = CallAmbigBaseIfNeeded(BasesWithMaxCount, coverage)
-        else:
-          BaseToCall = CallEnoughBases(counts, CountToCallBase, coverage)
-  
-      consensus += BaseToCall
-        
-  # Replaces gaps that border "no coverage" by "no coverage".
-  if not args.keep_gaps_by_missing:
-    consensus = PropagateNoCoverageChar(consensus)
-  
-  # Skip positions at which the ref has a gap and the consensus has a gap or
-  # missing cov.
+    raise
+
+  # Check positive
+  NegativeLines = (counts < 0).any(axis=1).nonzero()[0]
+  if len(NegativeLines) > 0:
+    LineNumMin1 = NegativeLines[0] + 1
+    print('Negative count on line', str(LineNumMin1+1), ',\n', \
+    lines[LineNumMin1-1], 'in', BaseFreqFile + '. Quitting', file=sys.stderr)
+    exit(1)
+
+  # Ignore the count for 'N', and call the consensus for each set of thresholds.
+  if not args.N_count_missing:
+    counts = counts[:, :-1]
+  consensuses = CallConsensusFromCounts(counts, thresholds)
+
   if not args.ref_seq_missing:
-    NewConsensus = ''
-    NewRefSeq = ''
-    for ConsensusBase, RefBase in zip(consensus, RefSeq):
-      if RefBase == GapChar and (ConsensusBase == '?' or ConsensusBase == \
-      GapChar):
-        continue
-      NewConsensus += ConsensusBase
-      NewRefSeq += RefBase
-    consensus = NewConsensus
-    RefSeq = NewRefSeq
+    RefSeqArray = np.frombuffer(RefSeq.encode(), dtype=np.uint8)
+
+  for ThresholdNum, consensus in enumerate(consensuses):
+
+    # Replaces gaps that border "no coverage" by "no coverage".
+    if not args.keep_gaps_by_missing:
+      consensus = PropagateNoCoverageChar(consensus)
   
-    RefSeqObj = SeqIO.SeqRecord(Seq.Seq(RefSeq), \
-    id=args.ref_seq_name, description='')
+    # Skip positions at which the ref has a gap and the consensus has a gap or
+    # missing cov.
+    if not args.ref_seq_missing:
+      ConsensusArray = np.frombuffer(consensus.encode(), dtype=np.uint8)
+      PositionsToKeep = ~((RefSeqArray == ord(GapChar)) & \
+      ((ConsensusArray == ord('?')) | (ConsensusArray == ord(GapChar))))
+      consensus = ConsensusArray[PositionsToKeep].tobytes().decode()
+      RefSeqObj = SeqIO.SeqRecord(Seq.Seq(
+      RefSeqArray[PositionsToKeep].tobytes().decode()), id=args.ref_seq_name,
+      description='')
   
-  # Replace "?" by "N" if desired.
-  if args.use_n_for_missing:
-    consensus = consensus.replace("?", "N")
+    # Replace "?" by "N" if desired.
+    if args.use_n_for_missing:
+      consensus = consensus.replace("?", "N")
   
-  ConsensusSeqObj = SeqIO.SeqRecord(Seq.Seq(consensus), \
-  id=args.consensus_seq_name, description='')
-  OutputSeqs = [ConsensusSeqObj]
+    ConsensusSeqObj = SeqIO.SeqRecord(Seq.Seq(consensus), \
+    id=args.consensus_seq_name, description='')
+    OutputSeqs = [ConsensusSeqObj]
   
-  if args.skip_ref_in_output:
-    consensus = sub("-", "", consensus)
-  elif not args.ref_seq_missing:
-    OutputSeqs.append(RefSeqObj)
+    if args.skip_ref_in_output:
+      consensus = sub("-", "", consensus)
+    elif not args.ref_seq_missing:
+      OutputSeqs.append(RefSeqObj)
   
-  SeqIO.write(OutputSeqs, sys.stdout, "fasta")
+    if args.thresholds is None:
+      SeqIO.write(OutputSeqs, sys.stdout, "fasta")
+    else:
+      SeqIO.write(OutputSeqs, OutFiles[ThresholdNum], "fasta")
   
   ## Thanks Stackoverflow:
   #def insert_newlines(string, every=50):
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import collections
+import os
+import sys
+from Bio import SeqIO
+from Bio.Seq import Seq
+from six.moves import zip_longest
+from ShiverFuncs import ReadPairIsContaminant
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''Finds contaminant reads, as an alternative to
+  blasting them, by assigning each read to whichever sequence in a fasta file
+  (the reference plus the contaminant contigs) it shares the most k-mers with
+  (on either strand). Each read's best hit is the sequence with the most of its
+  k-mers, if that's at least --min-shared-kmers; ties are resolved in favour of
+  the reference, then of the first sequence in the fasta file. For paired reads,
+  pairs are called contaminant with the same rules as
+  FindContaminantReadPairs.py (with more shared k-mers playing the role of a
+  smaller evalue): both reads must have a hit, and either both hit something
+  other than the reference or one does so with more shared k-mers than its
+  mate's hit to the reference. For unpaired reads, a read is contaminant if its
+  best hit is not the reference. The names of the contaminant reads are written
+  to OutFileBasename_1.txt (and OutFileBasename_2.txt for paired reads), in the
+  same format as FindContaminantReadPairs.py. The read files are streamed, and
+  for paired reads a read is only held in memory until its mate is found (i.e.
+  not at all if the two files are in the same order). Read names are the first
+  word of the fastq header line, and for paired reads must end in /1 or /2.'''
+
+  # Define a function to check files exist, as a type for the argparse.
+  def File(MyFile):
+    if not os.path.isfile(MyFile):
+      raise argparse.ArgumentTypeError(MyFile+' does not exist or is not a file.')
+    return MyFile
+
+  # Define a function to check an int is positive, as a type for the argparse.
+  def PositiveInt(MyInt):
+    try:
+      MyInt = int(MyInt)
+      assert MyInt > 0
+    except (ValueError, AssertionError):
+      raise argparse.ArgumentTypeError(str(MyInt) + ' is not a positive integer.')
+    return MyInt
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('RefAndContaminantsFasta', type=File)
+  parser.add_argument('RefName', help='The name of the reference in '
+  'RefAndContaminantsFasta; all other sequences there are contaminants.')
+  parser.add_argument('OutFileBasename')
+  parser.add_argument('Reads1', type=File)
+  parser.add_argument('Reads2', type=File, nargs='?', help='''The mates of the
+  reads in Reads1, for paired reads.''')
+  parser.add_argument('-k', '--kmer-length', type=PositiveInt, default=21)
+  parser.add_argument('-M', '--min-shared-kmers', type=PositiveInt, default=2,
+  help='''The minimum number of a read's k-mers that must be found in a
+  sequence for that to count as a hit (default: 2).''')
+  args = parser.parse_args()
+  k = args.kmer_length
+  Paired = args.Reads2 is not None
+
+  # Index the k-mers of each sequence, on both strands, recording which
+  # sequences each k-mer is found in.
+  SeqNames = []
+  KmerIndex = {}
+  for seq in SeqIO.parse(args.RefAndContaminantsFasta, 'fasta'):
+    if seq.id in SeqNames:
+      print(seq.id, 'occurs more than once in', args.RefAndContaminantsFasta +
+      '. Quitting.', file=sys.stderr)
+      exit(1)
+    SeqIndex = len(SeqNames)
+    SeqNames.append(seq.id)
+    ForwardSeq = str(seq.seq).upper().replace('-', '')
+    ReverseSeq = str(Seq(ForwardSeq).reverse_complement())
+    for strand in [ForwardSeq, ReverseSeq]:
+      for pos in range(len(strand) - k + 1):
+        kmer = strand[pos:pos + k]
+        SeqsWithKmer = KmerIndex.get(kmer, ())
+        if not SeqIndex in SeqsWithKmer:
+          KmerIndex[kmer] = SeqsWithKmer + (SeqIndex,)
+  if not args.RefName in SeqNames:
+    print(args.RefName, 'is not in', args.RefAndContaminantsFasta +
+    '. Quitting.', file=sys.stderr)
+    exit(1)
+  RefIndex = SeqNames.index(args.RefName)
+
+  def BestHit(ReadSeq):
+    '''Returns the name of the sequence sharing the most k-mers with the read,
+    and the number shared, or (None, 0) if no sequence shares enough.'''
+    counts = collections.Counter()
+    for pos in range(len(ReadSeq) - k + 1):
+      SeqsWithKmer = KmerIndex.get(ReadSeq[pos:pos + k])
+      if SeqsWithKmer is not None:
+        counts.update(SeqsWithKmer)
+    if not counts:
+      return None, 0
+    MaxCount = max(counts.values())
+    if MaxCount < args.min_shared_kmers:
+      return None, 0
+    if counts[RefIndex] == MaxCount:
+      return args.RefName, MaxCount
+    BestIndex = min(_index for _index, _count in counts.items() \
+    if _count == MaxCount)
+    return SeqNames[BestIndex], MaxCount
+
+  def IterateReads(FastqFile):
+    '''Yields the name and upper-case sequence of each read in a fastq file.'''
+    with open(FastqFile, 'r') as f:
+      for LineNumMin1, line in enumerate(f):
+        if LineNumMin1 % 4 == 0:
+          try:
+            ReadName = line[1:].split()[0]
+          except IndexError:
+            print('Empty read name on line', LineNumMin1 + 1, 'of', FastqFile +
+            '. Quitting.', file=sys.stderr)
+            exit(1)
+        elif LineNumMin1 % 4 == 1:
+          yield ReadName, line.strip().upper()
+
+  def StripMateSuffix(ReadName, FastqFile):
+    if len(ReadName) < 2 or not ReadName[-2:] in ['/1', '/2']:
+      print('Unexpected format for read', ReadName, 'in', FastqFile + '; read',
+      'names are expected to end in /1 or /2. Quitting.', file=sys.stderr)
+      exit(1)
+    return ReadName[:-2]
+
+  ContaminantReads = []
+  if not Paired:
+    for ReadName, ReadSeq in IterateReads(args.Reads1):
+      hit, _ = BestHit(ReadSeq)
+      if hit is not None and hit != args.RefName:
+        ContaminantReads.append(ReadName)
+  else:
+    # Step through both files together. Hits for reads whose mates have not
+    # been seen yet are held until they are.
+    PendingHits = [{}, {}]
+    ReadFiles = [args.Reads1, args.Reads2]
+    for reads in zip_longest(IterateReads(args.Reads1),
+    IterateReads(args.Reads2)):
+      for ReadIndex, read in enumerate(reads):
+        if read is None:
+          continue
+        ReadName, ReadSeq = read
+        ReadName = StripMateSuffix(ReadName, ReadFiles[ReadIndex])
+        if ReadName in PendingHits[ReadIndex]:
+          print('Encountered read', ReadName, '(having trimmed "/1" or "/2"',
+          'from the name) a second time in', ReadFiles[ReadIndex] +
+          '. Quitting.', file=sys.stderr)
+          exit(1)
+        hit = BestHit(ReadSeq)
+        MateHit = PendingHits[1 - ReadIndex].pop(ReadName, None)
+        if MateHit is None:
+          PendingHits[ReadIndex][ReadName] = hit
+          continue
+        read1Hit, read2Hit = (hit, MateHit) if ReadIndex == 0 else \
+        (MateHit, hit)
+        # Reads without a hit are not called contaminant, nor are their mates.
+        if read1Hit[0] is None or read2Hit[0] is None:
+          continue
+        # More shared k-mers is better, like a smaller evalue.
+        if ReadPairIsContaminant(read1Hit[0], -read1Hit[1], read2Hit[0],
+        -read2Hit[1], args.RefName):
+          ContaminantReads.append(ReadName)
+
+  # Write the output
+  if Paired:
+    OutFiles = [(args.OutFileBasename + '_1.txt', '/1'),
+    (args.OutFileBasename + '_2.txt', '/2')]
+  else:
+    OutFiles = [(args.OutFileBasename + '_1.txt', '')]
+  for OutFile, suffix in OutFiles:
+    with open(OutFile, 'w') as f:
+      for ReadName in ContaminantReads:
+        f.write(ReadName + suffix + '\n')
@@ -5,8 +5,8 @@ import argparse
 import os
 import sys
 import re
-from Bio import AlignIO, Seq
-import collections
+import numpy as np
+from ShiverFuncs import AlignmentMatrix
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -52,69 +52,55 @@ if __name__ == "__main__":
   
   # Read in the alignment
   try:
-    alignment = AlignIO.read(args.alignment, "fasta")
+    alignment = AlignmentMatrix.FromFasta(args.alignment)
   except:
     print('Problem reading', args.alignment + ':', file=sys.stderr)
     raise
-  AlignmentLength = alignment.get_alignment_length()
+  AlignmentLength = alignment.GetAlignmentLength()
   
   if args.RP or args.RHP:
     # HXB2 is the last seq. Remove it now so it doesn't affect the consensus.
-    alignment = alignment[:-1, :]
+    alignment = AlignmentMatrix(alignment.names[:-1], alignment.matrix[:-1])
   
   # Convert the alignment to upper case
-  for i in range(len(alignment)):
-    alignment[i].seq = Seq.Seq(str(alignment[i].seq).upper())
-  
-  # Construct a list whose nth element is the consensus base at position n in the
-  # alignment, or the value None if there is no consensus at position n (all gaps,
-  # or a tie for the most common base).
-  ConsensusBases = []
-  for position in range(0, AlignmentLength):
-    BasesHere = alignment[:, position]
-    BasesHereNoGaps = BasesHere.replace('-','')
-    if len(BasesHereNoGaps) == 0:
-      ConsensusBases.append(None)
-      continue
-    BaseCounts = collections.Counter(BasesHereNoGaps)
-    MostCommonTwoBases = BaseCounts.most_common(2)
-    if len(MostCommonTwoBases) > 1 and \
-    MostCommonTwoBases[1][1] == MostCommonTwoBases[0][1]:
-      ConsensusBases.append(None)
-    else:
-      ConsensusBases.append(MostCommonTwoBases[0][0])
-  
+  alignment.matrix = np.frombuffer(alignment.matrix.tobytes().upper(),
+  dtype=np.uint8).reshape(alignment.matrix.shape)
+  
+  # Construct an array whose nth element is the consensus base at position n in
+  # the alignment, or 0 if there is no consensus at position n (all gaps, or a
+  # tie for the most common base).
+  BaseCounts = alignment.ColumnCounts()
+  BaseCounts.pop('-', None)
+  if BaseCounts:
+    BaseCountsArray = np.array(list(BaseCounts.values()))
+    MaxCounts = BaseCountsArray.max(axis=0)
+    HaveConsensus = (MaxCounts > 0) & \
+    ((BaseCountsArray == MaxCounts).sum(axis=0) == 1)
+    ConsensusBases = np.where(HaveConsensus, np.array([ord(_base) for _base in \
+    BaseCounts])[BaseCountsArray.argmax(axis=0)], 0)
+  else:
+    ConsensusBases = np.zeros(AlignmentLength, dtype=np.uint8)
+  
+  # Assign colour codes
+  IsGap = alignment.matrix == ord('-')
+  ColourCodes = np.where(IsGap, ord('d'), np.where(alignment.matrix == \
+  ConsensusBases, ord('g'), ord('b'))).astype(np.uint8)
+  
+  # Replace leading and trailing deletions by their own character
+  HasBase = ~IsGap
+  FirstBasePos = HasBase.argmax(axis=1)
+  LastBasePos = AlignmentLength - 1 - HasBase[:, ::-1].argmax(axis=1)
+  positions = np.arange(AlignmentLength)
+  ColourCodes[(positions < FirstBasePos[:, None]) | \
+  (positions > LastBasePos[:, None])] = ord('n')
   OutList = []
-  for seq in alignment:
-  
-    # Assign colour codes
-    ColourCodes = ''
-    for position, base in enumerate(str(seq.seq)):
-      if base == '-':
-        ColourCodes += 'd'
-      elif base == ConsensusBases[position]:
-        ColourCodes += 'g'
-      else:
-        ColourCodes += 'b'
-  
-    # Replace leading and trailing deletions by their own character
-    try:
-      FirstBasePos = 0
-      while ColourCodes[FirstBasePos] == 'd':
-        FirstBasePos += 1
-    except IndexError:
+  for row, SeqID in enumerate(alignment.names):
+    if not HasBase[row].any():
       # This 'sequence' is nothing but gaps.
-      ColourCodes = 'n' * AlignmentLength
-      print('Warning: seq', seq.id, 'in', args.alignment, 'contains no bases.',
+      ColourCodes[row] = ord('n')
+      print('Warning: seq', SeqID, 'in', args.alignment, 'contains no bases.',
       file=sys.stderr)
-    else:
-      LastBasePos = AlignmentLength - 1
-      while ColourCodes[LastBasePos] == 'd':
-        LastBasePos -= 1
-      ColourCodes = 'n' * FirstBasePos + ColourCodes[FirstBasePos:LastBasePos+1] \
-      + 'n' * (AlignmentLength -1 - LastBasePos)
-  
-    OutList.append((seq.id, ColourCodes))
+    OutList.append((SeqID, ColourCodes[row].tobytes().decode()))
   
   if args.reorder or args.reorder_Hiseq:
   
@@ -206,7 +192,7 @@ if __name__ == "__main__":
     
   
   # Print output
-  for seq.id, ColourCodes in OutList:
-    print(seq.id + ',' + ColourCodes)
+  for SeqID, ColourCodes in OutList:
+    print(SeqID + ',' + ColourCodes)
   
   
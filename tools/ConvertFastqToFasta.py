@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import argparse
+import hashlib
 import os
 import sys
 from Bio import SeqIO
+from Bio.SeqIO.QualityIO import FastqGeneralIterator
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -12,7 +14,12 @@ if __name__ == "__main__":
 
   ## Overview:
   ExplanatoryMessage = '''This script converts sequence data from fastq format to
-  fasta format (discarding sequence quality information).
+  fasta format (discarding sequence quality information). With --deduplicate,
+  each distinct sequence is written only once, named after the first read that
+  has it, and the names of the other reads having it are written to a separate
+  table, so that the results of e.g. blasting the sequences can be expanded back
+  to all the reads afterwards (with KeepBestLinesInDataFile.py
+  --expand-duplicates).
   '''
   
   # Define a function to check files exist, as a type for the argparse.
@@ -27,11 +34,38 @@ if __name__ == "__main__":
   parser.add_argument('InputFastqFile', type=File)
   parser.add_argument('OutputFastaFile')
   parser.add_argument('-O', '--overwrite-output-file', action='store_true')
+  parser.add_argument('-D', '--deduplicate', metavar='DuplicatesFile',
+  help='''Write each distinct sequence only once, and write a csv file to
+  DuplicatesFile with one line for each of the other reads: the name of the read
+  the sequence was written with, then the name of this read.''')
   args = parser.parse_args()
   
-  if (not args.overwrite_output_file) and os.path.isfile(args.OutputFastaFile):
-    print(args.OutputFastaFile, 'exists already and --overwrite-output-file was',
-    'not specified. Exiting.', file=sys.stderr)
-    exit(1)  
+  for OutFile in [args.OutputFastaFile, args.deduplicate]:
+    if OutFile is not None and (not args.overwrite_output_file) and \
+    os.path.isfile(OutFile):
+      print(OutFile, 'exists already and --overwrite-output-file was',
+      'not specified. Exiting.', file=sys.stderr)
+      exit(1)  
   
-  SeqIO.convert(args.InputFastqFile, "fastq", args.OutputFastaFile, "fasta")
+  if args.deduplicate is None:
+    SeqIO.convert(args.InputFastqFile, "fastq", args.OutputFastaFile, "fasta")
+    exit(0)
+
+  # Record the name of the first read with each distinct sequence, keyed by a
+  # digest of the sequence so that memory doesn't grow with the read length.
+  FirstReadWithSeq = {}
+  NumReads = 0
+  with open(args.InputFastqFile, 'r') as f, \
+  open(args.OutputFastaFile, 'w') as OutFasta, \
+  open(args.deduplicate, 'w') as OutDuplicates:
+    for title, seq, _ in FastqGeneralIterator(f):
+      NumReads += 1
+      ReadName = title.split(None, 1)[0]
+      SeqDigest = hashlib.md5(seq.encode()).digest()
+      if SeqDigest in FirstReadWithSeq:
+        OutDuplicates.write(FirstReadWithSeq[SeqDigest] + ',' + ReadName + '\n')
+      else:
+        FirstReadWithSeq[SeqDigest] = ReadName
+        OutFasta.write('>' + ReadName + '\n' + seq + '\n')
+  print(args.InputFastqFile, 'has', len(FirstReadWithSeq), 'distinct',
+  'sequences among', NumReads, 'reads.')
@@ -1,12 +1,11 @@
 #!/usr/bin/env python
 from __future__ import print_function
-from six.moves import range
 import argparse
 import os
 import sys
-from Bio import AlignIO, SeqIO
-import collections
-from AuxiliaryFunctions import IUPACdict
+import numpy as np
+from AuxiliaryFunctions import IUPACdict, acgt
+from ShiverFuncs import AlignmentMatrix
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -34,81 +33,74 @@ if __name__ == "__main__":
   args = parser.parse_args()
   
   try:
-    alignment = AlignIO.read(args.alignment, "fasta")
+    alignment = AlignmentMatrix.FromFasta(args.alignment)
   except:
     print('Problem reading', args.alignment + ':', file=sys.stderr)
     raise
-  AlignmentLength = alignment.get_alignment_length()
+  AlignmentLength = alignment.GetAlignmentLength()
   
   # Bases we'll leave untouched
   OKbases = "ACGTNacgtn-?"
   
-  BaseCountsByPos = []
-  BaseCountTotalsByPos = []
-  for pos in range(AlignmentLength):
+  # Count the OKbases at each position. (Check there are some!)
+  OKbaseCounts = alignment.ColumnCounts(OKbases)
+  BaseCountTotalsByPos = sum(OKbaseCounts.values())
+  PositionsWithoutOKbases = (BaseCountTotalsByPos == 0).nonzero()[0]
+  if len(PositionsWithoutOKbases) > 0:
+    print('No "OK" bases, i.e.', OKbases + ", were observed at position",
+    PositionsWithoutOKbases[0] + 1, "in", args.alignment + ". This code does",
+    "not know how to estimate ambiguity codes in this case. Quitting.",
+    file=sys.stderr)
+    exit(1)
   
-    # Sort the OKbases here by how common they are. (Check there are some!)
-    BaseCounts = collections.Counter(alignment[:, pos])
-    BasesObserved = list(BaseCounts.keys())
-    for base in BasesObserved:
-      if not base in OKbases:
-        del BaseCounts[base]
-    if len(BaseCounts) == 0:
-      print('No "OK" bases, i.e.', OKbases + ", were observed at position", pos \
-      + 1, "in", args.alignment + ". This code does not know how to estimate",
-      "ambiguity codes in this case. Quitting.", file=sys.stderr)
-      exit(1)
-    BaseCountsByPos.append(BaseCounts.most_common())
-    BaseCountTotalsByPos.append(sum(BaseCounts.values()))
-  
-  # Make the alignment writable
-  MutableSeqList = [_seq.seq.tomutable() for _seq in alignment]
-  IDs = [_seq.id for _seq in alignment]
+  # For the bases an ambiguity code can mean, find the row in which each first
+  # appears at each position: that breaks ties between equally common bases.
+  FirstRows = {}
+  for base in acgt:
+    IsBase = alignment.matrix == ord(base)
+    FirstRows[base] = np.where(IsBase.any(axis=0), IsBase.argmax(axis=0),
+    len(alignment))
   
-  for row in range(len(MutableSeqList)):
-    SeqAsStr = str(MutableSeqList[row])
-    ID = IDs[row]
-    for pos in range(AlignmentLength):
+  # Find every base needing ambiguity interpretation, row by row.
+  NotOK = ~np.isin(alignment.matrix, np.frombuffer(OKbases.encode(),
+  dtype=np.uint8))
+  for row, pos in zip(*NotOK.nonzero()):
+    ID = alignment.names[row]
+    base = chr(alignment.matrix[row, pos])
   
-      # Check at this position whether ambiguity interpretation is needed.
-      base = SeqAsStr[pos]
-      if not base in OKbases:
+    # Convert to upper case, but remember whether it was orinally lower
+    IsLower = base == base.lower()
+    UpperBase = base.upper()
   
-        # Convert to upper case, but remember whether it was orinally lower
-        IsLower = base == base.lower()
-        UpperBase = base.upper()
-  
-        # Which bases does this ambiguity code mean?
-        if not UpperBase in IUPACdict:
-          print("Error: unexpected base", base, 'at position', pos + 1, 'for seq',
-          ID, 'in', args.alignment + ". Quitting.", file=sys.stderr)
-          exit(1)
-        bases = IUPACdict[UpperBase]
+    # Which bases does this ambiguity code mean?
+    if not UpperBase in IUPACdict:
+      print("Error: unexpected base", base, 'at position', pos + 1, 'for seq',
+      ID, 'in', args.alignment + ". Quitting.", file=sys.stderr)
+      exit(1)
+    bases = IUPACdict[UpperBase]
   
-        # Iterate through the OKbases from most common to least common, take the
-        # first match. If there's no match, crash - we don't know what to do.
-        MatchToBaseElsewhere = False
-        for BaseElsewhere, count in BaseCountsByPos[pos]:
-          if BaseElsewhere in bases:
-            BaseToUse = BaseElsewhere
-            CountToUse = count 
-            MatchToBaseElsewhere = True
-            break
-        if not MatchToBaseElsewhere:
-          BaseToUse = "N"
-          print('Warning: position', pos + 1, 'for seq', ID, 'in', args.alignment,
-          "is", base + ", which is the ambiguity code for", " or ".join(bases) + \
-          ", however none of these bases were observed in other sequences at",
-          "this position. Replacing this base by N.", file=sys.stderr)
+    # Of those bases observed here, take the most common (the one seen first if
+    # there's a tie). If none were observed, we don't know what to do.
+    ObservedBases = [_base for _base in bases if OKbaseCounts[_base][pos] > 0]
+    if ObservedBases:
+      BaseToUse = min(ObservedBases, key=lambda _base: \
+      (-OKbaseCounts[_base][pos], FirstRows[_base][pos]))
+      CountToUse = OKbaseCounts[BaseToUse][pos]
+    else:
+      BaseToUse = "N"
+      CountToUse = 0
+      print('Warning: position', pos + 1, 'for seq', ID, 'in', args.alignment,
+      "is", base + ", which is the ambiguity code for", " or ".join(bases) + \
+      ", however none of these bases were observed in other sequences at",
+      "this position. Replacing this base by N.", file=sys.stderr)
   
-        # Set the new base
-        if IsLower:
-          BaseToUse = BaseToUse.lower()
-        MutableSeqList[row][pos] = BaseToUse
-        if args.verbose:
-          print('At position', pos + 1, 'for seq', ID, "base", base,
-          "was changed to", BaseToUse, "(the latter appearing", CountToUse,
-          "times amongst", BaseCountTotalsByPos[pos], "unambiguous bases here).")
+    # Set the new base
+    if IsLower:
+      BaseToUse = BaseToUse.lower()
+    alignment.matrix[row, pos] = ord(BaseToUse)
+    if args.verbose:
+      print('At position', pos + 1, 'for seq', ID, "base", base,
+      "was changed to", BaseToUse, "(the latter appearing", CountToUse,
+      "times amongst", BaseCountTotalsByPos[pos], "unambiguous bases here).")
   
-  SeqIO.write((SeqIO.SeqRecord(_seq, id=IDs[_i], description='') for _i, _seq in \
-  enumerate(MutableSeqList)), args.OutputFile, 'fasta')
+  alignment.WriteFasta(args.OutputFile, UseTitles=False)
@@ -2,6 +2,7 @@
 from __future__ import print_function
 import os.path
 import sys
+from ShiverFuncs import ReadPairIsContaminant
 #
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -21,6 +22,10 @@ if __name__ == "__main__":
   ## novo assembly has been done with these reads, some of the resulting contigs
   ## may be identified as contamination -- we want to find the reads that
   ## correspond to those contigs, in order to remove them.)
+  ## With --unpaired as the first argument, the script instead reads one blast
+  ## file of (best) hits for unpaired reads, and writes the names of the reads
+  ## that blast to something other than the named sequence to one file, as it
+  ## reads them.
   
   ################################################################################
   # USER INPUT
@@ -30,10 +35,35 @@ if __name__ == "__main__":
   column_evalue = 4
   ################################################################################
   
+  RightmostColumn = max([column_qacc,column_sacc,column_evalue])
+
+  if len(sys.argv) > 1 and sys.argv[1] == '--unpaired':
+    if len(sys.argv) != 5:
+      sys.stderr.write('Incorrect number of arguments given. Correct usage:\n'+\
+      sys.argv[0] +' --unpaired BlastFile RefName OutFileBasename\nQuitting\n')
+      exit(1)
+    BlastFile = sys.argv[2]
+    RefName = sys.argv[3]
+    OutFile_1reads = sys.argv[4]+'_1.txt'
+    if not os.path.isfile(BlastFile):
+      sys.stderr.write(BlastFile +' does not exist or is not a file. Quitting.\n')
+      exit(1)
+    with open(BlastFile, 'r') as f, open(OutFile_1reads, 'w') as OutFile:
+      for line in f:
+        fields = line.split(',')
+        if len(fields) < RightmostColumn:
+          sys.stderr.write('The following line in ' +BlastFile +' has too few '+\
+          'fields (less than ' +str(RightmostColumn)+'):\n' +line+'Quitting.\n')
+          exit(1)
+        if fields[column_sacc-1] != RefName:
+          OutFile.write(fields[column_qacc-1] + '\n')
+    exit(0)
+
   # Check that this script was called from the command line with two arguments.
   if len(sys.argv) != 5:
     sys.stderr.write('Incorrect number of arguments given. Correct usage:\n'+\
     sys.argv[0] +' BlastFileFor1reads BlastFileFor2reads RefName '+\
+    'OutFileBasename\nor\n' +sys.argv[0] +' --unpaired BlastFile RefName '+\
     'OutFileBasename\nQuitting\n')
     exit(1)
   BlastFileFor1reads = sys.argv[1]
@@ -47,8 +77,6 @@ if __name__ == "__main__":
       sys.stderr.write(DataFile +' does not exist or is not a file. Quitting.\n')
       exit(1)
   
-  RightmostColumn = max([column_qacc,column_sacc,column_evalue])
-  
   def ReadBlastFile(BlastFile):
     '''Reads in the qacc, sacc, and evalue from a blast output file.
     The qacc is expected to end in /1 or /2, and this is removed.'''
@@ -88,28 +116,15 @@ if __name__ == "__main__":
       [read2Hit,read2Evalue] = HitsFor2reads[ReadName]
     except KeyError:
       continue
-    read1HitsRef = read1Hit == RefName
-    read2HitsRef = read2Hit == RefName
-    if read1HitsRef and read2HitsRef:
-      continue
-    elif read1HitsRef or read2HitsRef:
-      try:
-        read1Evalue = float(read1Evalue)
-        read2Evalue = float(read2Evalue)
-      except ValueError:
-        sys.stderr.write('Failed to understand one of the evalues for read ' +\
-        ReadName +', namely ' +str(read1Evalue).strip() +' and ' +\
-        str(read2Evalue).strip()+', as a float.\nQuitting.\n')
-        exit(1)
-      if read1HitsRef:
-        RefEvalue         = read1Evalue
-        ContaminantEvalue = read2Evalue
-      else:
-        ContaminantEvalue = read1Evalue
-        RefEvalue         = read2Evalue    
-      if ContaminantEvalue < RefEvalue:
-        ContaminantReadPairs.append(ReadName)
-    else:
+    try:
+      IsContaminant = ReadPairIsContaminant(read1Hit, read1Evalue, read2Hit,
+      read2Evalue, RefName)
+    except ValueError:
+      sys.stderr.write('Failed to understand one of the evalues for read ' +\
+      ReadName +', namely ' +str(read1Evalue).strip() +' and ' +\
+      str(read2Evalue).strip()+', as a float.\nQuitting.\n')
+      exit(1)
+    if IsContaminant:
       ContaminantReadPairs.append(ReadName)
   
   # Write the output
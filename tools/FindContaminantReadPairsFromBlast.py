@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import collections
+import os
+import sys
+from six.moves import zip_longest
+from ShiverFuncs import ReadPairIsContaminant
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''Finds contaminant read pairs from the blast hits of
+  the forward reads and of the reverse reads (blastn output in csv format,
+  i.e. -outfmt 10, with qacc, sacc and evalue as the first, second and fourth
+  fields), doing in one streaming pass what KeepBestLinesInDataFile.py followed
+  by FindContaminantReadPairs.py do with intermediate files. The blast files
+  can be named pipes that blastn is writing to. Each read's best hit (smallest
+  evalue, the first in a tie) is found on the fly, relying on blastn writing all
+  the hits of each read together, and pairs are called contaminant with the
+  same rules as FindContaminantReadPairs.py. Read names must end in /1 or /2.
+  The two files are read together, so a read's best hit is only held in memory
+  until its mate's is found (i.e. hardly at all if both sets of reads were in
+  the same order). The names of the contaminant reads are written to
+  OutFileBasename_1.txt and OutFileBasename_2.txt.'''
+
+  # Define a function to check files exist, as a type for the argparse.
+  def File(MyFile):
+    if not os.path.exists(MyFile):
+      raise argparse.ArgumentTypeError(MyFile+' does not exist.')
+    return MyFile
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('BlastFileFor1reads', type=File)
+  parser.add_argument('BlastFileFor2reads', type=File)
+  parser.add_argument('RefName')
+  parser.add_argument('OutFileBasename')
+  parser.add_argument('--duplicates-1', type=File, help='''A csv file of
+  duplicate forward reads, as written by ConvertFastqToFasta.py --deduplicate:
+  each line names a read that was blasted, then a read with the same sequence
+  that was not (and so is given the same best hit).''')
+  parser.add_argument('--duplicates-2', type=File, help='''As --duplicates-1,
+  for the reverse reads.''')
+  args = parser.parse_args()
+
+  ################################################################################
+  # What columns are the fields we want?
+  column_qacc = 1
+  column_sacc = 2
+  column_evalue = 4
+  ################################################################################
+  RightmostColumn = max([column_qacc,column_sacc,column_evalue])
+
+  def ReadDuplicates(DuplicatesFile):
+    '''Reads the names of the duplicates of each read that was blasted.'''
+    duplicates = collections.defaultdict(list)
+    if DuplicatesFile is not None:
+      with open(DuplicatesFile, 'r') as f:
+        for line in f:
+          ReadName, DuplicateName = line.rstrip('\n').split(',')
+          duplicates[ReadName].append(DuplicateName)
+    return duplicates
+
+  def IterateBestHits(BlastFile, duplicates):
+    '''Yields the name of each read in a blast file (with /1 or /2 removed), the
+    name of the sequence it hit best and the evalue of that hit, then the same
+    for each of the read's duplicates.'''
+    def BestHit(ReadName, sacc, evalue):
+      if len(ReadName) < 2 or (not ReadName[-2:] in ['/1','/2']):
+        print('Unexpected format for read', ReadName, 'in', BlastFile + '; read',
+        'names are expected to end in /1 or /2. Quitting.', file=sys.stderr)
+        exit(1)
+      yield ReadName[:-2], sacc, evalue
+      for DuplicateName in duplicates.get(ReadName, []):
+        yield DuplicateName[:-2], sacc, evalue
+    CurrentRead = None
+    with open(BlastFile, 'r') as f:
+      for line in f:
+        fields = line.split(',')
+        if len(fields) < RightmostColumn:
+          print('The following line in', BlastFile, 'has too few fields',
+          '(less than ' + str(RightmostColumn) + '):\n' + line + 'Quitting.',
+          file=sys.stderr)
+          exit(1)
+        ReadName = fields[column_qacc-1]
+        sacc = fields[column_sacc-1]
+        try:
+          evalue = float(fields[column_evalue-1])
+        except ValueError:
+          print('Failed to understand the evalue', fields[column_evalue-1],
+          'for read', ReadName, 'in', BlastFile, 'as a float. Quitting.',
+          file=sys.stderr)
+          exit(1)
+        if ReadName == CurrentRead:
+          if evalue < BestEvalue:
+            BestSacc, BestEvalue = sacc, evalue
+          continue
+        if CurrentRead is not None:
+          for hit in BestHit(CurrentRead, BestSacc, BestEvalue):
+            yield hit
+        CurrentRead, BestSacc, BestEvalue = ReadName, sacc, evalue
+    if CurrentRead is not None:
+      for hit in BestHit(CurrentRead, BestSacc, BestEvalue):
+        yield hit
+
+  # Step through the best hits of both sets of reads together, holding those
+  # whose mate has not been seen yet until it is.
+  BlastFiles = [args.BlastFileFor1reads, args.BlastFileFor2reads]
+  PendingHits = [{}, {}]
+  ContaminantReadPairs = []
+  for hits in zip_longest(
+  IterateBestHits(args.BlastFileFor1reads, ReadDuplicates(args.duplicates_1)),
+  IterateBestHits(args.BlastFileFor2reads, ReadDuplicates(args.duplicates_2))):
+    for ReadIndex, hit in enumerate(hits):
+      if hit is None:
+        continue
+      ReadName, sacc, evalue = hit
+      if ReadName in PendingHits[ReadIndex]:
+        print('Encountered read', ReadName, '(having trimmed "/1" or "/2" from',
+        'the name) a second time in', BlastFiles[ReadIndex] + '. Quitting.',
+        file=sys.stderr)
+        exit(1)
+      MateHit = PendingHits[1 - ReadIndex].pop(ReadName, None)
+      if MateHit is None:
+        PendingHits[ReadIndex][ReadName] = (sacc, evalue)
+        continue
+      (read1Hit, read1Evalue), (read2Hit, read2Evalue) = \
+      ((sacc, evalue), MateHit) if ReadIndex == 0 else (MateHit, (sacc, evalue))
+      if ReadPairIsContaminant(read1Hit, read1Evalue, read2Hit, read2Evalue,
+      args.RefName):
+        ContaminantReadPairs.append(ReadName)
+
+  # Write the output
+  for OutFile, suffix in [(args.OutFileBasename + '_1.txt', '/1'),
+  (args.OutFileBasename + '_2.txt', '/2')]:
+    with open(OutFile, 'w') as f:
+      for ReadName in ContaminantReadPairs:
+        f.write(ReadName + suffix + '\n')
@@ -25,8 +25,18 @@ if __name__ == "__main__":
   parser.add_option("-s", "--not-sorted", action="store_true", help='''Use this to
   specify that the read file and/or list of desired reads may not be sorted. We
   therefore search for the reads in a slightly slower manner.''')
+  parser.add_option("-m", "--ignore-mate-suffix", action="store_true",
+  help='''Ignore a trailing /1 or /2 in read names, both in the fastq file and
+  in the list of read names. This implies --not-sorted.''')
   (options, args) = parser.parse_args()
   invert = options.invert
+  if options.ignore_mate_suffix:
+    options.not_sorted = True
+
+  def StripMateSuffix(ReadName):
+    if options.ignore_mate_suffix and ReadName[-2:] in ('/1', '/2'):
+      return ReadName[:-2]
+    return ReadName
   
   # Check that this script was called from the command line with two arguments.
   if len(args) != 2:
@@ -50,7 +60,7 @@ if __name__ == "__main__":
   with open(FileOfReadNames, 'r') as f:
     for line in f:
       if options.not_sorted:
-        ReadNames.add(line.strip())
+        ReadNames.add(StripMateSuffix(line.strip()))
       else:
         ReadNames.append(line.strip())
   NumReadsToFind = len(ReadNames)
@@ -87,7 +97,8 @@ if __name__ == "__main__":
       # See if this is a read we want: a named read if invert = False,
       # or an unnamed read if invert = True.
       if options.not_sorted:
-        ThisReadInList = line[1:].split(None, 1)[0] in ReadNames
+        ThisReadInList = StripMateSuffix(line[1:].split(None, 1)[0]) in \
+        ReadNames
       else:
         ThisReadInList = line[1:].split(None, 1)[0] == ReadNames[NumNamedReadsFound]
       if ThisReadInList:
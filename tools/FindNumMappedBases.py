@@ -8,7 +8,7 @@ import argparse
 import numpy
 import pysam
 from Bio import SeqIO
-from ShiverFuncs import CalculateReadIdentity
+from ShiverFuncs import IterateReadsWithIdentity
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -50,6 +50,11 @@ if __name__ == "__main__":
   nucleotides from those reads with identity at least 0.5, then from those whose
   identity is at least 0.55, etc. This option requires the reference sequence to
   supplied using the --ref-file flag.''')
+  parser.add_argument('--use-md-tags', action='store_true', help='''For
+  --identity-binning, calculate read identities from the reads' MD tags (or NM
+  tags), where present, instead of comparing the reads to the reference. A ZI
+  tag, as written by RemoveDivergentReads.py --store-identity, is used in
+  preference to either.''')
   parser.add_argument('-R', '--ref-file', help='The file containing the '+\
   'sequence of the reference (to which reads were mapped in the bam file).', \
   type=File)
@@ -107,24 +112,21 @@ if __name__ == "__main__":
     NumMappedBases = 0
   
   NumDone = 0
-  for read in BamFile.fetch(RefName):
-  
+  if not BinByIdentity:
     # Add the number of mapped bases to the total if that's all we're doing.
-    if not BinByIdentity:
+    for read in BamFile.fetch(RefName):
       NumMappedBases += read.query_alignment_length
-      continue
-  
-    identity = CalculateReadIdentity(read, RefSeq)
+    print(NumMappedBases)
+    exit(0)
+
+  for read, identity in IterateReadsWithIdentity(BamFile.fetch(RefName), RefSeq,
+  args.use_md_tags):
   
     # Add the number of mapped bases to the bin for reads with this identity
     NumMappedBasesByReadIdentity[Bin(identity)] += \
     read.query_alignment_length
   
-    
-  if not BinByIdentity:
-    print(NumMappedBases)
-    exit(0)
-  
+
   print('Minimum read identity, Number of mapped bases')
   for i in range(NumBins):
     print(Min + i*BinWidth, sum(NumMappedBasesByReadIdentity[i:]), sep=',')
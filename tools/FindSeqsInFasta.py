@@ -3,9 +3,10 @@ from __future__ import print_function
 import argparse
 import os
 import sys
-from Bio import SeqIO
+from Bio import SeqIO, Seq
 import collections
-from AuxiliaryFunctions import ungap
+from AuxiliaryFunctions import ungap, IterateFastaRecords, ReadFastaIndex, \
+GetFastaIndex, IndexedFasta
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -84,6 +85,12 @@ if __name__ == "__main__":
   parser.add_argument('-D', '--allow-duplicates', action='store_true', help='''
   Used to specify that there may be duplicate names in the input sequences; for
   each named searched for, return all matches.''')
+  parser.add_argument('-I', '--create-index', action='store_true', help='''When
+  simply looking up sequences by name (i.e. without --invert-search,
+  --match-start or --allow-duplicates), we read only the desired sequences using
+  the index FastaFile.fai, if it exists (in samtools faidx format) and is up to
+  date. With this option we create that index if needed, so that later look-ups
+  in the same file are fast.''')
   
   args = parser.parse_args()
   
@@ -121,11 +128,27 @@ if __name__ == "__main__":
   
   NumSeqsToSearchFor = len(SeqNames)
   
+  # When simply looking sequences up by name, we can use an index of the fasta
+  # file to read in only those sequences. Otherwise, read through all of them.
+  index = None
+  if not (args.invert_search or args.match_start or args.allow_duplicates):
+    if args.create_index:
+      index = GetFastaIndex(args.FastaFile, WriteIndex=True)
+    else:
+      index = ReadFastaIndex(args.FastaFile)
+  if index is None:
+    records = IterateFastaRecords(args.FastaFile)
+  else:
+    IndexedSeqs = IndexedFasta(args.FastaFile, index)
+    records = ((_name, IndexedSeqs.title(_name), IndexedSeqs[_name]) for _name \
+    in IndexedSeqs if _name in SeqNames)
+
   # Find the seqs
   AllSeqNamesEncountered = []
   SeqsWeWant = []
   SeqsWeWant_names = []
-  for seq in SeqIO.parse(open(args.FastaFile),'fasta'):
+  for SeqName, title, SeqString in records:
+    seq = SeqIO.SeqRecord(Seq.Seq(SeqString), id=SeqName, description=title)
     AllSeqNamesEncountered.append(seq.id)
     if args.match_start:
       ThisSeqWasSearchedFor = False
@@ -152,6 +175,8 @@ if __name__ == "__main__":
         exit(1)
       SeqsWeWant.append(seq)
       SeqsWeWant_names.append(seq.id)
+  if index is not None:
+    IndexedSeqs.close()
   
   # Check we found some sequences for printing!
   if (not args.ignore_missing) and SeqsWeWant == []:
@@ -167,6 +192,8 @@ if __name__ == "__main__":
   
   # Check all specified seqs were encountered (unless only the beginnings of names
   # were specified).
+  if index is not None:
+    AllSeqNamesEncountered = list(index.keys())
   if not (args.match_start or args.ignore_missing):
     SeqsNotFound = [_seq for _seq in SeqNames \
     if not _seq in AllSeqNamesEncountered]
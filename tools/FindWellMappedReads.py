@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import argparse
+import pysam
+from Bio import SeqIO
+from ShiverFuncs import IterateReadsWithIdentity
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''This script writes the names of the reads in a bam
+  file that mapped well: those that are mapped, have an identity (the fraction of
+  bases which are mapped and agree with the reference) of at least
+  --min-identity, and have no more than --max-clipped-frac of their length
+  clipped. With --paired, only the names of pairs in which both reads mapped well
+  are written. A trailing /1 or /2 is removed from read names, in case the
+  mapper kept them. Secondary and supplementary alignments are ignored. The
+  intended use is finding the reads that are worth checking for contamination
+  after mapping: all those not named here (see FindNamedReadsInSortedFastq.py
+  --invert --ignore-mate-suffix).
+  '''
+
+  # Define a function to check files exist, as a type for the argparse.
+  def File(MyFile):
+    if not os.path.isfile(MyFile):
+      raise argparse.ArgumentTypeError(MyFile+' does not exist or is not a file.')
+    return MyFile
+
+  # Define a function to check a fraction, as a type for the argparse.
+  def Fraction(MyFrac):
+    try:
+      MyFrac = float(MyFrac)
+      assert 0 <= MyFrac <= 1
+    except (ValueError, AssertionError):
+      raise argparse.ArgumentTypeError(str(MyFrac) + ' is not a number between '
+      '0 and 1.')
+    return MyFrac
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('RefFile', type=File)
+  parser.add_argument('BamFile', type=File)
+  parser.add_argument('OutFile')
+  parser.add_argument('-I', '--min-identity', type=Fraction, default=0.9,
+  help='(default: %(default)s)')
+  parser.add_argument('-C', '--max-clipped-frac', type=Fraction, default=0.2,
+  help='''The largest fraction of a read's length that can be soft- or
+  hard-clipped (default: %(default)s).''')
+  parser.add_argument('-P', '--paired', action='store_true')
+  parser.add_argument('--use-md-tags', action='store_true', help='''Calculate
+  read identities from the reads' MD tags (or NM tags), where present, instead
+  of comparing the reads to the reference.''')
+  args = parser.parse_args()
+
+  # Get the reference.
+  SeqList = list(SeqIO.parse(open(args.RefFile), 'fasta'))
+  if len(SeqList) != 1:
+    print('There are', len(SeqList), 'sequences in', args.RefFile +\
+    '. There should be exactly 1. Quitting.', file=sys.stderr)
+    exit(1)
+  RefSeq = str(SeqList[0].seq)
+
+  def StripMateSuffix(ReadName):
+    if ReadName[-2:] in ('/1', '/2'):
+      return ReadName[:-2]
+    return ReadName
+
+  SoftClip, HardClip = 4, 5
+  def ClippedFrac(read):
+    '''The fraction of the read's length that is clipped.'''
+    NumClipped = sum(_length for _op, _length in read.cigartuples \
+    if _op in (SoftClip, HardClip))
+    return float(NumClipped) / max(read.infer_read_length(), 1)
+
+  BamFile = pysam.AlignmentFile(args.BamFile, "rb")
+  reads = (_read for _read in BamFile.fetch(until_eof=True) \
+  if not (_read.is_secondary or _read.is_supplementary))
+
+  # For paired reads, hold the result for the first read of each pair until its
+  # mate is found (which for a coordinate-sorted file is usually soon after).
+  FirstMateMappedWell = {}
+  with open(args.OutFile, 'w') as f:
+    for read, identity in IterateReadsWithIdentity(reads, RefSeq,
+    args.use_md_tags):
+      MappedWell = (not read.is_unmapped) and identity >= args.min_identity and \
+      ClippedFrac(read) <= args.max_clipped_frac
+      ReadName = StripMateSuffix(read.query_name)
+      if not args.paired:
+        if MappedWell:
+          f.write(ReadName + '\n')
+        continue
+      MateMappedWell = FirstMateMappedWell.pop(ReadName, None)
+      if MateMappedWell is None:
+        FirstMateMappedWell[ReadName] = MappedWell
+      elif MappedWell and MateMappedWell:
+        f.write(ReadName + '\n')
+  BamFile.close()
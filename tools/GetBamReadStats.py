@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import argparse
+import array
+import numpy as np
+import pysam
+from ShiverFuncs import InsertSizeCountsCsv, PysamThreads
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''Prints the number of reads in a bam file (i.e. the
+  number of lines that samtools view would print), taken from the index if the
+  file is indexed. Optionally also writes the distribution of (positive) insert
+  sizes to a csv file, as shiver does, reading through the bam file once. The
+  csv file is not written if no read has a positive insert size.'''
+
+  # Define a function to check files exist, as a type for the argparse.
+  def File(MyFile):
+    if not os.path.isfile(MyFile):
+      raise argparse.ArgumentTypeError(MyFile+' does not exist or is not a file.')
+    return MyFile
+
+  # Define a function to check ints are positive, as a type for the argparse.
+  def PositiveInt(MyInt):
+    try:
+      MyInt = int(MyInt)
+      assert MyInt > 0
+    except (ValueError, AssertionError):
+      raise argparse.ArgumentTypeError(str(MyInt) + ' is not a positive integer.')
+    return MyInt
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('BamFile', type=File)
+  parser.add_argument('-I', '--insert-size-counts', help='''The csv file to
+  write the insert size distribution to.''')
+  parser.add_argument('-@', '--threads', type=PositiveInt, default=1,
+  help='''The number of threads to use for decompressing the bam file (default
+  1).''')
+  args = parser.parse_args()
+
+  BamFile = pysam.AlignmentFile(args.BamFile, "rb",
+  threads=PysamThreads(args.threads))
+  HaveIndex = BamFile.has_index()
+  if HaveIndex:
+    NumReads = BamFile.mapped + BamFile.unmapped
+
+  def AddToCounts(counts, values):
+    '''Adds the values to an array of counts indexed by value.'''
+    NewCounts = np.bincount(np.frombuffer(values, dtype=np.int64))
+    if len(NewCounts) < len(counts):
+      NewCounts, counts = counts, NewCounts
+    NewCounts[:len(counts)] += counts
+    return NewCounts
+
+  if args.insert_size_counts is not None or not HaveIndex:
+    NumReadsRead = 0
+    InsertSizeCounts = np.zeros(0, dtype=np.int64)
+    InsertSizes = array.array('q')
+    for read in BamFile.fetch(until_eof=True):
+      NumReadsRead += 1
+      if read.template_length > 0:
+        InsertSizes.append(read.template_length)
+        if len(InsertSizes) == 100000:
+          InsertSizeCounts = AddToCounts(InsertSizeCounts, InsertSizes)
+          del InsertSizes[:]
+    InsertSizeCounts = AddToCounts(InsertSizeCounts, InsertSizes)
+    if not HaveIndex:
+      NumReads = NumReadsRead
+  BamFile.close()
+
+  if args.insert_size_counts is not None and InsertSizeCounts.sum() > 0:
+    with open(args.insert_size_counts, 'w') as f:
+      f.write('\n'.join(InsertSizeCountsCsv(InsertSizeCounts)) + '\n')
+
+  print(NumReads)
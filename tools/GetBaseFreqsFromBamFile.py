@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from six.moves import range
+import argparse
+import os
+import sys
+import collections
+import pysam
+from AuxiliaryFunctions import ReadSequencesFromFile
+from ShiverFuncs import CountBasesInBam, CountBasesInBamInParallel, \
+BaseFreqsBases
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''Calculates the base frequencies at each position of
+  the reference directly from a bam file, giving the same output as running
+  samtools mpileup on the bam file and then AnalysePileup.py on the pileup, but
+  without writing or parsing the (potentially huge) pileup file. The options
+  below are those of samtools mpileup that affect the base counts, so that
+  shiver's mpileupOptions can be passed straight through; BAQ is not
+  implemented, so --no-BAQ (or -B) is required. Output is printed to stdout
+  suitable for redirection into a csv file.'''
+
+  # Define a function to check files exist, as a type for the argparse.
+  def File(MyFile):
+    if not os.path.isfile(MyFile):
+      raise argparse.ArgumentTypeError(MyFile+' does not exist or is not a file.')
+    return MyFile
+
+  # Define functions to check ints are not negative / are positive, as types
+  # for the argparse.
+  def NonNegativeInt(MyInt):
+    try:
+      MyInt = int(MyInt)
+      assert MyInt >= 0
+    except (ValueError, AssertionError):
+      raise argparse.ArgumentTypeError(str(MyInt) + \
+      ' is not a non-negative integer.')
+    return MyInt
+  def PositiveInt(MyInt):
+    try:
+      MyInt = int(MyInt)
+      assert MyInt > 0
+    except (ValueError, AssertionError):
+      raise argparse.ArgumentTypeError(str(MyInt) + ' is not a positive integer.')
+    return MyInt
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('BamFile', type=File)
+  parser.add_argument('RefFile', type=File, help='''A fasta file containing
+  the (one) reference sequence the reads in the bam file are mapped to.''')
+  parser.add_argument('-B', '--no-BAQ', action='store_true', help='''As for
+  samtools mpileup: disable base alignment quality computation. Required.''')
+  parser.add_argument('-Q', '--min-BQ', type=NonNegativeInt, default=13,
+  help='''As for samtools mpileup: skip bases with base quality smaller than
+  this (default 13).''')
+  parser.add_argument('-q', '--min-MQ', type=NonNegativeInt, default=0,
+  help='''As for samtools mpileup: skip reads with mapping quality smaller
+  than this (default 0).''')
+  parser.add_argument('-d', '--max-depth', type=NonNegativeInt, default=8000,
+  help='''As for samtools mpileup, but here we only warn about positions with
+  more reads than this instead of skipping reads (default 8000).''')
+  parser.add_argument('-A', '--count-orphans', action='store_true',
+  help='''As for samtools mpileup: don't skip reads that are paired but not in
+  a proper pair.''')
+  parser.add_argument('-x', '--ignore-overlaps', action='store_true',
+  help='''As for samtools mpileup: don't modify the base qualities where the
+  two reads of a pair overlap.''')
+  parser.add_argument('--reads-per-chunk', type=PositiveInt, default=2000,
+  help='''How many reads to hold in memory and count together (default
+  2000).''')
+  parser.add_argument('-P', '--num-processes', type=PositiveInt, default=1,
+  help='''Split the reference into windows and count the bases in each window
+  in parallel with this many processes (default 1). This requires the bam file
+  to be indexed.''')
+  parser.add_argument('--window-size', type=PositiveInt, help='''With
+  --num-processes greater than 1, the size of the windows (by default the
+  reference length divided by four times the number of processes, but at least
+  500). Reads overlapping two windows are processed for each.''')
+  args = parser.parse_args()
+
+  if not args.no_BAQ:
+    print('BAQ computation is not implemented by', sys.argv[0] + '; run it',
+    'with --no-BAQ (or -B), or use samtools mpileup with AnalysePileup.py',
+    'instead. Quitting.', file=sys.stderr)
+    exit(1)
+
+  # Read in the reference; there should only be one sequence.
+  AllSequences, ReferenceLength = ReadSequencesFromFile(args.RefFile, False)
+  if len(AllSequences) != 1:
+    print('Found', len(AllSequences), 'sequences in', args.RefFile+\
+    '; expected 1.\nQuitting.', file=sys.stderr)
+    exit(1)
+  [(RefName, RefSeq)] = list(AllSequences.items())
+  RefSeq = RefSeq.upper()
+
+  # Check the bam file is mapped to that reference (and only that).
+  BamFile = pysam.AlignmentFile(args.BamFile, "rb")
+  AllReferences = BamFile.references
+  if len(AllReferences) != 1:
+    print('Expected exactly one reference in', args.BamFile+'; found',\
+    str(len(AllReferences))+'.\nQuitting.', file=sys.stderr)
+    exit(1)
+  RefNameInBam = AllReferences[0]
+  if BamFile.lengths[0] != ReferenceLength:
+    print('The reference', RefNameInBam, 'in', args.BamFile, 'has length',
+    BamFile.lengths[0], 'but the sequence in', args.RefFile, 'has length',
+    str(ReferenceLength) + '.\nQuitting.', file=sys.stderr)
+    exit(1)
+
+  options = {'MinBaseQual': args.min_BQ, 'MinMapQual': args.min_MQ,
+  'CountOrphans': args.count_orphans, 'IgnoreOverlaps': args.ignore_overlaps,
+  'ReadsPerChunk': args.reads_per_chunk}
+  NumProcesses = args.num_processes
+  if NumProcesses > 1 and not BamFile.has_index():
+    print('Warning:', args.BamFile, 'is not indexed, so we cannot process',
+    'windows of the reference in parallel; using one process.', file=sys.stderr)
+    NumProcesses = 1
+  if NumProcesses > 1:
+    BamFile.close()
+    WindowSize = args.window_size
+    if WindowSize is None:
+      WindowSize = max(-(-ReferenceLength // (4 * NumProcesses)), 500)
+    counts, InsertionMarks, insertions, NumReadsUsed = \
+    CountBasesInBamInParallel(args.BamFile, RefNameInBam, RefSeq, NumProcesses,
+    WindowSize, **options)
+  else:
+    counts, InsertionMarks, insertions, NumReadsUsed = CountBasesInBam(BamFile,
+    RefNameInBam, RefSeq, **options)
+    BamFile.close()
+
+  if NumReadsUsed == 0:
+    print('Found no pileup information. Quitting.', file=sys.stderr)
+    exit(1)
+
+  # Anything other than A, C, G, T, gap or N would make AnalysePileup.py fail
+  # its check of the number of bases; do the same here.
+  depths = counts.sum(axis=1)
+  for PosMin1 in counts[:, len(BaseFreqsBases)].nonzero()[0]:
+    print('WARNING: unexpected base(s) occur', counts[PosMin1,
+    len(BaseFreqsBases)], 'times at reference position', str(PosMin1 + 1) + \
+    '.', file=sys.stderr)
+    print('Error: counted', depths[PosMin1] - counts[PosMin1,
+    len(BaseFreqsBases)], 'bases at reference position', PosMin1 + 1,
+    'whereas', depths[PosMin1], 'reads pass the filters there.\nQuitting.',
+    file=sys.stderr)
+    exit(1)
+  MaxDepth = depths.max()
+  if args.max_depth > 0 and MaxDepth > args.max_depth:
+    print('Warning: the maximum depth in', args.BamFile, 'is', str(MaxDepth) + \
+    ', exceeding the --max-depth value of', str(args.max_depth) + \
+    '. samtools mpileup would have skipped some reads; we have not.',
+    file=sys.stderr)
+
+  # Group the insertions by position, in bam file order at each position, the
+  # order samtools mpileup would list them.
+  InsertionsByPos = collections.defaultdict(list)
+  for ReadNumber, PosMin1, insertion in sorted(insertions):
+    InsertionsByPos[PosMin1].append(insertion)
+
+  # Where more reads have an insertion than not, and the most common insertion
+  # size (with 0 always a possibility) is greater than zero, add that many
+  # positions after the reference position, counting bases only in insertions
+  # of exactly that size.
+  OutLines = ['position in ' + RefNameInBam + ',base in ' + RefNameInBam + \
+  ',A count,C count,G count,T count,gap count,N count']
+  for PosMin1 in range(ReferenceLength):
+    OutLines.append(str(PosMin1 + 1) + ',' + RefSeq[PosMin1] + ',' + \
+    ','.join(map(str, counts[PosMin1, :len(BaseFreqsBases)])))
+    NumReadsWithInsertion = InsertionMarks[PosMin1]
+    NumReadsWithoutInsertion = depths[PosMin1] - NumReadsWithInsertion
+    if NumReadsWithInsertion <= NumReadsWithoutInsertion:
+      continue
+    InsertionsBySize = collections.OrderedDict()
+    for insertion in InsertionsByPos[PosMin1]:
+      InsertionsBySize.setdefault(len(insertion), []).append(insertion.upper())
+    MostCommonInsertionSize = 0
+    NumberOfReadsWithMostCommonInsertionSize = NumReadsWithoutInsertion
+    for InsertionSize, AllInsertionsThatSize in InsertionsBySize.items():
+      if len(AllInsertionsThatSize) > NumberOfReadsWithMostCommonInsertionSize:
+        MostCommonInsertionSize = InsertionSize
+        NumberOfReadsWithMostCommonInsertionSize = len(AllInsertionsThatSize)
+    InsertionsConsidered = InsertionsBySize.get(MostCommonInsertionSize, [])
+    for PositionInInsertion in range(MostCommonInsertionSize):
+      BaseCounts = collections.Counter(_insertion[PositionInInsertion] for \
+      _insertion in InsertionsConsidered)
+      for base in BaseCounts:
+        if not base in BaseFreqsBases:
+          print('WARNING: unexpected base', base, 'occurs', BaseCounts[base],
+          'times in an insertion at reference position', str(PosMin1 + 1) + \
+          '.', file=sys.stderr)
+      OutLines.append('NA,-,' + ','.join(str(BaseCounts[_base]) for _base in \
+      BaseFreqsBases))
+
+  sys.stdout.write('\n'.join(OutLines) + '\n')
@@ -54,6 +54,12 @@ if __name__ == "__main__":
   specify that the first line is a header line (which we therefore always include
   in the output, excluding it from the sort-based choice of lines). By default we
   assume there is no header line (as is the case in blast output).''')
+  parser.add_argument('-D', '--expand-duplicates', metavar='DuplicatesFile',
+  type=File, help='''Used to specify a csv file, as written by
+  ConvertFastqToFasta.py --deduplicate, of pairs of IDs: one that is in the data
+  file, then one that is a duplicate of it (and so absent from the data file).
+  For each such pair, the row kept for the first ID is written out a second time
+  with the second ID in place of the first, after all the other rows.''')
   args = parser.parse_args()
   
   if args.sort_field > args.num_fields:
@@ -64,6 +70,10 @@ if __name__ == "__main__":
     print("Error: id_field cannot be larger than num_fields. Quitting.",
     file=sys.stderr) 
     exit(1)
+  if args.expand_duplicates is not None and args.order_by_id:
+    print("Error: --expand-duplicates and --order_by_id cannot be used together.",
+    "Quitting.", file=sys.stderr) 
+    exit(1)
   
   rows_to_keep = OrderedDict()
   
@@ -113,4 +123,13 @@ if __name__ == "__main__":
     else:
       for value in rows_to_keep.values():
         f.write(value[0])
+    if args.expand_duplicates is not None:
+      with open(args.expand_duplicates, 'r') as f_dups:
+        for line in f_dups:
+          id_, duplicate_id = line.rstrip('\n').split(',')
+          if not id_ in rows_to_keep:
+            continue
+          fields = rows_to_keep[id_][0].split(args.separator)
+          fields[args.id_field - 1] = duplicate_id
+          f.write(args.separator.join(fields))
   
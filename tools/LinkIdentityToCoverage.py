@@ -1,13 +1,13 @@
 #!/usr/bin/env python
 from __future__ import print_function, division
-from six.moves import range
 import os
 import sys
 import argparse
 import pysam
 import subprocess
+import numpy as np
 from Bio import SeqIO
-from ShiverFuncs import CalculateReadIdentity
+from ShiverFuncs import IterateReadsWithIdentity
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -48,6 +48,10 @@ if __name__ == "__main__":
   only once, which is what samtools mpileup does unless you specify
   --ignore-overlaps and/or --min-BQ 0). With this option, we will count the
   overlap twice.""")
+  parser.add_argument('--use-md-tags', action='store_true', help='''Calculate
+  read identities from the reads' MD tags (or NM tags), where present, instead
+  of comparing the reads to the reference. A ZI tag, as written by
+  RemoveDivergentReads.py --store-identity, is used in preference to either.''')
   args = parser.parse_args()
   
   SeqList = list(SeqIO.parse(open(args.RefFile), 'fasta'))
@@ -90,7 +94,7 @@ if __name__ == "__main__":
   if HaveStart:
     start -= 1
     if not HaveEnd:
-      end == RefLength
+      end = RefLength - 1
     elif end < start:
       print('The end point should not be before the start point. Quitting.',
       file=sys.stderr)
@@ -103,67 +107,92 @@ if __name__ == "__main__":
   # At each reference position record (1) the number of reads mapped here and (2)
   # the sum of the identity values of reads mapped here. Each read contributes to
   # a count of 1, and its identity value, to every position to which it is mapped.
-  CoveragesByPos = [0 for _pos in range(RefLength)]
-  IdentityTotalsByPos = [0 for _pos in range(RefLength)]
-  PositionsByRead = {}
-  for read in BamFile.fetch(RefName):
+  # We record these as difference arrays: each interval of mapped positions adds
+  # to its first position and subtracts from the position after its last; the
+  # cumulative sums then give the values at each position.
+  CoverageDiffs = np.zeros(RefLength + 1, dtype=np.int64)
+  IdentityTotalDiffs = np.zeros(RefLength + 1, dtype=np.float64)
+  IntervalStarts = []
+  IntervalEnds = []
+  IntervalIdentities = []
+  def AddIntervals():
+    '''Adds the intervals recorded so far to the difference arrays.'''
+    CoverageDiffs[:] += np.bincount(IntervalStarts, minlength=RefLength + 1) - \
+    np.bincount(IntervalEnds, minlength=RefLength + 1)
+    IdentityTotalDiffs[:] += np.bincount(IntervalStarts, IntervalIdentities,
+    minlength=RefLength + 1) - np.bincount(IntervalEnds, IntervalIdentities,
+    minlength=RefLength + 1)
+    del IntervalStarts[:], IntervalEnds[:], IntervalIdentities[:]
+
+  def SubtractIntervals(intervals, OtherIntervals):
+    '''Removes from a sorted list of non-overlapping [start, end) intervals the
+    parts covered by another such list.'''
+    result = []
+    i = 0
+    NumOtherIntervals = len(OtherIntervals)
+    for IntervalStart, IntervalEnd in intervals:
+      while i < NumOtherIntervals and OtherIntervals[i][1] <= IntervalStart:
+        i += 1
+      j = i
+      while j < NumOtherIntervals and OtherIntervals[j][0] < IntervalEnd:
+        OtherStart, OtherEnd = OtherIntervals[j]
+        if OtherStart > IntervalStart:
+          result.append((IntervalStart, OtherStart))
+        IntervalStart = max(IntervalStart, OtherEnd)
+        if IntervalStart >= IntervalEnd:
+          break
+        j += 1
+      if IntervalStart < IntervalEnd:
+        result.append((IntervalStart, IntervalEnd))
+    return result
+
+  # The mapped intervals of reads whose mate we expect to overlap them but have
+  # not seen yet; each is removed when the mate is seen.
+  IntervalsByRead = {}
+  for read, identity in IterateReadsWithIdentity(BamFile.fetch(RefName), RefSeq,
+  args.use_md_tags):
   
     if read.is_unmapped or read.is_supplementary:
       continue
   
-    MappedPositions = read.get_reference_positions(full_length=False)
+    MappedIntervals = read.get_blocks()
   
     # If this read is paired and we've seen its mate already, ignore mapped
     # positions in this read that were contained in the mate. If we haven't seen
-    # the mate already, record this read's positions.
+    # the mate already, record this read's positions if the mate (which comes
+    # later, the reads being sorted) may overlap them.
     if (not args.double_count_overlaps) and read.is_paired:
-      if read.query_name in PositionsByRead:
-        MatePositions = PositionsByRead[read.query_name]
-        MappedPositions = [_pos for _pos in MappedPositions if not _pos in \
-        MatePositions]
-        if not MappedPositions:
+      MateIntervals = IntervalsByRead.pop(read.query_name, None)
+      if MateIntervals is not None:
+        MappedIntervals = SubtractIntervals(MappedIntervals, MateIntervals)
+        if not MappedIntervals:
           continue
-      else:
-        PositionsByRead[read.query_name] = MappedPositions
-  
-    identity = CalculateReadIdentity(read, RefSeq)
+      elif (not read.mate_is_unmapped) and \
+      read.reference_start <= read.next_reference_start < read.reference_end:
+        IntervalsByRead[read.query_name] = MappedIntervals
   
-    CheckPositionsInWindow = False
+    # Only count positions inside the window of interest, if we have one.
     if HaveWindow:
-      # Skip reads wholly outside the window of interest
-      if MappedPositions[0] > end or MappedPositions[-1] < start:
-        continue
-      # Reads partially in, partially out the window need to be checked
-      if MappedPositions[0] < start or MappedPositions[-1] > end:
-        CheckPositionsInWindow = True
-    if CheckPositionsInWindow:
-      for pos in MappedPositions:
-        if pos >= start:
-          if pos > end:
-            break
-          CoveragesByPos[pos] += 1
-          IdentityTotalsByPos[pos] += identity
-    else:  
-      for pos in MappedPositions:
-        CoveragesByPos[pos] += 1
-        IdentityTotalsByPos[pos] += identity  
-  
-  
+      MappedIntervals = [(max(_start, start), min(_end, end + 1)) for _start, \
+      _end in MappedIntervals if _start <= end and _end > start]
+    for IntervalStart, IntervalEnd in MappedIntervals:
+      IntervalStarts.append(IntervalStart)
+      IntervalEnds.append(IntervalEnd)
+      IntervalIdentities.append(identity)
+    if len(IntervalStarts) >= 100000:
+      AddIntervals()
+  AddIntervals()
+  CoveragesByPos = np.cumsum(CoverageDiffs)[:RefLength]
+  IdentityTotalsByPos = np.cumsum(IdentityTotalDiffs)[:RefLength]
   
   # Combine identity totals for positions that have the same coverage, and count
   # how many positions have that coverage.
-  IdentityTotalsByCoverage = {}
-  CoverageCounts = {}
-  for pos in range(RefLength):
-    coverage = CoveragesByPos[pos]
-    if coverage > 0:
-      IdentityTotal = IdentityTotalsByPos[pos]
-      if coverage in IdentityTotalsByCoverage:
-        IdentityTotalsByCoverage[coverage] += IdentityTotal
-        CoverageCounts[coverage] += 1
-      else:
-        IdentityTotalsByCoverage[coverage] = IdentityTotal
-        CoverageCounts[coverage] = 1
+  CoveredPositions = CoveragesByPos > 0
+  IdentityTotalsByCoverage = np.bincount(CoveragesByPos[CoveredPositions],
+  IdentityTotalsByPos[CoveredPositions])
+  CoverageCounts = np.bincount(CoveragesByPos[CoveredPositions])
+  CoverageCounts = {_coverage: int(_count) for _coverage, _count in \
+  enumerate(CoverageCounts) if _count > 0}
   
   # The total number of reads present in all positions with a given coverage
   # (counting each read once per position-that-has-that-coverage, not once in
@@ -47,8 +47,9 @@ if __name__ == "__main__":
   'the positions of gaps of a second sequence - the reference - which is in '+\
   'both alignments.', epilog = 'Either the -d option or the -e option (but not'+\
   ' both) must be specified.')
-  parser.add_argument('MainAlignmentFile', help='The fasta file containing an '+\
-  'alignment of the reference and (many?) other sequences.')
+  parser.add_argument('MainAlignmentFile', nargs='?', help='The fasta file '+\
+  'containing an alignment of the reference and (many?) other sequences. '+\
+  'Omit this if using --coords-file.')
   parser.add_argument('PairedAlignmentFile', help='The fasta file containing an'+\
   ' alignment of the reference and one other sequence - the one you want to add'+\
   ' to the main alignment file.')
@@ -61,11 +62,37 @@ if __name__ == "__main__":
   "is the main alignment as is, i.e. including the reference.")
   parser.add_argument('-L', '--log-file', help='Used to specify a log file '
   'describing the coordinate transformation.')
+  parser.add_argument('-C', '--coords-file', help='Instead of the main '+\
+  'alignment, use a log file written by a previous run of this script with '+\
+  'the --log-file option, for the same reference and main alignment, to '+\
+  'place the other sequence. This allows the sequence to be replaced (e.g. '+\
+  'by a consensus called with different thresholds) when the main alignment '+\
+  'is no longer available. The -d and -e options are then not needed, since '+\
+  'the log file records which positions were excised, but --ref-seq-name is.')
+  parser.add_argument('--ref-seq-name', help='With --coords-file, the name '+\
+  'of the reference in the paired alignment.')
   
   args = parser.parse_args()
   
+  UseCoordsFile = args.coords_file != None
+  if UseCoordsFile:
+    if args.MainAlignmentFile != None:
+      print('The MainAlignmentFile argument should not be used with the',
+      '--coords-file option. Quitting.', file=sys.stderr)
+      exit(1)
+    if args.ref_seq_name == None:
+      print('The --coords-file option requires the --ref-seq-name option.',
+      'Quitting.', file=sys.stderr)
+      exit(1)
+  elif args.MainAlignmentFile == None:
+    print('The MainAlignmentFile argument is required unless the',
+    '--coords-file option is used. Quitting.', file=sys.stderr)
+    exit(1)
+
   # Check whether we're excising or not.
-  if (args.excise and args.dont_excise) or \
+  if UseCoordsFile:
+    pass
+  elif (args.excise and args.dont_excise) or \
   (not args.excise and not args.dont_excise):
     print('Either the -d option or the -e option (but not both) must be '+\
     'specified.', file=sys.stderr)
@@ -77,15 +104,23 @@ if __name__ == "__main__":
   ExciseUniqueInsertionsOfRefInMainAlignment = args.excise
   
   # Check that the arguments exist and are files
-  for InputFile in [MainAlnFile, PairedAlnFile]:
+  if UseCoordsFile:
+    InputFiles = [args.coords_file, PairedAlnFile]
+  else:
+    InputFiles = [MainAlnFile, PairedAlnFile]
+  for InputFile in InputFiles:
     if not os.path.isfile(InputFile):
       print(InputFile, 'does not exist or is not a file.', file=sys.stderr)
       exit(1)
   
-  # Read in the sequences from the main alignment file (into a dictionary)
-  MainAlnSeqDict, MainAlnSeqLength = ReadSequencesFromFile(MainAlnFile)
-  MainAlnSeqNames = list(MainAlnSeqDict.keys())
-  MainAlnSeqs     = list(MainAlnSeqDict.values())
+  # Read in the sequences from the main alignment file (into a dictionary).
+  # With a coords file, all we need to know is the name of the reference.
+  if UseCoordsFile:
+    MainAlnSeqNames = [args.ref_seq_name]
+  else:
+    MainAlnSeqDict, MainAlnSeqLength = ReadSequencesFromFile(MainAlnFile)
+    MainAlnSeqNames = list(MainAlnSeqDict.keys())
+    MainAlnSeqs     = list(MainAlnSeqDict.values())
   
   
   # Read in the sequences from the paired alignment file
@@ -117,7 +152,6 @@ if __name__ == "__main__":
   
   SeqToAdd = PairedAlnSeqDict[SeqToAddName]
   RefSeqFromPair = PairedAlnSeqDict[RefSeqName]
-  RefSeqFromMain = MainAlnSeqDict[RefSeqName]
   
   # Compare the duplicated sequence to its duplicate in the main alignment.
   # Does the reference sequence in the paired alignment contain gaps? If so we
@@ -155,6 +189,50 @@ if __name__ == "__main__":
   # refseq (and the 'to' coords are with respect to the final alignment, i.e. the
   # output.)
    
+  # Thanks Stackoverflow:
+  def insert_newlines(string, every=FastaSeqLineLength):
+      lines = []
+      for i in range(0, len(string), every):
+          lines.append(string[i:i+every])
+      return '\n'.join(lines)
+
+  # With a coords file, each position in the final alignment is either a gap or
+  # the given position in the reference; excised positions are absent.
+  if UseCoordsFile:
+    SeqToAdd_WithGaps = ''
+    NumRefPositions = 0
+    with open(args.coords_file) as f:
+      for LineNumMin1, line in enumerate(f):
+        if LineNumMin1 == 0:
+          continue
+        fields = line.strip().split(',')
+        try:
+          assert len(fields) == 3
+          if fields[1] != '-':
+            RefPosition = int(fields[1])
+            NumRefPositions += 1
+            assert RefPosition == NumRefPositions
+        except (ValueError, AssertionError):
+          print('Unexpected format for line', LineNumMin1 + 1, 'of',
+          args.coords_file + ':\n' + line + 'Quitting.', file=sys.stderr)
+          exit(1)
+        if fields[0] == '-':
+          continue
+        if fields[1] == '-':
+          SeqToAdd_WithGaps += GapChar
+        else:
+          SeqToAdd_WithGaps += SeqToAdd[RefPosition - 1]
+    if NumRefPositions != len(RefSeqFromPair):
+      print(args.coords_file, 'describes', NumRefPositions, 'positions in the',
+      'reference, but', RefSeqName, 'has', len(RefSeqFromPair), 'bases in',
+      PairedAlnFile + '. Quitting.', file=sys.stderr)
+      exit(1)
+    print('>'+SeqToAddName)
+    print(insert_newlines(PropagateNoCoverageChar(SeqToAdd_WithGaps)))
+    exit(0)
+
+  RefSeqFromMain = MainAlnSeqDict[RefSeqName]
+
   # Check that the two versions of the ref seq differ only with regards to gaps
   # and upper/lower case:
   if RefSeqFromMain.replace(GapChar,'').upper() != RefSeqFromPair.upper():
@@ -222,13 +300,6 @@ if __name__ == "__main__":
   
   FinalSeqToAdd = PropagateNoCoverageChar(SeqToAdd_WithGaps)
   
-  # Thanks Stackoverflow:
-  def insert_newlines(string, every=FastaSeqLineLength):
-      lines = []
-      for i in range(0, len(string), every):
-          lines.append(string[i:i+every])
-      return '\n'.join(lines)
-  
   print('>'+SeqToAddName)
   print(insert_newlines(FinalSeqToAdd))
   #print('>'+RefSeqName+'_UniqueInsertionsExcised')
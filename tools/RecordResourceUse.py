@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import stat
+import argparse
+import json
+import time
+import subprocess
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''Runs a command (all arguments after RecordFile),
+  passing through its stdin, stdout and stderr, then appends a record of the
+  resources it used to RecordFile as one line of json: its wall time, user and
+  system CPU time, peak resident memory (that of the command or of its largest
+  descendant), the total size of its input files (those of its arguments that are
+  existing files) and of its output files (those of its arguments that the
+  command created or modified, plus anything it wrote to stdout if that is
+  redirected to a file). Exits with the exit status of the command. Records from
+  many commands can be summarised with SummariseResourceUse.py.'''
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('RecordFile')
+  parser.add_argument('command', nargs=argparse.REMAINDER)
+  parser.add_argument('-C', '--context', default='', help='''Something to
+  record about where the command was run from, e.g. the name of the calling
+  function.''')
+  args = parser.parse_args()
+
+  if len(args.command) == 0:
+    print('No command given. Quitting.', file=sys.stderr)
+    exit(1)
+
+  def FileState(path):
+    '''Returns the size and modification time of a regular file, or None.'''
+    try:
+      FileStat = os.stat(path)
+    except (OSError, ValueError):
+      return None
+    if not stat.S_ISREG(FileStat.st_mode):
+      return None
+    return FileStat.st_size, FileStat.st_mtime
+
+  def StdoutSize():
+    '''Returns the size of the file stdout is redirected to, or None.'''
+    try:
+      FileStat = os.fstat(sys.stdout.fileno())
+    except (OSError, ValueError):
+      return None
+    if not stat.S_ISREG(FileStat.st_mode):
+      return None
+    return FileStat.st_size
+
+  # Name the step by the program, or by the script for an interpreter, plus the
+  # subcommand if there is one (e.g. 'samtools sort').
+  program = os.path.basename(args.command[0])
+  FirstArgIndex = 1
+  if (program.startswith('python') or program in ['bash', 'sh']) and \
+  len(args.command) > 1 and \
+  not args.command[1].startswith('-'):
+    program = os.path.basename(args.command[1])
+    FirstArgIndex = 2
+  step = program
+  if len(args.command) > FirstArgIndex:
+    FirstArg = args.command[FirstArgIndex]
+    if FirstArg.replace('_', '').isalpha() and \
+    FileState(FirstArg) is None:
+      step += ' ' + FirstArg
+
+  StatesBefore = {arg: FileState(arg) for arg in args.command[1:]}
+  StdoutSizeBefore = StdoutSize()
+
+  StartTime = time.time()
+  try:
+    process = subprocess.Popen(args.command)
+  except OSError as err:
+    print('Could not run', args.command[0] + ':', err, file=sys.stderr)
+    exit(127)
+  # Reap the process ourselves, to get its resource use.
+  _, status, usage = os.wait4(process.pid, 0)
+  WallTime = time.time() - StartTime
+  process.returncode = 0
+  if os.WIFSIGNALED(status):
+    ExitStatus = 128 + os.WTERMSIG(status)
+  else:
+    ExitStatus = os.WEXITSTATUS(status)
+
+  InputBytes = 0
+  OutputBytes = 0
+  for arg, StateBefore in StatesBefore.items():
+    if StateBefore is not None:
+      InputBytes += StateBefore[0]
+    StateAfter = FileState(arg)
+    if StateAfter is not None and StateAfter != StateBefore:
+      OutputBytes += StateAfter[0]
+  StdoutSizeAfter = StdoutSize()
+  if StdoutSizeBefore is not None and StdoutSizeAfter is not None:
+    OutputBytes += max(StdoutSizeAfter - StdoutSizeBefore, 0)
+
+  # ru_maxrss is in kilobytes on Linux but bytes on macOS.
+  MaxRSSkB = usage.ru_maxrss
+  if sys.platform == 'darwin':
+    MaxRSSkB //= 1024
+
+  record = {'context': args.context, 'step': step,
+  'command': ' '.join(args.command),
+  'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(StartTime)),
+  'wall_seconds': round(WallTime, 3),
+  'user_seconds': round(usage.ru_utime, 3),
+  'system_seconds': round(usage.ru_stime, 3), 'max_rss_kb': MaxRSSkB,
+  'input_bytes': InputBytes, 'output_bytes': OutputBytes,
+  'exit_status': ExitStatus}
+  try:
+    with open(args.RecordFile, 'a') as f:
+      f.write(json.dumps(record, sort_keys=True) + '\n')
+  except IOError as err:
+    print('Warning: could not record the resource use of', step, 'in',
+    args.RecordFile + ':', err, file=sys.stderr)
+
+  exit(ExitStatus)
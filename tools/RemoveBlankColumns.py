@@ -3,8 +3,7 @@ from __future__ import print_function
 import argparse
 import os
 import sys
-from Bio import AlignIO
-from ShiverFuncs import RemoveBlankColumns
+from ShiverFuncs import RemoveBlankColumns, AlignmentMatrix
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -39,8 +38,12 @@ if __name__ == "__main__":
   if args.q_mark:
     BlankChars += '?'
   
-  alignment = AlignIO.read(args.FastaFile, "fasta")
+  try:
+    alignment = AlignmentMatrix.FromFasta(args.FastaFile)
+  except ValueError as error:
+    print(error, 'Quitting.', file=sys.stderr)
+    exit(1)
   
   alignment = RemoveBlankColumns(alignment, BlankChars, args.uninformative)
   
-  AlignIO.write(alignment, sys.stdout, 'fasta')
+  alignment.WriteFasta(sys.stdout)
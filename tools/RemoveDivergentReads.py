@@ -3,9 +3,12 @@ from __future__ import print_function
 import os
 import sys
 import argparse
+import array
+import itertools
 import pysam
+import numpy as np
 from Bio import SeqIO
-from ShiverFuncs import CalculateReadIdentity
+from ShiverFuncs import IterateReadsWithIdentity, PysamThreads
 
 ## Author: Chris Wymant, chris.wymant@bdi.ox.ac.uk
 ## Acknowledgement: I wrote this while funded by ERC Advanced Grant PBDR-339251
@@ -15,11 +18,15 @@ if __name__ == "__main__":
   ## Overview:
   ExplanatoryMessage = '''This script removes reads with an 'identity' (the
   fraction of bases which are mapped and agree with the reference) below a
-  specified value from a bam file.
+  specified value from a bam file. With --keep-pairs-only, a read is kept only if
+  its mate is also kept. By default that is done by holding each read in memory
+  until its mate is found, which for a coordinate-sorted bam file can mean holding
+  a large fraction of all reads; for large files use --name-grouped (if the reads
+  in the input bam file are grouped by name, as output by the mapper or by
+  samtools sort -n) or --two-pass (for a coordinate-sorted and indexed bam file),
+  which do not.
   '''
   
-  
-  
   # Define a function to check files exist, as a type for the argparse.
   def File(MyFile):
     if not os.path.isfile(MyFile):
@@ -34,6 +41,29 @@ if __name__ == "__main__":
   parser.add_argument('OutBamFile')
   parser.add_argument('ReadIdentityThreshold', type=float)
   parser.add_argument('-P', '--keep-pairs-only', action='store_true')
+  parser.add_argument('-N', '--name-grouped', action='store_true', help='''The
+  reads in the input bam file are grouped by name, i.e. the reads in a pair are
+  next to each other. With --keep-pairs-only, pairs are then decided as they are
+  read, without holding reads in memory. (The output is in the same order as the
+  input.)''')
+  parser.add_argument('-2', '--two-pass', action='store_true', help='''For use
+  with --keep-pairs-only on a coordinate-sorted bam file: read the file twice,
+  first recording (a hash of) the name of each pair with a read failing the
+  threshold, then writing the reads of all other pairs. This needs memory only
+  for the failing pairs. Pairs are identified using the reads' flags: a read
+  whose mate is not flagged as mapped is removed.''')
+  parser.add_argument('-@', '--threads', type=int, default=1, help='''The
+  number of threads to use for compressing the output bam file and decompressing
+  the input bam file (default 1).''')
+  parser.add_argument('--use-md-tags', action='store_true', help='''Calculate
+  read identities from the reads' MD tags (or NM tags), where present, instead
+  of comparing the reads to the reference. A ZI tag, as written by
+  RemoveDivergentReads.py --store-identity, is used in preference to either.''')
+  parser.add_argument('--store-identity', action='store_true', help='''Store
+  the number of bases of each read agreeing with the reference in its ZI tag in
+  the output bam file, so that tools run on it later with --use-md-tags (this
+  one, LinkIdentityToCoverage.py and FindNumMappedBases.py) needn't recalculate
+  the read identities.''')
   args = parser.parse_args()
   
   # Check the identity threshold is between 0 and 1
@@ -42,6 +72,19 @@ if __name__ == "__main__":
     'than or equal to 1. Quitting.', file=sys.stderr)
     exit(1)
   
+  if args.name_grouped and args.two_pass:
+    print('The --name-grouped and --two-pass options cannot be used together.',
+    'Quitting.', file=sys.stderr)
+    exit(1)
+  if args.two_pass and not args.keep_pairs_only:
+    print('The --two-pass option only has an effect with --keep-pairs-only.',
+    'Quitting.', file=sys.stderr)
+    exit(1)
+  if args.threads < 1:
+    print('The number of threads should be an integer greater than 0.',
+    'Quitting.', file=sys.stderr)
+    exit(1)
+  
   # Get the reference.
   SeqList = list(SeqIO.parse(open(args.RefFile), 'fasta'))
   if len(SeqList) != 1:
@@ -50,7 +93,8 @@ if __name__ == "__main__":
     exit(1)
   RefSeq = str(SeqList[0].seq)
   
-  InBam = pysam.AlignmentFile(args.InBamFile, "rb")
+  InBam = pysam.AlignmentFile(args.InBamFile, "rb",
+  threads=PysamThreads(args.threads))
   
   # Find the reference in the bam file; there should only be one.
   AllReferences = InBam.references
@@ -60,27 +104,90 @@ if __name__ == "__main__":
     exit(1)
   RefName = AllReferences[0]
   
-  OutBam = pysam.AlignmentFile(args.OutBamFile, "wb", template=InBam)
+  if args.name_grouped:
+    SortOrder = InBam.header.to_dict().get('HD', {}).get('SO')
+    if SortOrder == 'coordinate':
+      print(args.InBamFile, 'is sorted by coordinate, not grouped by name; run',
+      'without --name-grouped. Quitting.', file=sys.stderr)
+      exit(1)
+    def GetReads():
+      return InBam.fetch(until_eof=True)
+  else:
+    def GetReads():
+      return InBam.fetch(RefName)
+  
+  # With --two-pass, first find the pairs to remove: those with a read failing
+  # the threshold, or with a read whose mate is not mapped (so that it won't be
+  # found). We record a 64-bit hash of the name of each of these pairs, rather
+  # than the name itself; a hash collision only risks removing an extra pair.
+  if args.two_pass:
+    FailingNameHashes = array.array('q')
+    for read, identity in IterateReadsWithIdentity(GetReads(), RefSeq,
+    args.use_md_tags):
+      if identity < args.ReadIdentityThreshold or (not read.is_paired) or \
+      read.mate_is_unmapped:
+        FailingNameHashes.append(hash(read.query_name))
+    FailingNameHashes = np.unique(np.frombuffer(FailingNameHashes,
+    dtype=np.int64))
   
-  # Iterate through the reads
-  UnpairedReads = {}
-  for read in InBam.fetch(RefName):
+  OutBam = pysam.AlignmentFile(args.OutBamFile, "wb", template=InBam,
+  threads=PysamThreads(args.threads))
   
-    # Calculate the read's identity
-    identity = CalculateReadIdentity(read, RefSeq)
+  ReadsWithIdentity = IterateReadsWithIdentity(GetReads(), RefSeq,
+  args.use_md_tags, args.store_identity)
   
-    if identity >= args.ReadIdentityThreshold:
+  if args.keep_pairs_only and args.two_pass:
   
-      # If we've seen the mate before, print this read and its mate; otherwise
-      # record this read.
-      if args.keep_pairs_only:
-        if read.query_name in UnpairedReads:
-          OutBam.write(UnpairedReads[read.query_name])
+    # Write the reads of pairs not found to fail in the first pass, a chunk at a
+    # time. The identity needs recalculating only to store it.
+    if args.store_identity:
+      reads = (_read for _read, _identity in ReadsWithIdentity)
+    else:
+      reads = GetReads()
+    while True:
+      chunk = list(itertools.islice(reads, 10000))
+      if not chunk:
+        break
+      NameHashes = np.array([hash(_read.query_name) for _read in chunk],
+      dtype=np.int64)
+      fail = np.isin(NameHashes, FailingNameHashes)
+      for read, ReadFails in zip(chunk, fail):
+        if not ReadFails:
+          OutBam.write(read)
+  
+  elif args.keep_pairs_only and args.name_grouped:
+  
+    # Write the reads with each name only if there are at least two and they
+    # all pass.
+    for name, ReadsWithThisName in itertools.groupby(ReadsWithIdentity,
+    key=lambda _ReadAndIdentity: _ReadAndIdentity[0].query_name):
+      ReadsWithThisName = list(ReadsWithThisName)
+      if len(ReadsWithThisName) > 1 and \
+      all(_identity >= args.ReadIdentityThreshold for _read, _identity in \
+      ReadsWithThisName):
+        for read, identity in ReadsWithThisName:
           OutBam.write(read)
-          del UnpairedReads[read.query_name]
-        else:
-          UnpairedReads[read.query_name] = read
   
-      else:
-        OutBam.write(read)
+  else:
+  
+    # Iterate through the reads
+    UnpairedReads = {}
+    for read, identity in ReadsWithIdentity:
+    
+      if identity >= args.ReadIdentityThreshold:
+    
+        # If we've seen the mate before, print this read and its mate; otherwise
+        # record this read.
+        if args.keep_pairs_only:
+          if read.query_name in UnpairedReads:
+            OutBam.write(UnpairedReads[read.query_name])
+            OutBam.write(read)
+            del UnpairedReads[read.query_name]
+          else:
+            UnpairedReads[read.query_name] = read
+    
+        else:
+          OutBam.write(read)
   
+  OutBam.close()
+  InBam.close()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import argparse
+import pysam
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''This script removes the reads named in a file (one
+  name per line) from a bam file, writing the others to a new bam file in the
+  same order. A trailing /1 or /2 is ignored when comparing names, both in the
+  file of names and in the bam file, so that naming either read of a pair as it
+  was named in a fastq file removes both reads of the pair from the bam file.
+  '''
+
+  # Define a function to check files exist, as a type for the argparse.
+  def File(MyFile):
+    if not os.path.isfile(MyFile):
+      raise argparse.ArgumentTypeError(MyFile+' does not exist or is not a file.')
+    return MyFile
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('InBamFile', type=File)
+  parser.add_argument('FileOfReadNames', type=File)
+  parser.add_argument('OutBamFile')
+  parser.add_argument('-R', '--removed-reads-bam', help='''Also write the
+  removed reads to this bam file.''')
+  args = parser.parse_args()
+
+  def StripMateSuffix(ReadName):
+    if ReadName[-2:] in ('/1', '/2'):
+      return ReadName[:-2]
+    return ReadName
+
+  with open(args.FileOfReadNames, 'r') as f:
+    NamesToRemove = set(StripMateSuffix(_line.strip()) for _line in f \
+    if _line.strip())
+
+  InBam = pysam.AlignmentFile(args.InBamFile, "rb")
+  OutBam = pysam.AlignmentFile(args.OutBamFile, "wb", template=InBam)
+  if args.removed_reads_bam is not None:
+    RemovedBam = pysam.AlignmentFile(args.removed_reads_bam, "wb",
+    template=InBam)
+  NumRemoved = 0
+  for read in InBam.fetch(until_eof=True):
+    if StripMateSuffix(read.query_name) in NamesToRemove:
+      NumRemoved += 1
+      if args.removed_reads_bam is not None:
+        RemovedBam.write(read)
+    else:
+      OutBam.write(read)
+  OutBam.close()
+  if args.removed_reads_bam is not None:
+    RemovedBam.close()
+  InBam.close()
+  print('Removed', NumRemoved, 'reads from', args.InBamFile + '.')
@@ -1,26 +1,142 @@
 from __future__ import print_function, division
+import collections
+import itertools
+import multiprocessing
+import re
 import sys
+import numpy as np
 from six.moves import range
+from AuxiliaryFunctions import ReverseIUPACdict2, IterateFastaRecords
 
-def CalculateReadIdentity(PysamRead, ReferenceSeq):
+# The bam aux tag in which the number of bases of a read agreeing with the
+# reference can be stored, so that its identity needn't be recalculated.
+IdentityTag = 'ZI'
+MDdeletionRegex = re.compile(r'\^[A-Za-z]+')
+MDmismatchRegex = re.compile(r'[A-Za-z]')
+
+def CountAgreeingBasesFromTags(PysamRead, NumAlignedBases, NumInsertedBases,
+NumDeletedBases, UseMD=False):
+  '''With UseMD, returns the number of bases agreeing with the reference
+  stored in the read's IdentityTag, or failing that inferred from its MD or NM
+  tag; None if it has no such tag, or without UseMD.'''
+  if UseMD:
+    if PysamRead.has_tag(IdentityTag):
+      return PysamRead.get_tag(IdentityTag)
+    if PysamRead.has_tag('MD'):
+      MD = MDdeletionRegex.sub('', PysamRead.get_tag('MD'))
+      return NumAlignedBases - len(MDmismatchRegex.findall(MD))
+    if PysamRead.has_tag('NM'):
+      return NumAlignedBases - (PysamRead.get_tag('NM') - NumInsertedBases - \
+      NumDeletedBases)
+  return None
+
+def CountReadAgreement(reads, ReferenceSeq, UseMD=False):
+  '''For a list of pysam reads, returns arrays of the number of bases in each
+  read that are mapped and agree with the reference (case-insensitively), and
+  of the number of positions each read is compared over: its length (including
+  soft clips) plus the number of reference positions deleted or skipped between
+  its first and last mapped bases.
+
+  With UseMD, the agreeing bases are taken from the read's IdentityTag, MD tag
+  or NM tag, the first it has; otherwise they are counted, for all the
+  reads at once, by comparing the mapped blocks of each read's CIGAR to the
+  reference, which should be given as an array of upper case character codes
+  (see ReferenceSeqAsArray) or a string.'''
+  if not isinstance(ReferenceSeq, np.ndarray):
+    ReferenceSeq = ReferenceSeqAsArray(ReferenceSeq)
+  NumAgreeingBases = []
+  NumPositions = []
+  blocks = []
+  seqs = []
+  SeqOffset = 0
+  for ReadNumber, read in enumerate(reads):
+    cigar = read.cigartuples
+    if not cigar:
+      NumPositions.append(read.query_length)
+      NumAgreeingBases.append(0)
+      continue
+    QueryPos = 0
+    RefPos = read.reference_start
+    FirstBlock = len(blocks)
+    NumAligned = NumInserted = NumDeleted = 0
+    for operation, length in cigar:
+      # Match or mismatch, i.e. M, = or X:
+      if operation == 0 or operation == 7 or operation == 8:
+        blocks.append((RefPos, SeqOffset + QueryPos, length, ReadNumber))
+        NumAligned += length
+        QueryPos += length
+        RefPos += length
+      # Insertion, soft clip:
+      elif operation == 1 or operation == 4:
+        QueryPos += length
+        if operation == 1:
+          NumInserted += length
+      # Deletion, skipped reference:
+      elif operation == 2 or operation == 3:
+        RefPos += length
+        if operation == 2:
+          NumDeleted += length
+    if len(blocks) > FirstBlock:
+      FirstRefPos = blocks[FirstBlock][0]
+      LastBlockStart, _, LastBlockLength, _ = blocks[-1]
+      NumPositions.append(QueryPos + LastBlockStart + LastBlockLength - \
+      FirstRefPos - NumAligned)
+    else:
+      NumPositions.append(QueryPos)
+    CachedCount = CountAgreeingBasesFromTags(read, NumAligned, NumInserted,
+    NumDeleted, UseMD)
+    seq = read.query_sequence
+    if CachedCount is not None or not seq:
+      del blocks[FirstBlock:]
+      NumAgreeingBases.append(CachedCount or 0)
+      continue
+    NumAgreeingBases.append(0)
+    seqs.append(seq)
+    SeqOffset += len(seq)
+  NumAgreeingBases = np.array(NumAgreeingBases, dtype=np.int64)
+  NumPositions = np.array(NumPositions, dtype=np.int64)
+  if blocks:
+    BlockRef, BlockOffset, BlockLength, BlockRead = np.array(blocks,
+    dtype=np.int64).T
+    AllSeqs = np.frombuffer(''.join(seqs).upper().encode(), dtype=np.uint8)
+    RefPos, offsets = ExpandBlocks(BlockRef, BlockOffset, BlockLength)
+    agree = AllSeqs[offsets] == ReferenceSeq[RefPos]
+    NumAgreeingBases += np.bincount(np.repeat(BlockRead, BlockLength)[agree],
+    minlength=len(NumAgreeingBases))
+  return NumAgreeingBases, NumPositions
+
+def ReferenceSeqAsArray(ReferenceSeq):
+  '''The reference as an array of upper case character codes, for
+  CountReadAgreement.'''
+  return np.frombuffer(ReferenceSeq.upper().encode(), dtype=np.uint8)
+
+def CalculateReadIdentity(PysamRead, ReferenceSeq, UseMD=False):
   '''Calculate the fractional agreement between a read and the ref sequence'''
+  NumAgreeingBases, NumPositions = CountReadAgreement([PysamRead], ReferenceSeq,
+  UseMD)
+  if NumPositions[0] == 0:
+    return 0.
+  return float(NumAgreeingBases[0]) / NumPositions[0]
 
-  positions = PysamRead.get_reference_positions(full_length=True)
-  seq = PysamRead.query_sequence.upper()
-  ReferenceSeq = ReferenceSeq.upper()
-  NumAgreeingBases = 0
-  NumDeletions = 0
-  LastRefPos = None
-  for i, pos in enumerate(positions):
-    if pos != None:
-      if ReferenceSeq[pos] == seq[i]:
-        NumAgreeingBases += 1
-      if LastRefPos != None and pos != LastRefPos + 1:
-        DeletionSize = pos - LastRefPos - 1
-        assert DeletionSize > 0
-        NumDeletions += DeletionSize
-      LastRefPos = pos
-  return float(NumAgreeingBases) / (len(positions) + NumDeletions)
+def IterateReadsWithIdentity(reads, ReferenceSeq, UseMD=False,
+StoreIdentity=False, ReadsPerChunk=10000):
+  '''Yields each of the reads (an iterable of pysam reads) together with its
+  identity as calculated by CalculateReadIdentity, working on chunks of reads at
+  a time. With StoreIdentity, the number of agreeing bases is also stored in
+  each read's IdentityTag (for when the reads will be written out again).'''
+  ReferenceSeq = ReferenceSeqAsArray(ReferenceSeq)
+  reads = iter(reads)
+  while True:
+    chunk = list(itertools.islice(reads, ReadsPerChunk))
+    if not chunk:
+      return
+    NumAgreeingBases, NumPositions = CountReadAgreement(chunk, ReferenceSeq,
+    UseMD)
+    identities = NumAgreeingBases / np.maximum(NumPositions, 1)
+    for ReadNumber, read in enumerate(chunk):
+      if StoreIdentity:
+        read.set_tag(IdentityTag, int(NumAgreeingBases[ReadNumber]), 'i')
+      yield read, float(identities[ReadNumber])
 
 # Stolen from phyloscanner
 def TranslateSeqCoordsToAlnCoords(seq, coords):
@@ -57,26 +173,894 @@ def GetSeqStartAndEndPos(seq):
     LastBasePos -= 1
   return FirstBasePos, LastBasePos
 
+class AlignmentMatrix(object):
+  '''Aligned sequences held as a numpy uint8 matrix of their characters, one
+  row per sequence and one column per position, together with their names and
+  titles (the whole header line after the '>' in fasta format). Whole-column
+  operations are done with array operations instead of slicing out each column
+  of the alignment in turn.'''
+
+  def __init__(self, names, matrix, titles=None):
+    self.names = list(names)
+    self.matrix = matrix
+    self.titles = list(titles) if titles is not None else list(names)
+
+  @classmethod
+  def FromFasta(cls, FastaFile):
+    '''Reads in a fasta file of aligned sequences. Raises a ValueError if there
+    are no sequences or they have different lengths.'''
+    names, titles, seqs = [], [], []
+    for name, title, seq in IterateFastaRecords(FastaFile):
+      names.append(name)
+      titles.append(title)
+      seqs.append(seq)
+    return cls.FromSeqs(names, seqs, titles, FastaFile)
+
+  @classmethod
+  def FromBioAlignment(cls, alignment):
+    '''Converts a Biopython alignment (or any list of SeqRecords).'''
+    return cls.FromSeqs([_seq.id for _seq in alignment],
+    [str(_seq.seq) for _seq in alignment],
+    [_seq.description for _seq in alignment])
+
+  @classmethod
+  def FromSeqs(cls, names, seqs, titles=None, source='the alignment'):
+    if len(seqs) == 0:
+      raise ValueError('No sequences found in ' + source + '.')
+    AlignmentLength = len(seqs[0])
+    for name, seq in zip(names, seqs):
+      if len(seq) != AlignmentLength:
+        raise ValueError(name + ' has length ' + str(len(seq)) + ' whereas ' + \
+        names[0] + ' has length ' + str(AlignmentLength) + ' in ' + source + \
+        '. Aligned sequences were expected.')
+    matrix = np.frombuffer(''.join(seqs).encode(), dtype=np.uint8).reshape(
+    len(seqs), AlignmentLength).copy()
+    return cls(names, matrix, titles)
+
+  def __len__(self):
+    return len(self.names)
+
+  def GetAlignmentLength(self):
+    return self.matrix.shape[1]
+
+  def GetSeq(self, row):
+    return self.matrix[row].tobytes().decode()
+
+  def WriteFasta(self, OutFile, LineLength=60, UseTitles=True):
+    '''Writes the alignment in fasta format (to a file name or an open file),
+    wrapping sequences as Biopython does.'''
+    OutLines = []
+    for row in range(len(self)):
+      OutLines.append('>' + (self.titles[row] if UseTitles else self.names[row]))
+      seq = self.GetSeq(row)
+      OutLines.extend(seq[_i:_i + LineLength] for _i in range(0, len(seq),
+      LineLength))
+    OutString = '\n'.join(OutLines) + '\n'
+    if hasattr(OutFile, 'write'):
+      OutFile.write(OutString)
+    else:
+      with open(OutFile, 'w') as f:
+        f.write(OutString)
+
+  def ColumnCounts(self, chars=None):
+    '''Returns a dict mapping each character (by default each one present in
+    the alignment) to an array of the number of times it occurs in each
+    column.'''
+    if chars is None:
+      codes = np.unique(self.matrix)
+    else:
+      codes = np.frombuffer(chars.encode(), dtype=np.uint8)
+    return collections.OrderedDict((chr(_code), (self.matrix == _code).sum(
+    axis=0)) for _code in codes)
+
+  def BlankColumns(self, BlankChars='-'):
+    '''Returns a boolean array marking the columns consisting solely of the
+    characters in BlankChars.'''
+    return np.isin(self.matrix, np.frombuffer(BlankChars.encode(),
+    dtype=np.uint8)).all(axis=0)
+
+  def UninformativeColumns(self, BlankChars='-'):
+    '''Returns a boolean array marking the columns in which all characters not
+    in BlankChars are the same (including columns with no such characters).'''
+    NotBlank = ~np.isin(self.matrix, np.frombuffer(BlankChars.encode(),
+    dtype=np.uint8))
+    HighestChar = np.where(NotBlank, self.matrix, 0).max(axis=0)
+    LowestChar = np.where(NotBlank, self.matrix, 255).min(axis=0)
+    return HighestChar <= LowestChar
+
+  def RemoveColumns(self, ColumnsToRemove):
+    '''Returns a new alignment without the columns marked by the boolean array
+    ColumnsToRemove.'''
+    return AlignmentMatrix(self.names, self.matrix[:, ~ColumnsToRemove],
+    self.titles)
+
 def RemoveBlankColumns(alignment, BlankChars="-", RemoveUninformative=False):
   '''Remove 'blank' columns from a seq alignment (consisting solely of "-",
   optionally including other charcters in the  BlankChars arg), and optionally
-  any column that is 'uninformative' (all non-blank characters are the same).'''
-
-  AlignmentLength = alignment.get_alignment_length()
-  for column in reversed(range(AlignmentLength)):
-    RemoveThisCol = True
-    FirstBaseSeen = None
-    for base in alignment[:, column]:
-      if not base in BlankChars:
-        if RemoveUninformative:
-          if FirstBaseSeen == None:
-            FirstBaseSeen = base
-          elif base != FirstBaseSeen:
-            RemoveThisCol = False
-            break
+  any column that is 'uninformative' (all non-blank characters are the same).
+
+  The alignment can be an AlignmentMatrix, or a Biopython alignment, in which
+  case a Biopython alignment is returned.'''
+
+  if isinstance(alignment, AlignmentMatrix):
+    matrix = alignment
+  else:
+    matrix = AlignmentMatrix.FromBioAlignment(alignment)
+  if RemoveUninformative:
+    ColumnsToRemove = matrix.UninformativeColumns(BlankChars)
+  else:
+    ColumnsToRemove = matrix.BlankColumns(BlankChars)
+  matrix = matrix.RemoveColumns(ColumnsToRemove)
+  if isinstance(alignment, AlignmentMatrix):
+    return matrix
+
+  from Bio.Align import MultipleSeqAlignment
+  from Bio.Seq import Seq
+  from Bio.SeqRecord import SeqRecord
+  return MultipleSeqAlignment([SeqRecord(Seq(matrix.GetSeq(_row)),
+  id=_record.id, name=_record.name, description=_record.description) for \
+  _row, _record in enumerate(alignment)])
+
+# The characters in a pileup string (after removal of read-start and read-end
+# markers and indels) that we count in bulk; anything else is counted
+# separately, so that it can be warned about.
+PileupCountedChars = b'ACGTN*.,'
+PileupIndelRegex = re.compile(b'[+-]([0-9]+)')
+PileupInsertionRegex = re.compile(b'[+]([0-9]+)')
+
+def ParsePileupString(PileupString, RecordInsertions=False):
+  '''Interpret a pileup string one character at a time.
+
+  Returns a Counter of the (upper-cased) characters that are bases, and a
+  dictionary of lists of insertions indexed by insertion size (which is only
+  filled if RecordInsertions is True). This is the original shiver
+  implementation: see ParsePileupBytes for a much faster equivalent.'''
+
+  # The character following a ^ should be ignored. $ should be ignored.
+  # After a '+' or '-' then a number, that number of characters should be
+  # ignored.
+  PileupString_OnlyBases = ''
+  SkipThisManyBases = 0
+  insertions = {}
+  for position,char in enumerate(PileupString):
+    if SkipThisManyBases > 0:
+      SkipThisManyBases -= 1
+      continue
+    if char == '$':
+      continue
+    if char == '^':
+      SkipThisManyBases = 1
+      continue
+    if char == '-' or char == '+':
+      # Next in the string will be an unknown number of digits, together
+      # comprising a number specifying the indel size.
+      IndelSizeNumDigits = 0
+      while PileupString[position+1+IndelSizeNumDigits] in \
+      ['0','1','2','3','4','5','6','7','8','9']:
+        IndelSizeNumDigits += 1
+      IndelSize = int(PileupString[position+1:position+1+IndelSizeNumDigits])
+      SkipThisManyBases = IndelSizeNumDigits+IndelSize
+
+      # If desired, we record the insertions: as a dictionary of lists, indexed
+      # by the length of the insertion. e.g. insertions[1] = ['A','A','C'];
+      # insertions[2] =  ['GG','CT'] etc.
+      if char == '+' and RecordInsertions:
+        insertion = PileupString[position+1+IndelSizeNumDigits:\
+        position+1+IndelSizeNumDigits+IndelSize]
+        if IndelSize in insertions:
+          insertions[IndelSize].append(insertion)
         else:
-          RemoveThisCol = False
+          insertions[IndelSize] = [insertion]
+      continue
+
+    # If we get to here, the character is just a regular base.
+    PileupString_OnlyBases += char
+
+  # Count all the different characters at this position, ignoring case.
+  PileupString_OnlyBases = PileupString_OnlyBases.upper()
+  BaseCounts = collections.Counter(PileupString_OnlyBases)
+  return BaseCounts, insertions
+
+def ParsePileupBytes(PileupString, RecordInsertions=False):
+  '''Interpret a pileup string, given as bytes, in bulk.
+
+  Gives the same result as ParsePileupString, but instead of visiting every
+  character in Python, the markers for read starts (a ^ and the mapping quality
+  character following it), read ends ($) and indels (+ or -, a number, then that
+  many bases) are cut out with C-level searches and substitutions, and the
+  remaining bases are counted with bytes.count. Insertions are returned as str, like
+  ParsePileupString does.'''
+
+  # Remove read starts. This must come first: the mapping quality character
+  # following a ^ can be anything, including ^, $, +, - or a digit.
+  if b'^' in PileupString:
+    chunks = []
+    start = 0
+    position = PileupString.find(b'^')
+    while position != -1:
+      chunks.append(PileupString[start:position])
+      start = position + 2
+      position = PileupString.find(b'^', start)
+    chunks.append(PileupString[start:])
+    PileupString = b''.join(chunks)
+
+  PileupString = PileupString.replace(b'$', b'')
+
+  # Now every + or - is the start of an indel. Indel sequences contain no
+  # digits, so once we know which sizes occur, a regex of the form
+  # [+-](1[^0-9]{1}|3[^0-9]{3}|...) matches exactly one whole indel, and all of
+  # them can be cut out in one pass.
+  insertions = {}
+  IndelSizes = PileupIndelRegex.findall(PileupString)
+  if IndelSizes:
+    IndelSizes = list(collections.OrderedDict.fromkeys(IndelSizes))
+    if RecordInsertions:
+      # Find the insertions of each size, keeping the sizes in order of first
+      # appearance (which determines the tie-breaking between insertion sizes).
+      for IndelSize in collections.OrderedDict.fromkeys(
+      PileupInsertionRegex.findall(PileupString)):
+        InsertionsThisSize = re.findall(b'[+]' + IndelSize + b'([^0-9]{' + \
+        IndelSize + b'})', PileupString)
+        insertions[int(IndelSize)] = [_insertion.decode('ascii') for \
+        _insertion in InsertionsThisSize]
+    IndelRegex = b'[+-](?:' + b'|'.join(_size + b'[^0-9]{' + _size + b'}' \
+    for _size in IndelSizes) + b')'
+    PileupString = re.sub(IndelRegex, b'', PileupString)
+  if b'+' in PileupString or b'-' in PileupString:
+    raise ValueError('Pileup string contains an indel marker that is not ' +\
+    'followed by the indel size and sequence.')
+
+  # Count all the different characters at this position, ignoring case.
+  PileupString = PileupString.upper()
+  BaseCounts = collections.Counter()
+  for char in PileupCountedChars.decode('ascii'):
+    count = PileupString.count(char.encode('ascii'))
+    if count > 0:
+      BaseCounts[char] = count
+  OtherChars = PileupString.translate(None, PileupCountedChars)
+  if OtherChars:
+    BaseCounts.update(OtherChars.decode('ascii'))
+  return BaseCounts, insertions
+
+# The columns of shiver's base frequency files, and the codes we use for them
+# when counting bases in numpy arrays. Code 6 is for anything unexpected; code 7
+# is for '=' (i.e. "same as the reference") in a read's sequence.
+BaseFreqsBases = ['A', 'C', 'G', 'T', '-', 'N']
+NumBaseCodes = 7
+BaseCodes = np.full(256, 6, dtype=np.uint8)
+for _code, _base in enumerate(BaseFreqsBases):
+  if _base != '-':
+    BaseCodes[ord(_base)] = _code
+    BaseCodes[ord(_base.lower())] = _code
+BaseCodes[ord('=')] = 7
+
+# The flags of reads that samtools mpileup skips by default: unmapped,
+# secondary, QC fail, duplicate.
+MpileupSkippedFlags = 0x4 | 0x100 | 0x200 | 0x400
+
+def ExpandBlocks(BlockRef, BlockOffset, BlockLength):
+  '''Expand blocks of consecutive positions into one entry per position,
+  returning arrays of reference positions and offsets into the sequence.'''
+  BlockLength = np.asarray(BlockLength, dtype=np.int64)
+  NumPositions = int(BlockLength.sum())
+  BlockStarts = np.cumsum(BlockLength) - BlockLength
+  index = np.arange(NumPositions, dtype=np.int64)
+  RefPos = np.repeat(np.asarray(BlockRef, dtype=np.int64) - BlockStarts,
+  BlockLength) + index
+  offsets = np.repeat(np.asarray(BlockOffset, dtype=np.int64) - BlockStarts,
+  BlockLength) + index
+  return RefPos, offsets
+
+def CountBasesInBam(BamFile, RefName, RefSeq, start=0, end=None,
+MinBaseQual=0, MinMapQual=0, CountOrphans=False, IgnoreOverlaps=False,
+ReadsPerChunk=2000):
+  '''Count the bases at each reference position of a (pysam) bam file.
+
+  This reproduces what samtools mpileup (without BAQ) followed by
+  AnalysePileup.py would find, without writing or parsing the pileup: reads are
+  filtered by flag, mapping quality and proper pairing as mpileup does by
+  default; where the two reads in a pair overlap, the qualities of their bases
+  are modified as htslib (of the version used by shiver's docker image) does, so
+  that the overlap is counted once; then bases (and deletions, which take the
+  quality of the read's next base) of quality at least MinBaseQual are counted.
+  Reads are processed in chunks: we loop over reads and their cigar operations
+  in Python, but over bases with numpy.
+
+  Only positions start <= pos < end (0-based) are counted, for a region fetched
+  from an indexed bam; with start=0 and end=None we iterate through the whole
+  file, which need not be indexed. Returns
+  (1) an array of shape (end - start, NumBaseCodes) of counts of A, C, G, T, gap,
+  N and anything unexpected;
+  (2) an array of the number of reads with an insertion immediately after each
+  position, including the artefact of AnalysePileup.py counting the mapping
+  quality '+' (i.e. 10) of a read starting here as an insertion;
+  (3) a list of the insertions, as (read number, 0-based position, sequence)
+  tuples with the read numbers in bam file order;
+  (4) the number of reads that passed the read filters.'''
+
+  RefLength = len(RefSeq)
+  if end is None:
+    end = RefLength
+  RegionLength = end - start
+  WholeRef = start == 0 and end == RefLength
+  RefCodes = BaseCodes[np.frombuffer(RefSeq.upper().encode('ascii'),
+  dtype=np.uint8)]
+  counts = np.zeros(RegionLength * (NumBaseCodes + 1), dtype=np.int64)
+  InsertionMarks = np.zeros(RegionLength, dtype=np.int64)
+  insertions = []
+
+  if WholeRef:
+    reads = BamFile.fetch(until_eof=True)
+  else:
+    reads = BamFile.fetch(RefName, start, end)
+
+  def CountCodes(RefPos, codes, keep):
+    '''Add to the counts, only for positions in the region. Rather than
+    selecting the bases to keep, we count the others in an extra column that we
+    discard at the end, which is faster.'''
+    if not WholeRef:
+      keep &= (RefPos >= start) & (RefPos < end)
+      RefPos = np.clip(RefPos, start, end - 1)
+    counts[:] += np.bincount((RefPos - start) * (NumBaseCodes + 1) + \
+    np.where(keep, codes, NumBaseCodes), minlength=len(counts))
+
+  def ProcessChunk(records, pairs):
+    '''Count the bases in a list of read records.'''
+    if not records:
+      return
+    SeqLengths = np.fromiter((len(_record[1]) for _record in records),
+    dtype=np.int64, count=len(records))
+    offsets = np.cumsum(SeqLengths) - SeqLengths
+    OffsetOf = dict((id(_record), _offset) for _record, _offset in \
+    zip(records, offsets.tolist()))
+    seqs = np.frombuffer(b''.join(_record[1] for _record in records),
+    dtype=np.uint8)
+    quals = np.frombuffer(b''.join(_record[2] for _record in records),
+    dtype=np.uint8).copy()
+
+    # Modify qualities where pairs overlap, like htslib's tweak_overlap_quality:
+    # at each position where both reads have an aligned base, if the bases
+    # agree the first read gets the sum of the qualities (capped at 200) and the
+    # second read gets zero; if not, the read with the lower quality gets zero
+    # and the other gets 80% of its quality (the first read winning ties). We
+    # only expand the parts of blocks inside the region where the pair overlaps.
+    if pairs:
+      OverlapBlocks = ([], [], [], []), ([], [], [], [])
+      for PairNumber, pair in enumerate(pairs):
+        OverlapStart = max(pair[0][3][0][0], pair[1][3][0][0])
+        OverlapEnd = min(pair[0][8], pair[1][8])
+        if OverlapStart >= OverlapEnd:
+          continue
+        for record, (BlockRef, BlockOffset, BlockLength, BlockPair) in \
+        zip(pair, OverlapBlocks):
+          ReadOffset = OffsetOf[id(record)]
+          for RefStart, QueryStart, length in record[3]:
+            ClippedStart = max(RefStart, OverlapStart)
+            ClippedEnd = min(RefStart + length, OverlapEnd)
+            if ClippedStart < ClippedEnd:
+              BlockRef.append(ClippedStart)
+              BlockOffset.append(ReadOffset + QueryStart + ClippedStart - \
+              RefStart)
+              BlockLength.append(ClippedEnd - ClippedStart)
+              BlockPair.append(PairNumber)
+      KeysAndOffsets = []
+      for BlockRef, BlockOffset, BlockLength, BlockPair in OverlapBlocks:
+        RefPos, BaseOffsets = ExpandBlocks(BlockRef, BlockOffset, BlockLength)
+        keys = np.repeat(np.asarray(BlockPair, dtype=np.int64),
+        BlockLength) * (RefLength + 1) + RefPos
+        KeysAndOffsets.append((keys, BaseOffsets))
+      (KeysFirst, OffsetsFirst), (KeysSecond, OffsetsSecond) = KeysAndOffsets
+      _, IndicesFirst, IndicesSecond = np.intersect1d(KeysFirst, KeysSecond,
+      assume_unique=True, return_indices=True)
+      OffsetsFirst = OffsetsFirst[IndicesFirst]
+      OffsetsSecond = OffsetsSecond[IndicesSecond]
+      QualsFirst = quals[OffsetsFirst].astype(np.int64)
+      QualsSecond = quals[OffsetsSecond].astype(np.int64)
+      agree = seqs[OffsetsFirst] == seqs[OffsetsSecond]
+      FirstBetter = QualsFirst >= QualsSecond
+      quals[OffsetsFirst] = np.where(agree, np.minimum(QualsFirst + \
+      QualsSecond, 200), np.where(FirstBetter, (QualsFirst * 4) // 5, 0))
+      quals[OffsetsSecond] = np.where(agree | FirstBetter, 0,
+      (QualsSecond * 4) // 5)
+
+    # Count bases. '=' means the reference base.
+    BlockRef = []
+    BlockOffset = []
+    BlockLength = []
+    for record, ReadOffset in zip(records, offsets.tolist()):
+      for RefStart, QueryStart, length in record[3]:
+        BlockRef.append(RefStart)
+        BlockOffset.append(ReadOffset + QueryStart)
+        BlockLength.append(length)
+    RefPos, BaseOffsets = ExpandBlocks(BlockRef, BlockOffset, BlockLength)
+    codes = BaseCodes[seqs[BaseOffsets]]
+    SameAsRef = codes == 7
+    if SameAsRef.any():
+      codes[SameAsRef] = RefCodes[RefPos[SameAsRef]]
+    CountCodes(RefPos, codes, quals[BaseOffsets] >= MinBaseQual)
+
+    # Count deletions. Their quality is that of the next base in the read, or
+    # zero if there is none.
+    DelRef = []
+    DelOffset = []
+    DelLength = []
+    for record, ReadOffset in zip(records, offsets.tolist()):
+      for RefStart, QueryPos, length in record[4]:
+        DelRef.append(RefStart)
+        DelOffset.append(ReadOffset + QueryPos if QueryPos < len(record[1]) \
+        else -1)
+        DelLength.append(length)
+    if DelRef:
+      DelPos, _ = ExpandBlocks(DelRef, [0] * len(DelRef), DelLength)
+      DelOffsets = np.repeat(np.asarray(DelOffset, dtype=np.int64),
+      DelLength)
+      DelQuals = np.where(DelOffsets >= 0, quals[np.maximum(DelOffsets, 0)], 0)
+      CountCodes(DelPos, np.full(len(DelPos), 4, dtype=np.uint8),
+      DelQuals >= MinBaseQual)
+
+    # Insertions are recorded at the last aligned base before them, if that
+    # base passes the quality threshold; so is a mapping quality of 10 for a
+    # read starting at a base that passes.
+    for record, ReadOffset in zip(records, offsets.tolist()):
+      for QueryPos, AnchorPos, insertion in record[5]:
+        if start <= AnchorPos < end and \
+        quals[ReadOffset + QueryPos] >= MinBaseQual:
+          InsertionMarks[AnchorPos - start] += 1
+          insertions.append((record[0], AnchorPos, insertion))
+      if record[6] is not None:
+        QueryPos, HeadPos = record[6]
+        if start <= HeadPos < end and QueryPos < len(record[1]) and \
+        quals[ReadOffset + QueryPos] >= MinBaseQual:
+          InsertionMarks[HeadPos - start] += 1
+
+  def MakeRecord(read, ReadNumber):
+    '''If this read passes the filters, record its number in the file, its
+    sequence, its qualities, its blocks of aligned bases, its deletions, its
+    insertions, where it starts (only needed if its mapping quality is 10),
+    where its mate starts, and where it ends. Otherwise return None.'''
+    flag = read.flag
+    if flag & MpileupSkippedFlags or read.mapping_quality < MinMapQual:
+      return None
+    if (not CountOrphans) and flag & 1 and not flag & 2:
+      return None
+    seq = read.query_sequence
+    cigar = read.cigartuples
+    if seq is None or not cigar:
+      return None
+    seq = seq.encode('ascii')
+    QualArray = read.query_qualities
+    if QualArray is None:
+      qual = b'\xff' * len(seq)
+    else:
+      qual = QualArray.tobytes()
+
+    ReadStart = read.reference_start
+    if len(cigar) == 1 and cigar[0][0] == 0:
+      # The simplest case: all bases aligned.
+      blocks = [(ReadStart, 0, cigar[0][1])]
+      dels = ()
+      ins = ()
+      head = (0, ReadStart)
+      ReadEnd = ReadStart + cigar[0][1]
+    else:
+      blocks = []
+      dels = []
+      ins = []
+      head = None
+      RefPos = ReadStart
+      QueryPos = 0
+      NumOps = len(cigar)
+      for OpNumber, (op, length) in enumerate(cigar):
+        if op == 0 or op == 7 or op == 8:
+          blocks.append((RefPos, QueryPos, length))
+          if head is None:
+            head = (QueryPos, RefPos)
+          if OpNumber + 1 < NumOps and cigar[OpNumber + 1][0] == 1:
+            InsertionLength = cigar[OpNumber + 1][1]
+            ins.append((QueryPos + length - 1, RefPos + length - 1,
+            seq[QueryPos + length: QueryPos + length + \
+            InsertionLength].decode('ascii')))
+          RefPos += length
+          QueryPos += length
+        elif op == 1 or op == 4:
+          QueryPos += length
+        elif op == 2:
+          dels.append((RefPos, QueryPos, length))
+          if head is None:
+            head = (QueryPos, RefPos)
+          RefPos += length
+        elif op == 3:
+          RefPos += length
+      ReadEnd = RefPos
+      if not blocks:
+        return None
+    if read.mapping_quality != 10:
+      head = None
+    return (ReadNumber, seq, qual, blocks, dels, ins, head,
+    read.next_reference_start, ReadEnd)
+
+  def MayOverlapMate(read):
+    '''Whether this read should be paired up with its mate, with the same
+    conditions as htslib.'''
+    return (not IgnoreOverlaps) and read.flag & 2 and not read.flag & 8 and \
+    abs(read.template_length) < 2 * read.query_length
+
+  # Iterate through the reads.
+  NumReadsUsed = 0
+  records = []
+  pairs = []
+  WaitingForMate = {}
+  NumRecordsToProcess = ReadsPerChunk
+  for ReadNumber, read in enumerate(reads):
+    record = MakeRecord(read, ReadNumber)
+    if record is None:
+      continue
+    NumReadsUsed += 1
+    records.append(record)
+
+    if MayOverlapMate(read):
+      name = read.query_name
+      if name in WaitingForMate:
+        pairs.append((WaitingForMate.pop(name), record))
+      else:
+        WaitingForMate[name] = record
+
+    if len(records) >= NumRecordsToProcess:
+      # Keep back reads whose mate has not been seen yet but could still come
+      # and overlap them; forget about the others.
+      ReadStart = read.reference_start
+      KeptBack = set(id(_record) for _record in WaitingForMate.values() if \
+      ReadStart <= _record[7] < _record[8])
+      WaitingForMate = dict((_name, _record) for _name, _record in \
+      WaitingForMate.items() if id(_record) in KeptBack)
+      ProcessChunk([_record for _record in records if not id(_record) in \
+      KeptBack], pairs)
+      records = [_record for _record in records if id(_record) in KeptBack]
+      pairs = []
+      NumRecordsToProcess = len(records) + ReadsPerChunk
+
+  # For a region, a read may still be waiting for a mate that starts after the
+  # region but overlaps it beyond the region's end: the mate can change the
+  # quality of the base after a deletion in the region. Fetch such mates.
+  if not WholeRef:
+    for name, record in list(WaitingForMate.items()):
+      MateStart = record[7]
+      if not end <= MateStart < record[8]:
+        continue
+      for read in BamFile.fetch(RefName, MateStart, MateStart + 1):
+        if read.query_name == name and read.reference_start == MateStart \
+        and MayOverlapMate(read):
+          MateRecord = MakeRecord(read, ReadNumber + 1)
+          if MateRecord is not None:
+            records.append(MateRecord)
+            pairs.append((record, MateRecord))
           break
-    if RemoveThisCol:
-      alignment = alignment[:, :column] + alignment[:, column+1:]
-  return alignment
+
+  ProcessChunk(records, pairs)
+  counts = counts.reshape((RegionLength, NumBaseCodes + 1))[:, :NumBaseCodes]
+  return counts, InsertionMarks, insertions, NumReadsUsed
+
+def CountBasesInBamWindow(arguments):
+  '''Count the bases in one window of the reference, for
+  CountBasesInBamInParallel. The bam file is opened here, by each worker process
+  separately.'''
+  import pysam
+  BamFileName, RefName, RefSeq, start, end, options = arguments
+  BamFile = pysam.AlignmentFile(BamFileName, "rb")
+  try:
+    return CountBasesInBam(BamFile, RefName, RefSeq, start, end, **options)
+  finally:
+    BamFile.close()
+
+def CountBasesInBamInParallel(BamFileName, RefName, RefSeq, NumProcesses,
+WindowSize, **options):
+  '''Like CountBasesInBam, but splitting the reference into windows of the
+  given size that are processed by a pool of NumProcesses processes, each
+  fetching its reads from the (indexed) bam file. The results for each window
+  are joined back together in reference order. The number of reads used counts
+  reads once for each window they overlap.'''
+  RefLength = len(RefSeq)
+  windows = [(RefName, RefSeq, _start, min(_start + WindowSize, RefLength))
+  for _start in range(0, RefLength, WindowSize)]
+  pool = multiprocessing.Pool(NumProcesses)
+  try:
+    results = pool.map(CountBasesInBamWindow, [(BamFileName,) + _window + \
+    (options,) for _window in windows], chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+  counts = np.concatenate([_result[0] for _result in results])
+  InsertionMarks = np.concatenate([_result[1] for _result in results])
+  insertions = []
+  for result in results:
+    insertions.extend(result[2])
+  NumReadsUsed = sum(_result[3] for _result in results)
+  return counts, InsertionMarks, insertions, NumReadsUsed
+
+# The bases considered when calling a consensus from base frequencies (N is
+# ignored), and the character called for each set of them, indexed by the
+# bitmask of the set (bit i set for ConsensusBases[i]). A gap together with
+# anything else is called as N.
+ConsensusBases = 'ACGT-'
+ConsensusBitmaskChars = np.zeros(2 ** len(ConsensusBases), dtype=np.uint8)
+for _bitmask in range(1, 2 ** len(ConsensusBases)):
+  _bases = ''.join(sorted(_base for _i, _base in enumerate(ConsensusBases) if \
+  _bitmask & (1 << _i)))
+  if len(_bases) == 1:
+    _char = _bases
+  elif '-' in _bases:
+    _char = 'N'
+  else:
+    _char = ReverseIUPACdict2[_bases]
+  ConsensusBitmaskChars[_bitmask] = ord(_char)
+ConsensusBitmaskCharsLower = np.frombuffer(
+ConsensusBitmaskChars.tobytes().lower(), dtype=np.uint8)
+
+def CallConsensusFromCounts(counts, thresholds):
+  '''Calls the consensus from an array of shape (number of positions, 5)
+  containing the counts of A, C, G, T and gap at each position, for each
+  (MinCoverage, MinCovForUpper, MinFracToCall) triple in thresholds, with the
+  same rules as CallConsensus.py: "?" where the coverage is below MinCoverage;
+  otherwise the fewest most common bases (taking ties together) whose total
+  count reaches MinFracToCall times the coverage, or just the most common
+  base(s) if MinFracToCall is negative, as an ambiguity code if needed and in
+  lower case if the coverage is below MinCovForUpper. Returns a list of
+  consensus strings, one per triple.'''
+  counts = np.asarray(counts, dtype=np.int64)
+  coverage = counts.sum(axis=1)
+  MaxCounts = counts.max(axis=1)
+
+  # For each base at each position, the total count of the bases at least as
+  # common as it; taking all bases at least as common as a given base is how
+  # ties are included together.
+  CumulativeCounts = None
+  BitValues = 1 << np.arange(counts.shape[1])
+
+  consensuses = []
+  for MinCoverage, MinCovForUpper, MinFracToCall in thresholds:
+    if MinFracToCall < 0:
+      CountToCall = MaxCounts
+    else:
+      if CumulativeCounts is None:
+        CumulativeCounts = ((counts[:, None, :] >= counts[:, :, None]) *
+        counts[:, None, :]).sum(axis=2)
+      # The smallest count such that the bases at least that common reach the
+      # required total. (The least common base always qualifies.)
+      CountToCall = np.where(CumulativeCounts >= coverage[:, None] *
+      MinFracToCall, counts, -1).max(axis=1)
+    bitmask = (counts >= CountToCall[:, None]).dot(BitValues)
+    chars = np.where(coverage < MinCovForUpper - 0.5,
+    ConsensusBitmaskCharsLower[bitmask], ConsensusBitmaskChars[bitmask])
+    chars[coverage < MinCoverage] = ord('?')
+    consensuses.append(chars.astype(np.uint8).tobytes().decode())
+  return consensuses
+
+def InsertSizeCountsCsv(InsertSizeCounts):
+  '''Returns the lines of an insert size distribution csv file (as made by
+  shiver's ProcessBam) from an array of the number of reads with each insert
+  size, indexed by the insert size.'''
+  TotalCount = InsertSizeCounts.sum()
+  lines = ['Insert size,Count,Unit-normalised count']
+  for InsertSize in InsertSizeCounts.nonzero()[0]:
+    count = InsertSizeCounts[InsertSize]
+    lines.append(str(InsertSize) + ',' + str(count) + ',' + \
+    '%.6g' % (count / TotalCount))
+  return lines
+
+def PysamThreads(NumThreads):
+  '''Converts a total number of threads to the number to give pysam when
+  opening a bam file. pysam's threads are in addition to the main one, and are
+  only used if there are more than 1, so the file may use one thread fewer than
+  asked for but never more.'''
+  return max(NumThreads - 1, 1)
+
+class BamQCStats(object):
+  '''Quality-control statistics for the reads in a bam file mapped to a single
+  reference of length RefLength, accumulated from a single pass through the
+  reads using numpy arrays indexed by reference position: the coverage, the
+  number of reads clipped at each position (counting only clipped ends of at
+  least MinClipLength bases) and the number spanning it, the insert sizes, and
+  the numbers of mapped reads and bases. With IdentityBinning = (minimum, bin
+  width), the mapped bases are also counted by the identity of their read.
+
+  Coverage and clipping are found from each read's blocks of aligned bases,
+  adding to an array at the start of each interval and subtracting after its
+  end; the cumulative sums give the per-position values.'''
+
+  def __init__(self, RefLength, MinClipLength=1, IdentityBinning=None):
+    self.RefLength = RefLength
+    self.MinClipLength = MinClipLength
+    self.CoverageDiffs = np.zeros(RefLength + 1, dtype=np.int64)
+    self.SpanningDiffs = np.zeros(RefLength + 2, dtype=np.int64)
+    self.ClipCounts = np.zeros(RefLength + 1, dtype=np.int64)
+    # The number of the clipping event (counting over all reads) at which each
+    # position was first found to be clipped, for ordering ties.
+    self.FirstClipEvents = np.full(RefLength + 1, np.iinfo(np.int64).max,
+    dtype=np.int64)
+    self.NumClipEvents = 0
+    self.InsertSizeCounts = np.zeros(0, dtype=np.int64)
+    self.NumMappedReads = 0
+    self.NumReadsWithMappedBases = 0
+    self.NumMappedBases = 0
+    self.IdentityBinning = IdentityBinning
+    if IdentityBinning is not None:
+      Min, BinWidth = IdentityBinning
+      self.NumIdentityBins = int((1. - Min) / BinWidth) + 1
+      self.NumMappedBasesByIdentityBin = np.zeros(self.NumIdentityBins,
+      dtype=np.int64)
+
+  def AddReads(self, reads, WithIdentity=False, ReadsPerChunk=10000):
+    '''Adds an iterable of pysam reads, or with WithIdentity, of (read,
+    identity) pairs as yielded by IterateReadsWithIdentity.'''
+    reads = iter(reads)
+    while True:
+      chunk = list(itertools.islice(reads, ReadsPerChunk))
+      if not chunk:
+        return
+      if WithIdentity:
+        self.AddChunk([_read for _read, _identity in chunk],
+        [_identity for _read, _identity in chunk])
+      else:
+        self.AddChunk(chunk)
+
+  def AddChunk(self, reads, identities=None):
+    BlockStarts = []
+    BlockEnds = []
+    SpanStarts = []
+    SpanEnds = []
+    ClipPositions = []
+    InsertSizes = []
+    AlignmentLengths = []
+    for read in reads:
+      AlignmentLength = read.query_alignment_length
+      AlignmentLengths.append(AlignmentLength)
+      self.NumMappedBases += AlignmentLength
+      if not read.is_unmapped:
+        self.NumMappedReads += 1
+      if read.template_length > 0:
+        InsertSizes.append(read.template_length)
+      blocks = read.get_blocks()
+      if not blocks:
+        continue
+      self.NumReadsWithMappedBases += 1
+      for BlockStart, BlockEnd in blocks:
+        BlockStarts.append(BlockStart)
+        BlockEnds.append(BlockEnd)
+      FirstMappedPos = blocks[0][0]
+      LastMappedPos = blocks[-1][1] - 1
+      SpanStarts.append(FirstMappedPos + 1)
+      SpanEnds.append(LastMappedPos + 1)
+      # The number of read bases before the first, and after the last, mapped
+      # base: soft-clipped, or inserted before any base is mapped.
+      cigar = read.cigartuples
+      for ClipPos, ops in [(FirstMappedPos, cigar),
+      (LastMappedPos + 1, reversed(cigar))]:
+        ClipLength = 0
+        for op, length in ops:
+          if op in (0, 7, 8):
+            break
+          if op in (1, 4):
+            ClipLength += length
+        if ClipLength >= self.MinClipLength:
+          ClipPositions.append(ClipPos)
+    NumDiffs = self.RefLength + 1
+    if BlockStarts:
+      self.CoverageDiffs += np.bincount(BlockStarts, minlength=NumDiffs) - \
+      np.bincount(BlockEnds, minlength=NumDiffs)
+      self.SpanningDiffs += np.bincount(SpanStarts, minlength=NumDiffs + 1) - \
+      np.bincount(SpanEnds, minlength=NumDiffs + 1)
+    if ClipPositions:
+      ClipPositions = np.array(ClipPositions, dtype=np.int64)
+      self.ClipCounts += np.bincount(ClipPositions, minlength=NumDiffs)
+      np.minimum.at(self.FirstClipEvents, ClipPositions,
+      np.arange(self.NumClipEvents, self.NumClipEvents + len(ClipPositions)))
+      self.NumClipEvents += len(ClipPositions)
+    if InsertSizes:
+      counts = np.bincount(InsertSizes)
+      if len(counts) > len(self.InsertSizeCounts):
+        counts[:len(self.InsertSizeCounts)] += self.InsertSizeCounts
+        self.InsertSizeCounts = counts
+      else:
+        self.InsertSizeCounts[:len(counts)] += counts
+    if identities is not None and self.IdentityBinning is not None:
+      Min, BinWidth = self.IdentityBinning
+      identities = np.array(identities, dtype=np.float64)
+      bins = np.where(identities >= 1, self.NumIdentityBins - 1,
+      np.where(identities <= Min, 0,
+      ((identities - Min) / BinWidth).astype(np.int64)))
+      self.NumMappedBasesByIdentityBin += np.bincount(bins,
+      weights=AlignmentLengths, minlength=self.NumIdentityBins).astype(np.int64)
+
+  def GetCoverage(self):
+    '''The number of mapped bases at each reference position.'''
+    return np.cumsum(self.CoverageDiffs)[:self.RefLength]
+
+  def GetNumSpanningReads(self):
+    '''The number of reads spanning each reference position, i.e. with mapped
+    bases both before and at it.'''
+    return np.cumsum(self.SpanningDiffs)[:self.RefLength + 1]
+
+  def CoverageCsv(self):
+    '''The lines of GetCoverageFromBamFile.py's output: the coverage from the
+    first to the last covered position.'''
+    coverage = self.GetCoverage()
+    lines = ['reference position (1-based),coverage']
+    covered = coverage.nonzero()[0]
+    if len(covered) > 0:
+      for PosMin1 in range(covered[0], covered[-1] + 1):
+        lines.append(str(PosMin1 + 1) + ',' + str(coverage[PosMin1]))
+    return lines
+
+  def ClippingCsv(self, MinReadCount=1):
+    '''The lines of FindClippingHotSpots.py's output: positions at which at
+    least MinReadCount reads are clipped, most clipped first.'''
+    ClippedPositions = (self.ClipCounts >= max(MinReadCount, 1)).nonzero()[0]
+    counts = self.ClipCounts[ClippedPositions]
+    order = np.lexsort((self.FirstClipEvents[ClippedPositions], -counts))
+    spanning = self.GetNumSpanningReads()
+    lines = ['Reference position, Number of reads clipped, Percentage of ' + \
+    'spanning reads clipped']
+    for pos, count in zip(ClippedPositions[order], counts[order]):
+      # 100% of reads overhanging the start or end of the reference are clipped.
+      if pos == 0 or pos == self.RefLength:
+        PercentageClipped = 100
+      else:
+        PercentageClipped = 100 * float(count) / (count + spanning[pos])
+      lines.append(str(pos + 1) + ',' + str(count) + ',%.3f' % PercentageClipped)
+    return lines
+
+  def MappedBasesByIdentityCsv(self):
+    '''The lines of FindNumMappedBases.py's output with --identity-binning: the
+    number of mapped bases in reads of at least each identity.'''
+    Min, BinWidth = self.IdentityBinning
+    CumulativeCounts = np.cumsum(self.NumMappedBasesByIdentityBin[::-1])[::-1]
+    lines = ['Minimum read identity, Number of mapped bases']
+    for i in range(self.NumIdentityBins):
+      lines.append(str(Min + i * BinWidth) + ',' + str(CumulativeCounts[i]))
+    return lines
+
+  def Summary(self):
+    '''A dict of summary statistics.'''
+    coverage = self.GetCoverage()
+    summary = collections.OrderedDict()
+    summary['ReferenceLength'] = self.RefLength
+    summary['NumMappedReads'] = self.NumMappedReads
+    summary['NumMappedBases'] = self.NumMappedBases
+    summary['NumPositionsCovered'] = int(np.count_nonzero(coverage))
+    summary['MeanCoverage'] = float(coverage.mean()) if self.RefLength else 0.
+    summary['MaxCoverage'] = int(coverage.max()) if self.RefLength else 0
+    summary['NumClippedEnds'] = int(self.ClipCounts.sum())
+    NumInserts = int(self.InsertSizeCounts.sum())
+    summary['NumPositiveInsertSizes'] = NumInserts
+    if NumInserts > 0:
+      InsertSizes = np.arange(len(self.InsertSizeCounts))
+      summary['MeanInsertSize'] = float((InsertSizes * \
+      self.InsertSizeCounts).sum() / NumInserts)
+      summary['MedianInsertSize'] = int(np.searchsorted(
+      np.cumsum(self.InsertSizeCounts), (NumInserts + 1) // 2))
+    if self.IdentityBinning is not None:
+      Min, BinWidth = self.IdentityBinning
+      summary['NumMappedBasesByMinIdentity'] = collections.OrderedDict(
+      (str(Min + _i * BinWidth), int(_count)) for _i, _count in enumerate(
+      np.cumsum(self.NumMappedBasesByIdentityBin[::-1])[::-1]))
+    return summary
+
+def ReadPairIsContaminant(read1Hit, read1Evalue, read2Hit, read2Evalue,
+RefName):
+  '''Decides whether a read pair is contamination, given the best hit of each
+  read (the name of the sequence it matched best) and the evalue of that hit
+  (smaller is better): it is if both reads hit something other than RefName, or
+  if one read hits RefName and its mate hits something else with a smaller
+  evalue. The evalues are only converted to floats (raising ValueError if they
+  can't be) when they need comparing.'''
+  read1HitsRef = read1Hit == RefName
+  read2HitsRef = read2Hit == RefName
+  if read1HitsRef and read2HitsRef:
+    return False
+  if not (read1HitsRef or read2HitsRef):
+    return True
+  if read1HitsRef:
+    RefEvalue, ContaminantEvalue = float(read1Evalue), float(read2Evalue)
+  else:
+    RefEvalue, ContaminantEvalue = float(read2Evalue), float(read1Evalue)
+  return ContaminantEvalue < RefEvalue
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import argparse
+import collections
+import json
+
+if __name__ == "__main__":
+
+  ## Overview:
+  ExplanatoryMessage = '''Summarises the records of resource use written by
+  RecordResourceUse.py (one json object per line): prints a table with one row
+  per step (i.e. per program and the context it was run in), giving the number
+  of times it was run, the total wall time, the total CPU time, the largest peak
+  memory and the total size of input and output files, ordered by decreasing
+  wall time. Steps run inside others (e.g. those run by shiver_map_reads.sh,
+  when shiver_map_reads.sh is itself recorded) are counted in both.'''
+
+  # Define a function to check files exist, as a type for the argparse.
+  def File(MyFile):
+    if not os.path.isfile(MyFile):
+      raise argparse.ArgumentTypeError(MyFile+' does not exist or is not a file.')
+    return MyFile
+
+  # Set up the arguments for this script
+  ExplanatoryMessage = ExplanatoryMessage.replace('\n', ' ').replace('  ', ' ')
+  parser = argparse.ArgumentParser(description=ExplanatoryMessage)
+  parser.add_argument('RecordFile', type=File)
+  parser.add_argument('-J', '--json-out', help='''Also write a json file
+  containing all the records and the summary per step.''')
+  args = parser.parse_args()
+
+  records = []
+  with open(args.RecordFile) as f:
+    for LineNumMin1, line in enumerate(f):
+      if not line.strip():
+        continue
+      try:
+        records.append(json.loads(line))
+      except ValueError:
+        print('Warning: could not understand line', LineNumMin1 + 1, 'of',
+        args.RecordFile, 'as json; skipping it.', file=sys.stderr)
+
+  steps = collections.OrderedDict()
+  for record in records:
+    key = (record['context'], record['step'])
+    if not key in steps:
+      steps[key] = collections.OrderedDict([('context', record['context']),
+      ('step', record['step']), ('calls', 0), ('failed_calls', 0),
+      ('wall_seconds', 0.), ('cpu_seconds', 0.), ('max_rss_kb', 0),
+      ('input_bytes', 0), ('output_bytes', 0)])
+    summary = steps[key]
+    summary['calls'] += 1
+    if record['exit_status'] != 0:
+      summary['failed_calls'] += 1
+    summary['wall_seconds'] += record['wall_seconds']
+    summary['cpu_seconds'] += record['user_seconds'] + \
+    record['system_seconds']
+    summary['max_rss_kb'] = max(summary['max_rss_kb'], record['max_rss_kb'])
+    summary['input_bytes'] += record['input_bytes']
+    summary['output_bytes'] += record['output_bytes']
+  SortedSteps = sorted(steps.values(), key=lambda s: -s['wall_seconds'])
+  for summary in SortedSteps:
+    summary['wall_seconds'] = round(summary['wall_seconds'], 3)
+    summary['cpu_seconds'] = round(summary['cpu_seconds'], 3)
+
+  if args.json_out is not None:
+    with open(args.json_out, 'w') as f:
+      json.dump(collections.OrderedDict([('steps', SortedSteps),
+      ('records', records)]), f, indent=2)
+      f.write('\n')
+
+  def MB(NumBytes):
+    return '%.1f' % (NumBytes / 1048576.)
+
+  header = ['Context', 'Step', 'Calls', 'Wall (s)', 'CPU (s)', 'Max RSS (MB)',
+  'Input (MB)', 'Output (MB)']
+  rows = [header] + [[s['context'], s['step'], str(s['calls']),
+  '%.1f' % s['wall_seconds'], '%.1f' % s['cpu_seconds'],
+  MB(s['max_rss_kb'] * 1024), MB(s['input_bytes']), MB(s['output_bytes'])]
+  for s in SortedSteps]
+  widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+  for row in rows:
+    print('  '.join(field.ljust(width) if i < 2 else field.rjust(width)
+    for i, (field, width) in enumerate(zip(row, widths))))